@@ -5,20 +5,45 @@ This module provides the application factory pattern for creating Flask app inst
 Routes are organized in separate blueprint modules in the routes package.
 """
 
+from typing import Dict, Optional
 from flask import Flask
+import database
+import metrics
 from database import init_database, add_sample_data
+from services import payment_service, search_cache, search_index
 from routes import register_blueprints
+from cli import register_commands
 
 
-def create_app():
+def create_app(config: Optional[Dict] = None):
     """
     Application factory function to create and configure Flask app.
     
+    Args:
+        config: Optional settings applied on top of the defaults
+            (e.g. DATABASE, DB_POOL_SIZE, SQLITE_PRAGMAS, PAYMENT_GATEWAY_URL, SEARCH_INDEX, SEARCH_CACHE)
+
     Returns:
         Flask: Configured Flask application instance
     """
     app = Flask(__name__)
     app.secret_key = "super secret key"
+    app.config['DB_POOL_SIZE'] = database.POOL_SIZE
+    app.config['SQLITE_PRAGMAS'] = {}  # overrides for database.DEFAULT_STORAGE_PROFILE
+    if config:
+        app.config.update(config)
+    
+    # Configure the connection pool and return connections after each request
+    database.init_app(app)
+    
+    # Create the payment gateway shared by all requests
+    payment_service.init_app(app)
+    
+    # Serve title/author searches from the in-memory index unless SEARCH_INDEX is off
+    search_index.init_app(app)
+    
+    # Reuse recent search results until the catalog changes (SEARCH_CACHE_* settings)
+    search_cache.init_app(app)
     
     # Initialize the database
     init_database()
@@ -26,9 +51,15 @@ def create_app():
     # Add sample data for testing and demonstration
     add_sample_data()
     
+    # Count and time every request for /metrics
+    metrics.init_app(app)
+    
     # Register all route blueprints
     register_blueprints(app)
     
+    # Register command line tasks (flask <command>)
+    register_commands(app)
+    
     return app
 
 
@@ -0,0 +1,6 @@
+"""
+Benchmarks and load tools for the Library Management System.
+
+These are run by hand (``python -m benchmarks.<name>``) and are not part
+of the test suite.
+"""
@@ -0,0 +1,232 @@
+"""
+Benchmark suite for the library service on a large synthetic library.
+
+Times search_books_in_catalog (exact, fuzzy and cached), search_books_page,
+suggest_search_terms, the search index build, get_catalog_display,
+get_patron_status_report, borrow_book_by_patron and return_book_by_patron
+against a library built by benchmarks.dataset, and compares each median with
+a saved baseline.
+
+The file is named bench_*.py so the regular test run does not collect it;
+run it explicitly:
+
+    pytest benchmarks/bench_library.py -q                         # 10k books
+    BENCH_SIZE=100k pytest benchmarks/bench_library.py -q
+    BENCH_SAVE_BASELINE=1 pytest benchmarks/bench_library.py -q   # record a new baseline
+
+Environment:
+    BENCH_SIZE           10k, 100k or 1m (default 10k)
+    BENCH_BASELINE_DIR   where bench_<size>.json baselines live (default benchmarks/baselines)
+    BENCH_THRESHOLD      allowed slowdown of a median before failing (default 0.25 = 25%)
+    BENCH_SAVE_BASELINE  1 to write this run's results as the new baseline
+
+Each run also writes its results to bench_<size>.last.json in BENCH_DATA_DIR
+(see benchmarks.dataset). Baselines are machine specific; record one on the
+machine that will do the comparing.
+"""
+
+import json
+import os
+import platform
+import statistics
+import time
+from datetime import datetime
+
+import pytest
+
+import database
+from benchmarks.dataset import SIZES, copy_library, dataset_path, ensure_library
+from services import search_cache
+from services.search_index import TrigramIndex
+from services.library_service import (
+    borrow_book_by_patron,
+    get_catalog_display,
+    get_patron_status_report,
+    return_book_by_patron,
+    search_books_in_catalog,
+    search_books_page,
+    suggest_search_terms
+)
+
+SIZE = os.environ.get('BENCH_SIZE', '10k').lower()
+BASELINE_DIR = os.environ.get('BENCH_BASELINE_DIR', os.path.join(os.path.dirname(__file__), 'baselines'))
+THRESHOLD = float(os.environ.get('BENCH_THRESHOLD', '0.25'))
+SAVE_BASELINE = os.environ.get('BENCH_SAVE_BASELINE') == '1'
+# Slowdowns smaller than this are timer noise, whatever the ratio
+MIN_REGRESSION_MS = 0.05
+
+if SIZE not in SIZES:
+    raise ValueError(f"BENCH_SIZE must be one of {', '.join(SIZES)}, not {SIZE!r}")
+
+
+def _baseline_path() -> str:
+    return os.path.join(BASELINE_DIR, f'bench_{SIZE}.json')
+
+
+@pytest.fixture(scope='module')
+def library(tmp_path_factory):
+    """A writable copy of the cached synthetic library, installed as the active database."""
+    path = str(tmp_path_factory.mktemp('bench') / f'library_{SIZE}.db')
+    copy_library(ensure_library(SIZE), path)
+    old_database = database.DATABASE
+    database.DATABASE = path
+    # Cached libraries may predate newer migrations
+    database.migrate_database()
+    # Time the searches themselves; test_search_cached measures the result cache
+    search_cache.ENABLED = False
+    conn = database.get_db_connection()
+    yield {
+        'conn': conn,
+        'author': conn.execute('SELECT author FROM books WHERE id = 1').fetchone()[0].split()[-1],
+        'title_word': conn.execute('SELECT title FROM books WHERE id = 2').fetchone()[0].split()[0],
+        'isbn': conn.execute('SELECT isbn FROM books WHERE id = 3').fetchone()[0],
+        'busiest_patron': conn.execute('''
+            SELECT patron_id FROM borrow_records WHERE return_date IS NULL
+            GROUP BY patron_id ORDER BY COUNT(*) DESC, patron_id LIMIT 1
+        ''').fetchone()[0],
+    }
+    search_cache.ENABLED = True
+    search_cache.search_cache.clear()
+    database.close_all_connections()
+    database.DATABASE = old_database
+
+
+@pytest.fixture(scope='module')
+def results():
+    """Collects every benchmark's timings and writes them out when the module is done."""
+    collected = {}
+    yield collected
+    report = {
+        'size': SIZE,
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'benchmarks': collected,
+    }
+    last_path = os.path.join(os.path.dirname(dataset_path(SIZE)), f'bench_{SIZE}.last.json')
+    paths = [last_path] + ([_baseline_path()] if SAVE_BASELINE else [])
+    for path in paths:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    if SAVE_BASELINE or not os.path.exists(_baseline_path()):
+        return {}
+    with open(_baseline_path()) as f:
+        return json.load(f)['benchmarks']
+
+
+@pytest.fixture
+def bench(results, baseline):
+    """
+    bench(name, func, *args, rounds=20, setup=None) times `rounds` calls after one warm-up.
+
+    setup(i), if given, runs untimed before call i and returns the call's args.
+    Fails if the median is more than BENCH_THRESHOLD slower than the baseline.
+    """
+    def run(name, func, *args, rounds=20, setup=None):
+        timings = []
+        for i in range(rounds + 1):
+            call_args = setup(i) if setup else args
+            start = time.perf_counter()
+            func(*call_args)
+            elapsed = time.perf_counter() - start
+            if i:
+                timings.append(elapsed * 1000)
+        timings.sort()
+        stats = {
+            'rounds': rounds,
+            'median_ms': round(statistics.median(timings), 4),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+            'min_ms': round(timings[0], 4),
+        }
+        results[name] = stats
+
+        previous = baseline.get(name)
+        if previous:
+            limit = previous['median_ms'] * (1 + THRESHOLD)
+            if stats['median_ms'] > limit and stats['median_ms'] - previous['median_ms'] > MIN_REGRESSION_MS:
+                pytest.fail(f"{name} regressed: median {stats['median_ms']:.3f} ms vs baseline "
+                            f"{previous['median_ms']:.3f} ms (threshold {THRESHOLD:.0%})")
+        return stats
+    return run
+
+
+def _rounds(small: int, large: int) -> int:
+    return small if SIZES[SIZE] < 1_000_000 else large
+
+## Search
+
+def test_search_title_common_substring(library, bench):
+    bench('search_title_common', search_books_in_catalog, 'mor', 'title', rounds=_rounds(20, 5))
+
+def test_search_title_word(library, bench):
+    bench('search_title_word', search_books_in_catalog, library['title_word'], 'title')
+
+def test_search_author(library, bench):
+    bench('search_author', search_books_in_catalog, library['author'], 'author')
+
+def test_search_short_term(library, bench):
+    bench('search_title_short', search_books_in_catalog, 'ka', 'title', rounds=_rounds(10, 3))
+
+def test_search_isbn(library, bench):
+    bench('search_isbn', search_books_in_catalog, library['isbn'], 'isbn', rounds=200)
+
+def test_search_page_broad(library, bench):
+    bench('search_page_broad', search_books_page, 'a', 'author', rounds=_rounds(20, 5))
+
+def test_search_cached(library, bench, monkeypatch):
+    monkeypatch.setattr(search_cache, 'ENABLED', True)
+    bench('search_title_cached', search_books_in_catalog, library['title_word'], 'title', rounds=200)
+
+def _typo(word):
+    """The word with its middle letter dropped."""
+    return word[:len(word) // 2] + word[len(word) // 2 + 1:]
+
+def test_search_author_fuzzy(library, bench):
+    bench('search_author_fuzzy', search_books_in_catalog, _typo(library['author']), 'author', True)
+
+def test_search_title_fuzzy(library, bench):
+    bench('search_title_fuzzy', search_books_in_catalog, _typo(library['title_word']), 'title', True,
+          rounds=_rounds(20, 5))
+
+def test_suggest_title(library, bench):
+    bench('suggest_title', suggest_search_terms, library['title_word'][:3], 'title', rounds=500)
+
+def test_suggest_author(library, bench):
+    bench('suggest_author', suggest_search_terms, library['author'][:2], 'author', rounds=500)
+
+def test_search_index_build(library, bench):
+    bench('search_index_build', lambda: TrigramIndex().sync(), rounds=_rounds(3, 1))
+
+## Catalog and patron status
+
+def test_catalog_display(library, bench):
+    bench('catalog_display', get_catalog_display, rounds=_rounds(5, 2))
+
+def test_patron_status_report(library, bench):
+    bench('patron_status_report', get_patron_status_report, library['busiest_patron'], rounds=100)
+
+## Borrow and return
+
+def _borrowable_books(conn, count):
+    return [row[0] for row in conn.execute(
+        'SELECT id FROM books WHERE available_copies > 1 ORDER BY id LIMIT ?', (count,))]
+
+def test_borrow_book(library, bench):
+    books = _borrowable_books(library['conn'], 101)
+    # A new patron each round so the 5-book limit never applies
+    bench('borrow_book', borrow_book_by_patron, rounds=100,
+          setup=lambda i: (f'{800000 + i}', books[i]))
+
+def test_return_book(library, bench):
+    books = _borrowable_books(library['conn'], 101)
+
+    def setup(i):
+        patron_id = f'{810000 + i}'
+        assert borrow_book_by_patron(patron_id, books[i])[0]
+        return patron_id, books[i]
+    bench('return_book', return_book_by_patron, rounds=100, setup=setup)
@@ -0,0 +1,209 @@
+"""
+Seeded generator for large synthetic libraries.
+
+Builds a library database with the real schema (init_database(), so every
+migration, index and the search index are present) holding `books` titles,
+about books / 5 patrons and a loan history of roughly two years:
+
+- titles and author names are made of pronounceable pseudo-words, so
+  substring search has realistic selectivity;
+- popularity is Zipf-like: a few books account for most loans;
+- most loans are returned (some late), and about a third of the patrons
+  have 1-5 books out now, some of them overdue. available_copies matches
+  the active loans.
+
+The same size and seed always produce the same library. Generated files are
+cached in BENCH_DATA_DIR (default: <tmp>/library-bench) and reused.
+
+Usage:
+    python -m benchmarks.dataset --size 100k [--seed 327] [--out library_100k.db]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+
+import database
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+DEFAULT_SEED = 327
+
+# Loans are dated relative to this fixed day, so a seed always yields the same rows
+HISTORY_END = datetime(2025, 6, 30, 12, 0)
+HISTORY_DAYS = 730
+LOANS_PER_BOOK = 3
+INSERT_CHUNK = 50_000
+
+_SYLLABLES = ('ka', 'lo', 'mi', 'ren', 'tor', 'va', 'shi', 'den', 'ar', 'bel', 'cor', 'dun',
+              'el', 'fin', 'gal', 'hal', 'is', 'jor', 'kel', 'lin', 'mor', 'nor', 'os', 'pel',
+              'qua', 'ril', 'sen', 'tal', 'ul', 'vin', 'wyn', 'zar')
+
+
+def _words(rng: random.Random, count: int, min_syllables: int = 1, max_syllables: int = 3) -> List[str]:
+    words = set()
+    while len(words) < count:
+        words.add(''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(min_syllables, max_syllables))))
+    return sorted(words)
+
+
+def dataset_path(size: str, seed: int = DEFAULT_SEED, data_dir: Optional[str] = None) -> str:
+    data_dir = data_dir or os.environ.get('BENCH_DATA_DIR') or os.path.join(tempfile.gettempdir(), 'library-bench')
+    return os.path.join(data_dir, f'library_{size}_seed{seed}.db')
+
+
+def _chunks(rows: Iterator[tuple], size: int = INSERT_CHUNK) -> Iterator[List[tuple]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate_library(path: str, books: int, seed: int = DEFAULT_SEED,
+                     loans_per_book: int = LOANS_PER_BOOK) -> Dict:
+    """
+    Build a synthetic library database at `path` (replacing any existing file).
+
+    Returns:
+        dict: books, patrons, loans, active_loans, overdue_loans and seconds
+    """
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    vocabulary = [w.capitalize() for w in _words(rng, 3000)]
+    first_names = [w.capitalize() for w in _words(rng, 400, 2, 2)]
+    last_names = [w.capitalize() for w in _words(rng, 1500, 2, 3)]
+    authors = [f'{rng.choice(first_names)} {rng.choice(last_names)}' for _ in range(max(50, books // 20))]
+    patrons = [f'{100000 + i}' for i in range(max(100, books // 5))]
+
+    copies = [rng.choice((1, 1, 1, 2, 2, 3, 5)) for _ in range(books)]
+    available = list(copies)
+    # Zipf-like popularity over a shuffled rank order
+    ranked = list(range(1, books + 1))
+    rng.shuffle(ranked)
+    cum_weights, running = [], 0.0
+    for rank in range(1, books + 1):
+        running += 1.0 / rank ** 0.8
+        cum_weights.append(running)
+
+    def pick_books(k: int) -> List[int]:
+        return [ranked[i] - 1 for i in rng.choices(range(books), cum_weights=cum_weights, k=k)]
+
+    old_database = database.DATABASE
+    database.DATABASE = path
+    try:
+        database.init_database()
+        conn = database.get_db_connection()
+
+        def book_rows():
+            for i in range(books):
+                title = ' '.join(rng.choice(vocabulary) for _ in range(rng.choice((1, 2, 2, 3, 3, 4, 5))))
+                yield (title, rng.choice(authors), f'978{i:010d}', copies[i], copies[i])
+
+        with database.transaction() as tx:
+            for chunk in _chunks(book_rows()):
+                tx.executemany('''
+                    INSERT INTO books (title, author, isbn, total_copies, available_copies)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', chunk)
+
+        history = books * loans_per_book
+
+        def history_rows():
+            for chunk_start in range(0, history, INSERT_CHUNK):
+                count = min(INSERT_CHUNK, history - chunk_start)
+                for book_index in pick_books(count):
+                    borrowed = HISTORY_END - timedelta(days=rng.uniform(45, HISTORY_DAYS))
+                    due = borrowed + timedelta(days=14)
+                    # ~80% back on time, the rest up to a month late
+                    returned = borrowed + timedelta(days=rng.uniform(1, 14) if rng.random() < 0.8
+                                                    else rng.uniform(15, 45))
+                    yield (rng.choice(patrons), book_index + 1, borrowed.isoformat(),
+                           due.isoformat(), returned.isoformat())
+
+        active, overdue = [], 0
+        for patron_id in patrons:
+            if rng.random() >= 0.33:
+                continue
+            for book_index in pick_books(rng.randint(1, 5)):
+                if available[book_index] == 0:
+                    continue
+                available[book_index] -= 1
+                borrowed = HISTORY_END - timedelta(days=rng.uniform(0, 40))
+                due = borrowed + timedelta(days=14)
+                overdue += due < HISTORY_END
+                active.append((patron_id, book_index + 1, borrowed.isoformat(), due.isoformat(), None))
+
+        with database.transaction() as tx:
+            for chunk in _chunks(history_rows()):
+                tx.executemany('''
+                    INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', chunk)
+            tx.executemany('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date, return_date)
+                VALUES (?, ?, ?, ?, ?)
+            ''', active)
+            tx.executemany('UPDATE books SET available_copies = ? WHERE id = ?',
+                           [(count, i + 1) for i, count in enumerate(available) if count != copies[i]])
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    finally:
+        database.close_all_connections()
+        database.DATABASE = old_database
+
+    return {
+        'books': books,
+        'patrons': len(patrons),
+        'loans': history + len(active),
+        'active_loans': len(active),
+        'overdue_loans': overdue,
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+def ensure_library(size: str, seed: int = DEFAULT_SEED, data_dir: Optional[str] = None) -> str:
+    """Path of the cached library for `size` and `seed`, generating it on first use."""
+    path = dataset_path(size, seed, data_dir)
+    if not os.path.exists(path):
+        tmp_path = path + '.partial'
+        generate_library(tmp_path, SIZES[size], seed)
+        os.replace(tmp_path, path)
+    return path
+
+
+def copy_library(source: str, target: str):
+    """Copy a generated library so a benchmark can write to it."""
+    for suffix in ('-wal', '-shm'):
+        if os.path.exists(target + suffix):
+            os.remove(target + suffix)
+    shutil.copyfile(source, target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a seeded synthetic library database.')
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--out', help='output file (default: the benchmark cache)')
+    args = parser.parse_args()
+
+    path = args.out or dataset_path(args.size, args.seed)
+    summary = generate_library(path, SIZES[args.size], args.seed)
+    print(f"{path}: {summary['books']} books, {summary['patrons']} patrons, {summary['loans']} loans "
+          f"({summary['active_loans']} active, {summary['overdue_loans']} overdue) in {summary['seconds']}s")
+
+
+if __name__ == '__main__':
+    main()
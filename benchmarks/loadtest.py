@@ -0,0 +1,240 @@
+"""
+HTTP load test for the Flask app.
+
+Serves create_app() with Werkzeug's threaded WSGI server in a child process
+(so the client threads do not compete with it for the GIL) on a copy of a
+synthetic library (benchmarks.dataset). The payment gateway points at a
+local StandInPaymentServer with tunable latency. Worker threads drive the
+app with a weighted mix of requests:
+
+    catalog   GET  /catalog
+    search    GET  /search?q=<word>&type=title|author
+    borrow    POST /borrow
+    return    POST /return
+    late_fee  GET  /api/late_fee/<patron>/<book>
+
+Reports throughput, latency percentiles and error rate per route, and can
+save them as JSON and compare against an earlier run:
+
+    python -m benchmarks.loadtest --seconds 20 --workers 16 --out run.json
+    python -m benchmarks.loadtest --mix catalog=1,search=1 --gateway-latency 0.2 --compare run.json
+
+A response is an error if the request fails or its status is 5xx, or 4xx
+for the catalog and search pages. Borrows of unavailable books and returns
+of books that are not on loan are normal business outcomes and are not
+counted as errors.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from werkzeug.serving import make_server
+
+from benchmarks.dataset import SIZES, copy_library, ensure_library
+from benchmarks.payment_standin import StandInPaymentServer
+
+DEFAULT_MIX = {'catalog': 25, 'search': 30, 'borrow': 15, 'return': 15, 'late_fee': 10}
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """'catalog=3,search=1' -> {'catalog': 3.0, 'search': 1.0}"""
+    mix = {}
+    for part in text.split(','):
+        route, _, weight = part.partition('=')
+        route = route.strip()
+        if route not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown route '{route}' (choose from {', '.join(DEFAULT_MIX)})")
+        try:
+            mix[route] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"weight for '{route}' must be a number") from None
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError('at least one route needs a positive weight')
+    return mix
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] if ordered else 0.0
+
+
+class Workload:
+    """Picks the next request from the mix, using ids that exist in the library."""
+
+    def __init__(self, conn, mix: Dict[str, float], seed: int):
+        self.routes = [route for route, weight in mix.items() if weight > 0]
+        self.weights = [mix[route] for route in self.routes]
+        self.max_book_id = conn.execute('SELECT MAX(id) FROM books').fetchone()[0]
+        self.patrons = [row[0] for row in conn.execute('SELECT DISTINCT patron_id FROM borrow_records')]
+        self.loans = [tuple(row) for row in conn.execute(
+            'SELECT patron_id, book_id FROM borrow_records WHERE return_date IS NULL')]
+        self.words = sorted({word for (title,) in conn.execute('SELECT title FROM books LIMIT 2000')
+                             for word in title.split()})
+        self.authors = [row[0].split()[-1] for row in conn.execute('SELECT author FROM books LIMIT 500')]
+        self.seed = seed
+
+    def requester(self, worker: int):
+        rng = random.Random(self.seed + worker)
+
+        def next_request() -> Tuple[str, str, str, Optional[Dict]]:
+            route = rng.choices(self.routes, self.weights)[0]
+            patron_id, book_id = rng.choice(self.loans) if self.loans else ('100000', 1)
+            if route == 'catalog':
+                return route, 'GET', '/catalog', None
+            if route == 'search':
+                if rng.random() < 0.7:
+                    return route, 'GET', f'/search?q={rng.choice(self.words)}&type=title', None
+                return route, 'GET', f'/search?q={rng.choice(self.authors)}&type=author', None
+            if route == 'borrow':
+                return route, 'POST', '/borrow', {'patron_id': rng.choice(self.patrons),
+                                                  'book_id': rng.randint(1, self.max_book_id)}
+            if route == 'return':
+                return route, 'POST', '/return', {'patron_id': patron_id, 'book_id': book_id}
+            return route, 'GET', f'/api/late_fee/{patron_id}/{book_id}', None
+        return next_request
+
+
+def is_error(route: str, status: int) -> bool:
+    if status >= 500:
+        return True
+    return route in ('catalog', 'search', 'late_fee') and status >= 400
+
+
+def run_load(base_url: str, workload: Workload, workers: int, seconds: float,
+             timeout: float = 30.0) -> Dict[str, Dict]:
+    samples: Dict[str, List[float]] = {route: [] for route in workload.routes}
+    errors: Dict[str, int] = {route: 0 for route in workload.routes}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(index: int):
+        session = requests.Session()
+        next_request = workload.requester(index)
+        local: Dict[str, List[Tuple[float, bool]]] = {route: [] for route in workload.routes}
+        while time.monotonic() < deadline:
+            route, method, path, form = next_request()
+            start = time.perf_counter()
+            try:
+                response = session.request(method, base_url + path, data=form, timeout=timeout,
+                                            allow_redirects=False)
+                failed = is_error(route, response.status_code)
+            except requests.RequestException:
+                failed = True
+            local[route].append(((time.perf_counter() - start) * 1000, failed))
+        session.close()
+        with lock:
+            for route, results in local.items():
+                samples[route].extend(ms for ms, _ in results)
+                errors[route] += sum(failed for _, failed in results)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for route in workload.routes + ['all']:
+        timings = sorted(samples[route] if route != 'all' else [ms for ms_list in samples.values() for ms in ms_list])
+        failed = errors[route] if route != 'all' else sum(errors.values())
+        report[route] = {
+            'requests': len(timings),
+            'errors': failed,
+            'error_rate': round(failed / len(timings), 4) if timings else 0.0,
+            'throughput_rps': round(len(timings) / elapsed, 2),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p90_ms': round(percentile(timings, 90), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'max_ms': round(timings[-1], 3) if timings else 0.0,
+        }
+    return report
+
+
+def print_report(report: Dict[str, Dict], previous: Optional[Dict[str, Dict]] = None):
+    print(f"{'route':>10} {'reqs':>8} {'rps':>9} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'errors':>8}")
+    for route, stats in report.items():
+        print(f"{route:>10} {stats['requests']:>8} {stats['throughput_rps']:>9.1f} {stats['p50_ms']:>9.2f} "
+              f"{stats['p90_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['error_rate']:>8.2%}")
+        old = (previous or {}).get(route)
+        if old:
+            def change(key):
+                return f"{(stats[key] - old[key]) / old[key]:+.0%}" if old[key] else 'n/a'
+            print(f"{'vs prev':>10} {'':>8} {change('throughput_rps'):>9} {change('p50_ms'):>9} "
+                  f"{change('p90_ms'):>9} {change('p99_ms'):>9}")
+
+
+def _serve(database_path: str, gateway_url: str, ready):
+    """Child process: serve the app on a free port and report the port through `ready`."""
+    from app import create_app
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = create_app({'DATABASE': database_path, 'PAYMENT_GATEWAY_URL': gateway_url})
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    ready.put(server.server_port)
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the library app over HTTP.')
+    parser.add_argument('--size', choices=sorted(SIZES), default='10k', help='synthetic library size')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--workers', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='route weights, e.g. catalog=25,search=30,borrow=15 (default: %(default)s)')
+    parser.add_argument('--gateway-latency', type=float, default=0.05,
+                        help='payment stand-in delay per request (s)')
+    parser.add_argument('--seed', type=int, default=327)
+    parser.add_argument('--out', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare with')
+    args = parser.parse_args()
+
+    standin = StandInPaymentServer(latency=args.gateway_latency).start()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'library.db')
+        copy_library(ensure_library(args.size), path)
+        conn = sqlite3.connect(path)
+        workload = Workload(conn, args.mix, args.seed)
+        conn.close()
+
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(target=_serve, args=(path, standin.url, ready), daemon=True)
+        server.start()
+        try:
+            port = ready.get(timeout=60)
+            report = run_load(f'http://127.0.0.1:{port}', workload, args.workers, args.seconds)
+        finally:
+            server.terminate()
+            server.join()
+            standin.stop()
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['routes']
+    print_report(report, previous)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump({
+                'recorded_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'settings': {'size': args.size, 'seconds': args.seconds, 'workers': args.workers,
+                             'mix': args.mix, 'gateway_latency': args.gateway_latency, 'seed': args.seed},
+                'routes': report,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
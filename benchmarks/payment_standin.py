@@ -0,0 +1,187 @@
+"""
+Local stand-in for the payment provider's HTTP API.
+
+Implements the endpoints HttpPaymentGateway calls (POST /charges,
+POST /refunds, GET /charges/<id>, GET /charges?idempotency_key=<key>) with
+a configurable delay, and counts TCP connections so connection reuse can be
+observed. A charge repeated with the same Idempotency-Key header returns
+the original charge instead of making a new one.
+
+Run directly to compare per-charge latency of a new connection per
+charge against the pooled, keep-alive gateway:
+
+    python -m benchmarks.payment_standin [--charges 200] [--latency 0.005]
+"""
+
+import argparse
+import json
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from services.payment_service import HttpPaymentGateway
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes; don't let Nagle hold the body
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return {}
+
+    def do_POST(self):
+        body = self._read_json()
+        self.server.simulate_latency()
+
+        if self.path == '/charges':
+            key = self.headers.get('Idempotency-Key')
+            with self.server.lock:
+                existing = self.server.charges_by_key.get(key) if key else None
+            if existing is not None:
+                return self._send(200, existing)
+            customer, amount = str(body.get('customer_id', '')), body.get('amount', 0)
+            if not isinstance(amount, (int, float)) or amount <= 0:
+                return self._send(402, {'error': 'Invalid amount: must be greater than 0'})
+            if amount > 1000:
+                return self._send(402, {'error': 'Payment declined: amount exceeds limit'})
+            if len(customer) != 6:
+                return self._send(402, {'error': 'Invalid patron ID format'})
+            charge = {
+                'id': f'txn_{customer}_{uuid.uuid4().hex[:12]}',
+                'status': 'completed',
+                'amount': amount,
+                'timestamp': time.time(),
+            }
+            with self.server.lock:
+                self.server.charges[charge['id']] = charge
+                if key:
+                    self.server.charges_by_key[key] = charge
+            return self._send(200, charge)
+
+        if self.path == '/refunds':
+            charge_id, amount = body.get('charge', ''), body.get('amount', 0)
+            with self.server.lock:
+                charge = self.server.charges.get(charge_id)
+            if charge is None:
+                return self._send(404, {'error': 'Invalid transaction ID'})
+            if not isinstance(amount, (int, float)) or amount <= 0 or amount > charge['amount']:
+                return self._send(400, {'error': 'Invalid refund amount'})
+            return self._send(200, {'id': f'refund_{charge_id}', 'amount': amount})
+
+        self._send(404, {'error': 'Not found'})
+
+    def do_GET(self):
+        self.server.simulate_latency()
+        path, _, query = self.path.partition('?')
+        if path == '/charges':
+            key = parse_qs(query).get('idempotency_key', [''])[0]
+            with self.server.lock:
+                charge = self.server.charges_by_key.get(key)
+            if charge is not None:
+                return self._send(200, dict(charge, transaction_id=charge['id']))
+        elif self.path.startswith('/charges/'):
+            with self.server.lock:
+                charge = self.server.charges.get(self.path[len('/charges/'):])
+            if charge is not None:
+                return self._send(200, dict(charge, transaction_id=charge['id']))
+        self._send(404, {'error': 'Transaction not found'})
+
+
+class StandInPaymentServer(ThreadingHTTPServer):
+    """Threaded HTTP server playing the payment provider."""
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0):
+        super().__init__((host, port), _Handler)
+        self.latency = latency
+        self.connections = 0
+        self.charges = {}
+        self.charges_by_key = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def simulate_latency(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def start(self) -> 'StandInPaymentServer':
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def _percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def _measure(label, charge, n):
+    latencies = []
+    for _ in range(n):
+        start = time.perf_counter()
+        charge()
+        latencies.append(time.perf_counter() - start)
+    print(f'{label:>28}: p50 {_percentile(latencies, 50) * 1000:7.3f} ms   '
+          f'p99 {_percentile(latencies, 99) * 1000:7.3f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure per-charge latency against a local stand-in.')
+    parser.add_argument('--charges', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='server-side delay per request (s)')
+    args = parser.parse_args()
+
+    server = StandInPaymentServer(latency=args.latency).start()
+    try:
+        payload = {'customer_id': '123456', 'amount': 5.0, 'currency': 'usd'}
+        before = server.connections
+        _measure('new connection per charge',
+                 lambda: requests.post(f'{server.url}/charges', json=payload, timeout=10), args.charges)
+        print(f'{"":>28}  {server.connections - before} connection(s)')
+
+        gateway = HttpPaymentGateway(base_url=server.url)
+        before = server.connections
+        _measure('pooled keep-alive gateway',
+                 lambda: gateway.process_payment('123456', 5.0, 'Late fees'), args.charges)
+        print(f'{"":>28}  {server.connections - before} connection(s)')
+        gateway.close()
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
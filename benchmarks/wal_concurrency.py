@@ -0,0 +1,149 @@
+"""
+Read/write concurrency benchmark for the SQLite storage profile.
+
+Catalog readers run against a writer that keeps borrowing and returning
+books, once with SQLite's defaults (rollback journal, synchronous=FULL)
+and once with database.DEFAULT_STORAGE_PROFILE (WAL).
+
+Usage:
+    python -m benchmarks.wal_concurrency [--books 2000] [--readers 4] [--seconds 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import database
+
+PROFILES = {
+    'rollback-journal': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'mmap_size': 0,
+        'cache_size': -2000,
+        'temp_store': 'DEFAULT',
+        'busy_timeout': 5000,
+    },
+    'wal': dict(database.DEFAULT_STORAGE_PROFILE),
+}
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def seed(n_books):
+    conn = database.get_db_connection()
+    conn.executemany('''
+        INSERT INTO books (title, author, isbn, total_copies, available_copies)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ((f'Title {i:06d}', f'Author {i % 500}', f'{9780000000000 + i}', 3, 3)
+          for i in range(n_books)))
+    conn.commit()
+
+
+def run_profile(name, profile, n_books, n_readers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        original = database.DATABASE
+        database.DATABASE = os.path.join(tmp, 'bench.db')
+        database.configure_storage(profile)
+        try:
+            database.init_database()
+            seed(n_books)
+            database.close_db()
+
+            stop = threading.Event()
+            read_latencies, write_latencies = [], []
+            errors = {'read': 0, 'write': 0}
+            lock = threading.Lock()
+
+            def reader():
+                rng = random.Random()
+                local = []
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        database.get_book_by_id(rng.randint(1, n_books))
+                        database.get_patron_borrow_count('100000')
+                    except sqlite3.OperationalError:
+                        with lock:
+                            errors['read'] += 1
+                        continue
+                    local.append(time.perf_counter() - start)
+                database.close_db()
+                with lock:
+                    read_latencies.extend(local)
+
+            def writer():
+                rng = random.Random(1)
+                while not stop.is_set():
+                    book_id = rng.randint(1, n_books)
+                    now = datetime.now()
+                    start = time.perf_counter()
+                    status, _ = database.borrow_book_record('100000', book_id, now,
+                                                            now + timedelta(days=14), 5)
+                    if status == 'ok':
+                        status, _, _ = database.return_book_record('100000', book_id, now)
+                    if status == 'error':
+                        errors['write'] += 1
+                    else:
+                        write_latencies.append(time.perf_counter() - start)
+                database.close_db()
+
+            threads = [threading.Thread(target=reader) for _ in range(n_readers)]
+            threads.append(threading.Thread(target=writer))
+            for t in threads:
+                t.start()
+            time.sleep(seconds)
+            stop.set()
+            for t in threads:
+                t.join()
+        finally:
+            database.close_all_connections()
+            database.DATABASE = original
+            database.configure_storage()
+
+    return {
+        'profile': name,
+        'reads_per_sec': round(len(read_latencies) / seconds, 1),
+        'writes_per_sec': round(len(write_latencies) / seconds, 1),
+        'read_p50_ms': round(percentile(read_latencies, 50) * 1000, 3),
+        'read_p99_ms': round(percentile(read_latencies, 99) * 1000, 3),
+        'write_p50_ms': round(percentile(write_latencies, 50) * 1000, 3),
+        'read_errors': errors['read'],
+        'write_errors': errors['write'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--json', help='write results to this file')
+    args = parser.parse_args()
+
+    results = [run_profile(name, profile, args.books, args.readers, args.seconds)
+               for name, profile in PROFILES.items()]
+
+    columns = list(results[0].keys())
+    print('  '.join(f'{c:>16}' for c in columns))
+    for row in results:
+        print('  '.join(f'{row[c]!s:>16}' for c in columns))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+Command line tasks for the Library Management System.
+
+Commands are registered on the Flask CLI by the application factory, e.g.:
+
+    flask --app app:create_app fee-batch --date 2025-01-31
+    flask --app app:create_app import-books feed.csv
+"""
+
+import os
+import click
+from services.library_service import IMPORT_BATCH_SIZE, IMPORT_FORMATS, import_books, run_fee_batch
+
+
+def register_commands(app):
+    """Register all CLI commands with the Flask app."""
+    app.cli.add_command(fee_batch_command)
+    app.cli.add_command(import_books_command)
+
+
+@click.command('fee-batch')
+@click.option('--date', 'as_of', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Date to assess fees on (default: today).')
+def fee_batch_command(as_of):
+    """Snapshot the outstanding late fees of every patron."""
+    result = run_fee_batch(as_of)
+    click.echo(f"{result['snapshot_date']}: {result['num_patrons']} patron(s) owe "
+               f"${result['total_late_fees']:.2f} in late fees.")
+
+
+@click.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+              help='File format (default: from the file extension).')
+@click.option('--batch-size', type=click.IntRange(min=1), default=IMPORT_BATCH_SIZE, show_default=True,
+              help='Books inserted per transaction.')
+def import_books_command(path, fmt, batch_size):
+    """Bulk add books from a CSV or JSONL file."""
+    if fmt is None:
+        fmt = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.ndjson') else 'csv'
+    with open(path, encoding='utf-8', errors='surrogateescape', newline='') as stream:
+        result = import_books(stream, fmt, batch_size)
+    for error in result['errors']:
+        click.echo(f"line {error['line']}: {error['error']}", err=True)
+    if result['errors_truncated']:
+        click.echo(f"... {result['failed'] - len(result['errors'])} more error(s)", err=True)
+    click.echo(f"Imported {result['imported']} of {result['rows']} row(s); {result['failed']} failed.")
@@ -3,18 +3,374 @@ Database module for Library Management System
 Handles all database operations and connections
 """
 
+import json
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from cache import LRUCache
+from query_stats import InstrumentedConnection, QueryLog
 
 # Database configuration
 DATABASE = 'library.db'
+POOL_SIZE = 5  # idle connections kept open per database file
+
+# SQLite storage profile applied to every new connection
+DEFAULT_STORAGE_PROFILE = {
+    'journal_mode': 'WAL',        # readers don't block on a committing writer
+    'synchronous': 'NORMAL',      # fsync at checkpoints only (safe with WAL)
+    'mmap_size': 268435456,       # 256 MiB of the file read through mmap
+    'cache_size': -65536,         # negative = KiB, so 64 MiB page cache
+    'temp_store': 'MEMORY',
+    'busy_timeout': 5000,         # ms to wait for a lock before SQLITE_BUSY
+}
+STORAGE_PROFILE = dict(DEFAULT_STORAGE_PROFILE)
+
+# Rows fetched per cursor round trip by the streaming export iterators
+EXPORT_BATCH_SIZE = 1000
+
+# Read-through cache of book rows, keyed ('id', DATABASE, book_id) -> row and
+# ('isbn', DATABASE, isbn) -> book_id, so switching DATABASE never serves
+# another file's rows. Every write to books must call invalidate_book().
+BOOK_CACHE_SIZE = 10000
+BOOK_CACHE_TTL = 300.0  # seconds
+book_cache = LRUCache(BOOK_CACHE_SIZE, BOOK_CACHE_TTL)
+
+# Bumped after every write to books made through this module, so caches of
+# anything derived from the catalog can tell when it changed. Only counts
+# this process's writes.
+catalog_version = 0
+_catalog_version_lock = threading.Lock()
+
+# Schema migrations, applied in order by init_database(). PRAGMA user_version
+# records how many have run, so each one executes once per database file.
+MIGRATIONS = [
+    # 1: indexes for active-loan and per-book lookups on borrow_records
+    [
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_active_patron
+           ON borrow_records (patron_id, borrow_date) WHERE return_date IS NULL''',
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_active_loan
+           ON borrow_records (patron_id, book_id) WHERE return_date IS NULL''',
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_book
+           ON borrow_records (book_id, borrow_date)''',
+    ],
+    # 2: full-text index over title/author, kept in sync with books by triggers.
+    # The trigram tokenizer matches case-insensitive substrings of 3+ characters.
+    [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(
+               title, author, content='books', content_rowid='id', tokenize='trigram'
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+               INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+               INSERT INTO books_fts (books_fts, rowid, title, author)
+               VALUES ('delete', old.id, old.title, old.author);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE OF title, author ON books BEGIN
+               INSERT INTO books_fts (books_fts, rowid, title, author)
+               VALUES ('delete', old.id, old.title, old.author);
+               INSERT INTO books_fts (rowid, title, author) VALUES (new.id, new.title, new.author);
+           END''',
+        "INSERT INTO books_fts (books_fts) VALUES ('rebuild')",
+    ],
+    # 3: catalog order, so keyset pages on (title, id) are index range scans
+    [
+        'CREATE INDEX IF NOT EXISTS idx_books_title ON books (title, id)',
+    ],
+    # 4: per-patron late fee totals written by the nightly fee batch
+    [
+        '''CREATE TABLE IF NOT EXISTS fee_snapshots (
+               snapshot_date TEXT NOT NULL,
+               patron_id TEXT NOT NULL,
+               overdue_loans INTEGER NOT NULL,
+               total_fee REAL NOT NULL,
+               PRIMARY KEY (snapshot_date, patron_id)
+           )''',
+        '''CREATE INDEX IF NOT EXISTS idx_borrow_records_active_due
+           ON borrow_records (due_date) WHERE return_date IS NULL''',
+    ],
+    # 5: late fee payment ledger, one row per idempotency key (see claim_payment())
+    [
+        '''CREATE TABLE IF NOT EXISTS payments (
+               idempotency_key TEXT PRIMARY KEY,
+               patron_id TEXT NOT NULL,
+               book_id INTEGER NOT NULL,
+               loan_id INTEGER,
+               amount REAL NOT NULL,
+               status TEXT NOT NULL,
+               transaction_id TEXT,
+               message TEXT,
+               created_at TEXT NOT NULL,
+               updated_at TEXT NOT NULL
+           )''',
+    ],
+    # 6: borrow_date range scans for loan history exports
+    [
+        'CREATE INDEX IF NOT EXISTS idx_borrow_records_borrow_date ON borrow_records (borrow_date)',
+    ],
+    # 7: log of title/author edits and deletes, so in-memory search indexes
+    # (services.search_index) can catch up with writes from any connection
+    [
+        '''CREATE TABLE IF NOT EXISTS book_edits (
+               seq INTEGER PRIMARY KEY AUTOINCREMENT,
+               book_id INTEGER NOT NULL,
+               old_title TEXT NOT NULL,
+               old_author TEXT NOT NULL
+           )''',
+        '''CREATE TRIGGER IF NOT EXISTS book_edits_update AFTER UPDATE OF title, author ON books BEGIN
+               INSERT INTO book_edits (book_id, old_title, old_author) VALUES (old.id, old.title, old.author);
+           END''',
+        '''CREATE TRIGGER IF NOT EXISTS book_edits_delete AFTER DELETE ON books BEGIN
+               INSERT INTO book_edits (book_id, old_title, old_author) VALUES (old.id, old.title, old.author);
+           END''',
+    ],
+    # 8: a loan's late fee may be paid in several ledger entries as it grows
+    [
+        'CREATE INDEX IF NOT EXISTS idx_payments_loan ON payments (loan_id)',
+    ],
+]
+
+# Per-statement timing, off unless configure_query_log() turns it on
+query_log: Optional[QueryLog] = None
+
+# Shortest term the trigram index can answer; shorter terms fall back to a scan
+FTS_MIN_TERM_LENGTH = 3
+
+
+def _unicode_lower(text: Optional[str]) -> Optional[str]:
+    """SQL unicode_lower(): Python's lower(), which unlike SQLite's also folds non-ASCII letters."""
+    return text.lower() if isinstance(text, str) else text
+
+
+class ConnectionPool:
+    """
+    Pool of SQLite connections for a single database file.
+
+    Each thread gets its own connection, which it keeps reusing until
+    release() is called (at the end of a Flask app context, for example).
+    Released connections are kept for the next thread, up to `size` of them.
+    """
+
+    def __init__(self, database: str, size: int = POOL_SIZE, pragmas: Optional[Dict] = None,
+                 log: Optional[QueryLog] = None):
+        self.database = database
+        self.size = size
+        self.pragmas = dict(STORAGE_PROFILE if pragmas is None else pragmas)
+        self.log = log
+        self._idle: List[sqlite3.Connection] = []
+        self._open: set = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.log is not None:
+            conn = sqlite3.connect(self.database, check_same_thread=False, factory=InstrumentedConnection)
+            conn.query_log = self.log
+        else:
+            conn = sqlite3.connect(self.database, check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # This enables column access by name
+        conn.create_function('unicode_lower', 1, _unicode_lower, deterministic=True)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        with self._lock:
+            self._open.add(conn)
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._open.discard(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def acquire(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, checking one out if needed."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                conn = self._connect()
+                break
+            if self._is_healthy(conn):
+                break
+            self._discard(conn)
+
+        self._local.conn = conn
+        return conn
+
+    def release(self):
+        """Hand the calling thread's connection back to the pool."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size and conn in self._open:
+                self._idle.append(conn)
+                return
+        self._discard(conn)
+
+    def resize(self, size: int):
+        """Change how many idle connections are kept, closing any extras."""
+        with self._lock:
+            self.size = size
+            extra = self._idle[size:]
+            del self._idle[size:]
+        for conn in extra:
+            self._discard(conn)
+
+    def close(self):
+        """Close every connection this pool has opened."""
+        with self._lock:
+            conns = list(self._open)
+            self._open.clear()
+            self._idle.clear()
+        self._local.conn = None
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'open': len(self._open), 'idle': len(self._idle), 'size': self.size}
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Get the connection pool for the currently configured DATABASE."""
+    pool = _pools.get(DATABASE)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(DATABASE)
+            if pool is None:
+                pool = _pools[DATABASE] = ConnectionPool(DATABASE, POOL_SIZE, STORAGE_PROFILE, query_log)
+    return pool
 
 def get_db_connection():
-    """Get a database connection."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row  # This enables column access by name
-    return conn
+    """Get the pooled database connection for the current thread."""
+    return get_pool().acquire()
+
+def close_db(exception=None):
+    """Release the current thread's connection back to the pool."""
+    pool = _pools.get(DATABASE)
+    if pool is not None:
+        pool.release()
+
+def close_all_connections():
+    """Close every pooled connection (e.g. before the database file is removed)."""
+    # The file may be replaced, so nothing cached from it can be trusted
+    bump_catalog_version()
+    book_cache.clear()
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+def configure_pool(size: int):
+    """Set the number of idle connections kept per database."""
+    global POOL_SIZE
+    POOL_SIZE = size
+    for pool in list(_pools.values()):
+        pool.resize(size)
+
+def configure_storage(profile: Optional[Dict] = None):
+    """
+    Set the SQLite pragmas applied to new connections.
+
+    Args:
+        profile: Pragma overrides merged over DEFAULT_STORAGE_PROFILE.
+            Values must be integers or bare keywords (e.g. 'WAL', 'NORMAL').
+    """
+    merged = dict(DEFAULT_STORAGE_PROFILE)
+    merged.update(profile or {})
+    for name, value in merged.items():
+        if name not in DEFAULT_STORAGE_PROFILE:
+            raise ValueError(f"Unsupported SQLite pragma: {name}")
+        if not (isinstance(value, int) or str(value).isalpha()):
+            raise ValueError(f"Invalid value for pragma {name}: {value!r}")
+
+    STORAGE_PROFILE.clear()
+    STORAGE_PROFILE.update(merged)
+    # Existing connections were opened with the old settings
+    close_all_connections()
+
+def configure_query_log(enabled: bool, capacity: int = 10000, slow_threshold_ms: float = 100.0):
+    """
+    Turn per-statement timing on or off for new connections.
+
+    When enabled, every statement run on a pooled connection is timed and
+    kept in a ring buffer of `capacity` entries; statements slower than
+    slow_threshold_ms are logged as warnings.
+    """
+    global query_log
+    query_log = QueryLog(capacity, slow_threshold_ms / 1000) if enabled else None
+    # Existing connections were opened with the other connection class
+    close_all_connections()
+
+def get_query_stats(recent: int = 20) -> Dict:
+    """Aggregated statement timings (p50/p95/p99 by statement and caller) if timing is on."""
+    if query_log is None:
+        return {'enabled': False}
+    return dict(query_log.stats(recent), enabled=True)
+
+@contextmanager
+def transaction(immediate: bool = True):
+    """
+    Run a block of statements as one transaction on the pooled connection.
+
+    BEGIN IMMEDIATE takes the write lock up front, so reads made inside the
+    block cannot be invalidated by another writer before the commit.
+    """
+    conn = get_db_connection()
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+def init_app(app):
+    """Apply database settings from the app config and register teardown."""
+    global DATABASE
+    if 'DATABASE' in app.config:
+        DATABASE = app.config['DATABASE']
+    configure_pool(app.config.get('DB_POOL_SIZE', POOL_SIZE))
+    configure_storage(app.config.get('SQLITE_PRAGMAS'))
+    configure_book_cache(app.config.get('BOOK_CACHE_SIZE', BOOK_CACHE_SIZE),
+                         app.config.get('BOOK_CACHE_TTL', BOOK_CACHE_TTL))
+    configure_query_log(app.config.get('SQL_QUERY_LOG', False),
+                        app.config.get('SQL_QUERY_LOG_SIZE', 10000),
+                        app.config.get('SQL_SLOW_QUERY_MS', 100.0))
+    app.teardown_appcontext(close_db)
 
 def init_database():
     """Initialize the database with required tables."""
@@ -46,7 +402,16 @@ def init_database():
     ''')
     
     conn.commit()
-    conn.close()
+    migrate_database()
+
+def migrate_database():
+    """Apply any schema migrations the database has not run yet."""
+    with transaction() as conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f'PRAGMA user_version = {number}')
 
 def add_sample_data():
     """Add sample data to the database if it's empty."""
@@ -79,31 +444,279 @@ def add_sample_data():
         conn.execute('UPDATE books SET available_copies = 0 WHERE id = 3')
         
         conn.commit()
-    
-    conn.close()
 
 # Helper Functions for Database Operations
 
-def get_all_books() -> List[Dict]:
-    """Get all books from the database."""
+def get_all_books(limit: Optional[int] = None, after: Optional[Tuple[str, int]] = None,
+                  before: Optional[Tuple[str, int]] = None) -> List[Dict]:
+    """
+    Get books from the database ordered by title.
+
+    Args:
+        limit: Maximum number of books to return (all books if None)
+        after: (title, id) of a row; only books sorting after it are returned
+        before: (title, id) of a row; only books sorting before it are returned,
+            i.e. the `limit` books immediately preceding it
+    """
     conn = get_db_connection()
-    books = conn.execute('SELECT * FROM books ORDER BY title').fetchall()
-    conn.close()
-    return [dict(book) for book in books]
+    query = 'SELECT * FROM books'
+    params: list = []
+    if after is not None:
+        query += ' WHERE (title, id) > (?, ?)'
+        params.extend(after)
+    elif before is not None:
+        query += ' WHERE (title, id) < (?, ?)'
+        params.extend(before)
+
+    # Walk the (title, id) index backwards to find the rows just before a cursor
+    if before is not None and after is None:
+        query += ' ORDER BY title DESC, id DESC'
+    else:
+        query += ' ORDER BY title, id'
+    if limit is not None:
+        query += ' LIMIT ?'
+        params.append(limit)
+
+    books = [dict(book) for book in conn.execute(query, params).fetchall()]
+    if before is not None and after is None:
+        books.reverse()
+    return books
 
 def get_book_by_id(book_id: int) -> Optional[Dict]:
-    """Get a specific book by ID."""
+    """Get a specific book by ID (served from book_cache when possible)."""
+    # Only canonical integer ids are cached, so invalidation by id is exact
+    cacheable = type(book_id) is int
+    if cacheable:
+        book = book_cache.get(('id', DATABASE, book_id))
+        if book is not None:
+            return dict(book)
+
+    generation = book_cache.generation
     conn = get_db_connection()
     book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    if book is None:
+        return None
+    book = dict(book)
+    if cacheable:
+        _cache_book(book, generation)
+    return dict(book)
 
 def get_book_by_isbn(isbn: str) -> Optional[Dict]:
-    """Get a specific book by ISBN."""
+    """Get a specific book by ISBN (served from book_cache when possible)."""
+    book_id = book_cache.get(('isbn', DATABASE, isbn))
+    if book_id is not None:
+        book = get_book_by_id(book_id)
+        if book is not None:
+            return book
+
+    generation = book_cache.generation
     conn = get_db_connection()
     book = conn.execute('SELECT * FROM books WHERE isbn = ?', (isbn,)).fetchone()
-    conn.close()
-    return dict(book) if book else None
+    if book is None:
+        return None
+    book = dict(book)
+    _cache_book(book, generation)
+    return dict(book)
+
+def _cache_book(book: Dict, generation: int):
+    book_cache.set(('id', DATABASE, book['id']), book, generation)
+    book_cache.set(('isbn', DATABASE, book['isbn']), book['id'], generation)
+
+def bump_catalog_version() -> int:
+    """Record that the catalog changed; returns the new catalog_version."""
+    global catalog_version
+    with _catalog_version_lock:
+        catalog_version += 1
+        return catalog_version
+
+def invalidate_book(book_id: Optional[int] = None, isbn: Optional[str] = None):
+    """Drop a book from book_cache. Call after any write to the books table."""
+    bump_catalog_version()
+    if book_id is not None:
+        book_cache.pop(('id', DATABASE, book_id))
+    if isbn is not None:
+        book_cache.pop(('isbn', DATABASE, isbn))
+
+def get_book_cache_stats() -> Dict:
+    """Hit, miss, eviction and expiry counters for book_cache."""
+    return book_cache.stats()
+
+def configure_book_cache(size: int = BOOK_CACHE_SIZE, ttl: Optional[float] = BOOK_CACHE_TTL):
+    """Set the maximum number of cache entries and their time-to-live in seconds."""
+    book_cache.resize(size, ttl)
+
+def search_books(term: str, field: str) -> List[Dict]:
+    """
+    Find books whose title or author contains the term (case-insensitive).
+
+    Results are ranked by bm25 relevance, then title.
+    """
+    if field not in ('title', 'author'):
+        raise ValueError(f"Unsupported search field: {field}")
+
+    conn = get_db_connection()
+    if len(term) < FTS_MIN_TERM_LENGTH:
+        # LIKE only ignores the case of ASCII letters
+        books = conn.execute(f'''
+            SELECT * FROM books WHERE instr(unicode_lower({field}), ?) > 0
+            ORDER BY title, id
+        ''', (term.lower(),)).fetchall()
+    else:
+        # Quote the term as a single FTS5 phrase restricted to one column
+        phrase = '"' + term.replace('"', '""') + '"'
+        books = conn.execute('''
+            SELECT b.* FROM books_fts
+            JOIN books b ON b.id = books_fts.rowid
+            WHERE books_fts MATCH ?
+            ORDER BY bm25(books_fts), b.title, b.id
+        ''', (f'{field} : {phrase}',)).fetchall()
+    return [dict(book) for book in books]
+
+def count_search_matches(term: str, field: str, limit: int) -> int:
+    """
+    How many books contain the term (case-insensitive), counting no further
+    than `limit`. The term must be at least FTS_MIN_TERM_LENGTH characters.
+    """
+    if field not in ('title', 'author'):
+        raise ValueError(f"Unsupported search field: {field}")
+    phrase = '"' + term.replace('"', '""') + '"'
+    return get_db_connection().execute('''
+        SELECT COUNT(*) FROM (SELECT 1 FROM books_fts WHERE books_fts MATCH ? LIMIT ?)
+    ''', (f'{field} : {phrase}', limit)).fetchone()[0]
+
+def search_books_by_title(term: str, field: str, after: Optional[Tuple[str, int]] = None,
+                          limit: Optional[int] = None,
+                          scan_limit: Optional[int] = None) -> Tuple[List[Dict], Optional[Tuple[str, int]]]:
+    """
+    Find books whose title or author contains the term (case-insensitive), in title order.
+
+    Walks the (title, id) index from `after` and stops at `limit` matches or
+    after examining `scan_limit` books, so a call costs at most scan_limit
+    rows however rare the term is.
+
+    Returns:
+        tuple: (matching books, (title, id) of the last book examined if
+        scan_limit stopped the walk early, else None)
+    """
+    if field not in ('title', 'author'):
+        raise ValueError(f"Unsupported search field: {field}")
+
+    query = f'SELECT id, title, instr(unicode_lower({field}), ?) > 0 FROM books'
+    params: list = [term.lower()]
+    if after is not None:
+        query += ' WHERE (title, id) > (?, ?)'
+        params.extend(after)
+    query += ' ORDER BY title, id'
+    if scan_limit is not None:
+        query += ' LIMIT ?'
+        params.append(scan_limit)
+
+    conn = get_db_connection()
+    cursor = conn.execute(query, params)
+    ids, scanned, last = [], 0, None
+    try:
+        for book_id, title, hit in cursor:
+            scanned, last = scanned + 1, (title, book_id)
+            if hit:
+                ids.append(book_id)
+                if limit is not None and len(ids) >= limit:
+                    break
+    finally:
+        cursor.close()
+    stopped_early = scan_limit is not None and scanned == scan_limit and (limit is None or len(ids) < limit)
+
+    books = {book['id']: book for book in get_books_by_ids(ids)}
+    return [books[book_id] for book_id in ids if book_id in books], (last if stopped_early else None)
+
+def get_book_text_marks() -> Tuple[int, int]:
+    """
+    (highest book id, last book_edits seq).
+
+    Book ids and edit seqs only grow (the seq comes from sqlite_sequence, so
+    pruning the log does not lower it), so together these change whenever a
+    title or author is added, edited or deleted.
+    """
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT (SELECT IFNULL(MAX(id), 0) FROM books),
+               (SELECT IFNULL(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'book_edits')
+    ''').fetchone()
+    return row[0], row[1]
+
+def iter_book_text(after_id: int = 0, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Tuple[int, str, str]]:
+    """Yield (id, title, author) of the books with id > after_id, in id order."""
+    cursor = get_db_connection().execute(
+        'SELECT id, title, author FROM books WHERE id > ? ORDER BY id', (after_id,))
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield tuple(row)
+    finally:
+        cursor.close()
+
+def get_book_edits(after_seq: int) -> List[Tuple[int, int, str, str]]:
+    """(seq, book_id, old_title, old_author) of the title/author edits and deletes after after_seq."""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT seq, book_id, old_title, old_author FROM book_edits WHERE seq > ? ORDER BY seq
+    ''', (after_seq,)).fetchall()
+    return [tuple(row) for row in rows]
+
+def prune_book_edits(through_seq: int) -> int:
+    """Delete the book_edits rows with seq <= through_seq; returns how many went."""
+    with transaction() as conn:
+        return conn.execute('DELETE FROM book_edits WHERE seq <= ?', (through_seq,)).rowcount
+
+def get_books_by_ids(book_ids: List[int]) -> List[Dict]:
+    """Books with the given ids, in no particular order (missing ids are skipped)."""
+    if not book_ids:
+        return []
+    conn = get_db_connection()
+    # One JSON parameter instead of a placeholder per id, so any number of ids fits
+    rows = conn.execute('''
+        SELECT * FROM books WHERE id IN (SELECT value FROM json_each(?))
+    ''', (json.dumps(list(book_ids)),)).fetchall()
+    return [dict(row) for row in rows]
+
+def iter_books(batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """Yield every book in id order, fetching batch_size rows at a time."""
+    cursor = get_db_connection().execute('SELECT * FROM books ORDER BY id')
+    return _iter_cursor(cursor, batch_size)
+
+def iter_borrow_records(start: Optional[date] = None, end: Optional[date] = None,
+                        batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[Dict]:
+    """
+    Yield borrow records in borrow_date order, fetching batch_size rows at a time.
+
+    Args:
+        start: Only records borrowed on or after this date
+        end: Only records borrowed on or before this date
+    """
+    clauses, params = [], []
+    if start is not None:
+        clauses.append('borrow_date >= ?')
+        params.append(start.isoformat())
+    if end is not None:
+        # ISO timestamps sort as text, so anything before the next day is on or before `end`
+        clauses.append('borrow_date < ?')
+        params.append((end + timedelta(days=1)).isoformat())
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    cursor = get_db_connection().execute(f'SELECT * FROM borrow_records {where} ORDER BY borrow_date, id', params)
+    return _iter_cursor(cursor, batch_size)
+
+def _iter_cursor(cursor: sqlite3.Cursor, batch_size: int) -> Iterator[Dict]:
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield dict(row)
+    finally:
+        cursor.close()
 
 def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     """Get currently borrowed books for a patron."""
@@ -115,11 +728,11 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
         WHERE br.patron_id = ? AND br.return_date IS NULL
         ORDER BY br.borrow_date
     ''', (patron_id,)).fetchall()
-    conn.close()
     
     borrowed_books = []
     for record in records:
         borrowed_books.append({
+            'loan_id': record['id'],
             'book_id': record['book_id'],
             'title': record['title'],
             'author': record['author'],
@@ -130,6 +743,79 @@ def get_patron_borrowed_books(patron_id: str) -> List[Dict]:
     
     return borrowed_books
 
+# Tiered late fee for a column/expression of overdue days, using the
+# :first_week_days, :first_week_rate, :daily_rate and :max_fee parameters
+LATE_FEE_SQL = '''
+    MIN(:max_fee, CASE
+        WHEN {days} <= 0 THEN 0.0
+        WHEN {days} <= :first_week_days THEN {days} * :first_week_rate
+        ELSE :first_week_days * :first_week_rate + ({days} - :first_week_days) * :daily_rate
+    END)
+'''
+
+def get_patron_loans_with_fees(patron_id: str, as_of: datetime, fee_rule: Dict) -> List[Dict]:
+    """
+    Get a patron's active loans with days overdue and late fee computed in SQL.
+
+    Args:
+        patron_id: Patron whose active loans to fetch
+        as_of: Date the fees are assessed on (only the date part is used)
+        fee_rule: first_week_days, first_week_rate, daily_rate and max_fee
+    """
+    conn = get_db_connection()
+    params = dict(fee_rule, patron_id=patron_id, as_of=as_of.date().isoformat())
+    records = conn.execute(f'''
+        SELECT loan.*, {LATE_FEE_SQL.format(days='loan.days_overdue')} AS late_fee
+        FROM (
+            SELECT br.id AS loan_id, br.book_id, b.title, b.author, br.borrow_date, br.due_date,
+                   MAX(0, CAST(julianday(:as_of) - julianday(date(br.due_date)) AS INTEGER)) AS days_overdue
+            FROM borrow_records br
+            JOIN books b ON br.book_id = b.id
+            WHERE br.patron_id = :patron_id AND br.return_date IS NULL
+        ) loan
+        ORDER BY loan.borrow_date
+    ''', params).fetchall()
+
+    loans = []
+    for record in records:
+        loan = dict(record)
+        loan['borrow_date'] = datetime.fromisoformat(record['borrow_date'])
+        loan['due_date'] = datetime.fromisoformat(record['due_date'])
+        loans.append(loan)
+    return loans
+
+def write_fee_snapshot(as_of: datetime, fee_rule: Dict) -> Dict[str, float]:
+    """
+    Total the late fees of every overdue active loan per patron and store them
+    in fee_snapshots for the as_of date, replacing any earlier run for that date.
+
+    The whole computation is a single INSERT ... SELECT aggregate, so loans are
+    streamed through SQLite rather than loaded into Python.
+
+    Returns:
+        dict: patron_id -> total fee
+    """
+    snapshot_date = as_of.date().isoformat()
+    params = dict(fee_rule, as_of=snapshot_date)
+    with transaction() as conn:
+        conn.execute('DELETE FROM fee_snapshots WHERE snapshot_date = ?', (snapshot_date,))
+        # ISO due dates sort as text, so due_date < 'YYYY-MM-DD' means due before that day
+        conn.execute(f'''
+            INSERT INTO fee_snapshots (snapshot_date, patron_id, overdue_loans, total_fee)
+            SELECT :as_of, patron_id, COUNT(*), ROUND(SUM({LATE_FEE_SQL.format(days='days_overdue')}), 2)
+            FROM (
+                SELECT patron_id,
+                       CAST(julianday(:as_of) - julianday(date(due_date)) AS INTEGER) AS days_overdue
+                FROM borrow_records
+                WHERE return_date IS NULL AND due_date < :as_of
+            )
+            GROUP BY patron_id
+        ''', params)
+        totals = conn.execute('''
+            SELECT patron_id, total_fee FROM fee_snapshots WHERE snapshot_date = ?
+        ''', (snapshot_date,)).fetchall()
+    return {row['patron_id']: row['total_fee'] for row in totals}
+
 def get_patron_borrow_count(patron_id: str) -> int:
     """Get the number of books currently borrowed by a patron."""
     conn = get_db_connection()
@@ -137,7 +823,6 @@ def get_patron_borrow_count(patron_id: str) -> int:
         SELECT COUNT(*) as count FROM borrow_records 
         WHERE patron_id = ? AND return_date IS NULL
     ''', (patron_id,)).fetchone()['count']
-    conn.close()
     return count
 
 def insert_book(title: str, author: str, isbn: str, total_copies: int, available_copies: int) -> bool:
@@ -149,12 +834,36 @@ def insert_book(title: str, author: str, isbn: str, total_copies: int, available
             VALUES (?, ?, ?, ?, ?)
         ''', (title, author, isbn, total_copies, available_copies))
         conn.commit()
-        conn.close()
+        invalidate_book(isbn=isbn)
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
         return False
 
+def insert_books(books: List[Tuple[str, str, str, int, int]]) -> List[str]:
+    """
+    Insert a batch of books in one transaction, skipping ISBNs already in the catalog.
+
+    Args:
+        books: (title, author, isbn, total_copies, available_copies) rows with
+            distinct ISBNs
+
+    Returns:
+        list: ISBNs that were skipped because they already exist
+    """
+    isbns = [book[2] for book in books]
+    with transaction() as conn:
+        placeholders = ','.join('?' * len(isbns))
+        existing = {row['isbn'] for row in conn.execute(
+            f'SELECT isbn FROM books WHERE isbn IN ({placeholders})', isbns)}
+        conn.executemany('''
+            INSERT OR IGNORE INTO books (title, author, isbn, total_copies, available_copies)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [book for book in books if book[2] not in existing])
+    # Lookup misses are not cached, so brand new ISBNs need no invalidation
+    bump_catalog_version()
+    return [isbn for isbn in isbns if isbn in existing]
+
 def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime) -> bool:
     """Insert a new borrow record into the database."""
     conn = get_db_connection()
@@ -164,10 +873,9 @@ def insert_borrow_record(patron_id: str, book_id: int, borrow_date: datetime, du
             VALUES (?, ?, ?, ?)
         ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
         conn.commit()
-        conn.close()
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
         return False
 
 def update_book_availability(book_id: int, change: int) -> bool:
@@ -178,10 +886,10 @@ def update_book_availability(book_id: int, change: int) -> bool:
             UPDATE books SET available_copies = available_copies + ? WHERE id = ?
         ''', (change, book_id))
         conn.commit()
-        conn.close()
+        invalidate_book(book_id)
         return True
     except Exception as e:
-        conn.close()
+        conn.rollback()
         return False
 
 def update_borrow_record_return_date(patron_id: str, book_id: int, return_date: datetime) -> bool:
@@ -194,8 +902,296 @@ def update_borrow_record_return_date(patron_id: str, book_id: int, return_date:
             WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
         ''', (return_date.isoformat(), patron_id, book_id))
         conn.commit()
-        conn.close()
         return True
     except Exception as e:
-        conn.close()
-        return False
\ No newline at end of file
+        conn.rollback()
+        return False
+
+def borrow_book_record(patron_id: str, book_id: int, borrow_date: datetime, due_date: datetime,
+                       max_borrowed: int) -> Tuple[str, Optional[Dict]]:
+    """
+    Check availability and the patron's limit, then record the borrow, in one transaction.
+
+    Returns:
+        tuple: (status, book) where status is 'ok', 'not_found', 'unavailable',
+        'limit_reached' or 'error'
+    """
+    try:
+        with transaction() as conn:
+            book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+            if book is None:
+                return 'not_found', None
+            book = dict(book)
+            if book['available_copies'] <= 0:
+                return 'unavailable', book
+
+            count = conn.execute('''
+                SELECT COUNT(*) as count FROM borrow_records
+                WHERE patron_id = ? AND return_date IS NULL
+            ''', (patron_id,)).fetchone()['count']
+            if count >= max_borrowed:
+                return 'limit_reached', book
+
+            # Conditional decrement: never lets availability go below zero
+            updated = conn.execute('''
+                UPDATE books SET available_copies = available_copies - 1
+                WHERE id = ? AND available_copies > 0
+            ''', (book_id,)).rowcount
+            if updated == 0:
+                return 'unavailable', book
+
+            conn.execute('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', (patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()))
+    except sqlite3.Error:
+        return 'error', None
+    invalidate_book(book['id'])
+    return 'ok', book
+
+def return_book_record(patron_id: str, book_id: int,
+                       return_date: datetime) -> Tuple[str, Optional[Dict], Optional[datetime]]:
+    """
+    Close the patron's active borrow record and restore availability, in one transaction.
+
+    Returns:
+        tuple: (status, book, due_date) where status is 'ok', 'not_found',
+        'no_record' or 'error'
+    """
+    try:
+        with transaction() as conn:
+            book = conn.execute('SELECT * FROM books WHERE id = ?', (book_id,)).fetchone()
+            if book is None:
+                return 'not_found', None, None
+            book = dict(book)
+
+            record = conn.execute('''
+                SELECT id, due_date FROM borrow_records
+                WHERE patron_id = ? AND book_id = ? AND return_date IS NULL
+                ORDER BY borrow_date LIMIT 1
+            ''', (patron_id, book_id)).fetchone()
+            if record is None:
+                return 'no_record', book, None
+
+            conn.execute('UPDATE borrow_records SET return_date = ? WHERE id = ?',
+                         (return_date.isoformat(), record['id']))
+            # Increment availability without exceeding total
+            conn.execute('''
+                UPDATE books SET available_copies = available_copies + 1
+                WHERE id = ? AND available_copies < total_copies
+            ''', (book_id,))
+    except sqlite3.Error:
+        return 'error', None, None
+    invalidate_book(book['id'])
+    return 'ok', book, datetime.fromisoformat(record['due_date'])
+
+def borrow_book_records(patron_id: str, book_ids: List[int], borrow_date: datetime, due_date: datetime,
+                        max_borrowed: int) -> List[Tuple[str, Optional[Dict]]]:
+    """
+    Borrow several books for one patron in one transaction.
+
+    The patron's active loan count and the books are read once; the items are
+    then decided in order against that snapshot and written with executemany.
+
+    Returns:
+        list: one (status, book) per book id, in order, with the statuses of
+        borrow_book_record(). Every item is 'error' if the transaction failed.
+    """
+    unique_ids = list(dict.fromkeys(book_ids))
+    try:
+        with transaction() as conn:
+            placeholders = ','.join('?' * len(unique_ids))
+            books = {row['id']: dict(row) for row in conn.execute(
+                f'SELECT * FROM books WHERE id IN ({placeholders})', unique_ids)}
+            count = conn.execute('''
+                SELECT COUNT(*) as count FROM borrow_records
+                WHERE patron_id = ? AND return_date IS NULL
+            ''', (patron_id,)).fetchone()['count']
+
+            results, borrowed = [], []
+            for book_id in book_ids:
+                book = books.get(book_id)
+                if book is None:
+                    results.append(('not_found', None))
+                elif book['available_copies'] <= 0:
+                    results.append(('unavailable', dict(book)))
+                elif count >= max_borrowed:
+                    results.append(('limit_reached', dict(book)))
+                else:
+                    book['available_copies'] -= 1
+                    count += 1
+                    borrowed.append(book_id)
+                    results.append(('ok', dict(book)))
+
+            conn.executemany('UPDATE books SET available_copies = available_copies - 1 WHERE id = ?',
+                             [(book_id,) for book_id in borrowed])
+            conn.executemany('''
+                INSERT INTO borrow_records (patron_id, book_id, borrow_date, due_date)
+                VALUES (?, ?, ?, ?)
+            ''', [(patron_id, book_id, borrow_date.isoformat(), due_date.isoformat()) for book_id in borrowed])
+    except sqlite3.Error:
+        return [('error', None)] * len(book_ids)
+    for book_id in set(borrowed):
+        invalidate_book(book_id)
+    return results
+
+def return_book_records(patron_id: str, book_ids: List[int],
+                        return_date: datetime) -> List[Tuple[str, Optional[Dict], Optional[datetime]]]:
+    """
+    Return several books for one patron in one transaction.
+
+    Each book id closes the patron's oldest still-open loan of that book.
+
+    Returns:
+        list: one (status, book, due_date) per book id, in order, with the
+        statuses of return_book_record(). Every item is 'error' if the
+        transaction failed.
+    """
+    unique_ids = list(dict.fromkeys(book_ids))
+    try:
+        with transaction() as conn:
+            placeholders = ','.join('?' * len(unique_ids))
+            books = {row['id']: dict(row) for row in conn.execute(
+                f'SELECT * FROM books WHERE id IN ({placeholders})', unique_ids)}
+            loans = {}
+            for record in conn.execute(f'''
+                SELECT id, book_id, due_date FROM borrow_records
+                WHERE patron_id = ? AND return_date IS NULL AND book_id IN ({placeholders})
+                ORDER BY borrow_date
+            ''', [patron_id] + unique_ids):
+                loans.setdefault(record['book_id'], []).append(record)
+
+            results, closed = [], []
+            for book_id in book_ids:
+                book = books.get(book_id)
+                if book is None:
+                    results.append(('not_found', None, None))
+                elif not loans.get(book_id):
+                    results.append(('no_record', dict(book), None))
+                else:
+                    record = loans[book_id].pop(0)
+                    closed.append((record['id'], book_id))
+                    results.append(('ok', dict(book), datetime.fromisoformat(record['due_date'])))
+
+            conn.executemany('UPDATE borrow_records SET return_date = ? WHERE id = ?',
+                             [(return_date.isoformat(), loan_id) for loan_id, _ in closed])
+            # Increment availability without exceeding total
+            conn.executemany('''
+                UPDATE books SET available_copies = available_copies + 1
+                WHERE id = ? AND available_copies < total_copies
+            ''', [(book_id,) for _, book_id in closed])
+    except sqlite3.Error:
+        return [('error', None, None)] * len(book_ids)
+    for book_id in {book_id for _, book_id in closed}:
+        invalidate_book(book_id)
+    return results
+
+def claim_payment(idempotency_key: str, patron_id: str, book_id: int, loan_id: Optional[int],
+                  fee_amount: float, stale_before: Optional[str] = None) -> Tuple[str, Optional[Dict]]:
+    """
+    Reserve the ledger entry for a payment before the gateway is called.
+
+    A loan's fee keeps growing after it is first paid, so the entry is only
+    charged the part of fee_amount (the loan's whole fee so far) that the
+    loan's completed entries do not already cover. A new key, or one whose
+    earlier attempt failed, is (re)claimed as 'pending' for that amount.
+    Otherwise the existing entry is returned so the caller can answer
+    locally. While another entry for the loan is 'pending' or 'unknown',
+    that entry is returned instead: it has to finish or be settled before
+    the outstanding amount is known.
+
+    An 'unknown' entry (the gateway call errored after it may have reached
+    the provider) must be settled with the provider (see
+    settle_unknown_payment()) before anything more is charged. A 'pending'
+    entry last updated before `stale_before` (ISO timestamp) was left by a
+    worker that died mid-call, so it is turned into an 'unknown' one.
+
+    Returns:
+        tuple: ('claimed', entry), (status, entry) for an existing
+        'pending', 'unknown' or 'completed' entry, ('paid', None) if
+        nothing is outstanding, or ('error', None)
+    """
+    now = datetime.now().isoformat()
+    try:
+        with transaction() as conn:
+            if stale_before is not None:
+                conn.execute('''
+                    UPDATE payments SET status = 'unknown', message = 'Abandoned while pending', updated_at = ?
+                    WHERE loan_id IS ? AND patron_id = ? AND book_id = ? AND status = 'pending'
+                          AND updated_at < ?
+                ''', (now, loan_id, patron_id, book_id, stale_before))
+
+            existing = conn.execute(
+                'SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+            if existing is not None and existing['status'] != 'failed':
+                return existing['status'], dict(existing)
+
+            entries = [dict(row) for row in conn.execute('''
+                SELECT * FROM payments WHERE loan_id IS ? AND patron_id = ? AND book_id = ?
+                ORDER BY created_at
+            ''', (loan_id, patron_id, book_id))]
+            for entry in entries:
+                if entry['status'] in ('pending', 'unknown'):
+                    return entry['status'], entry
+            paid = sum(entry['amount'] for entry in entries if entry['status'] == 'completed')
+            amount = round(fee_amount - paid, 2)
+            if amount <= 0:
+                return 'paid', None
+
+            if existing is None:
+                conn.execute('''
+                    INSERT INTO payments
+                        (idempotency_key, patron_id, book_id, loan_id, amount, status, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, 'pending', ?, ?)
+                ''', (idempotency_key, patron_id, book_id, loan_id, amount, now, now))
+            else:
+                # Only failed attempts may be retried; they never reached a charge
+                conn.execute('''
+                    UPDATE payments SET status = 'pending', amount = ?, transaction_id = NULL,
+                                        message = NULL, updated_at = ?
+                    WHERE idempotency_key = ?
+                ''', (amount, now, idempotency_key))
+            payment = dict(conn.execute(
+                'SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)).fetchone())
+    except sqlite3.Error:
+        return 'error', None
+    return 'claimed', payment
+
+def settle_unknown_payment(idempotency_key: str, status: str, transaction_id: Optional[str] = None,
+                           message: Optional[str] = None) -> bool:
+    """
+    Settle an 'unknown' entry once the provider has answered for its key:
+    'completed' if it holds the charge, 'failed' if it holds none. False if
+    another request settled it first.
+    """
+    try:
+        with transaction() as conn:
+            return conn.execute('''
+                UPDATE payments SET status = ?, transaction_id = ?, message = ?, updated_at = ?
+                WHERE idempotency_key = ? AND status = 'unknown'
+            ''', (status, transaction_id, message, datetime.now().isoformat(), idempotency_key)).rowcount == 1
+    except sqlite3.Error:
+        return False
+
+def record_payment_result(idempotency_key: str, status: str, transaction_id: Optional[str] = None,
+                          message: Optional[str] = None) -> bool:
+    """
+    Store the gateway outcome of a claimed payment: 'completed', 'failed'
+    (declined, or never sent) or 'unknown' (the call errored after it may
+    have reached the provider).
+    """
+    try:
+        with transaction() as conn:
+            conn.execute('''
+                UPDATE payments SET status = ?, transaction_id = ?, message = ?, updated_at = ?
+                WHERE idempotency_key = ?
+            ''', (status, transaction_id, message, datetime.now().isoformat(), idempotency_key))
+        return True
+    except sqlite3.Error:
+        return False
+
+def get_payment(idempotency_key: str) -> Optional[Dict]:
+    """Get a ledger entry by its idempotency key."""
+    row = get_db_connection().execute(
+        'SELECT * FROM payments WHERE idempotency_key = ?', (idempotency_key,)).fetchone()
+    return dict(row) if row else None
@@ -0,0 +1,236 @@
+"""
+In-process metrics for the Library Management System
+Provides thread-safe counters and latency histograms, a registry that
+renders them in the Prometheus text exposition format, and Flask hooks
+that time every request
+"""
+
+import bisect
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds (seconds) of the default latency buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Latency histogram with fixed, cumulative buckets.
+
+    Observations are counted in the first bucket whose upper bound is >= the
+    value; anything larger falls in the implicit +Inf bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def cumulative(self) -> Tuple[List[Tuple[str, int]], float, int]:
+        """([(upper bound, observations <= bound), ..., ('+Inf', count)], sum, count)"""
+        with self._lock:
+            counts, total, value_sum = list(self._counts), self._count, self._sum
+        buckets, running = [], 0
+        for bound, count in zip(self.buckets, counts):
+            running += count
+            buckets.append((str(bound), running))
+        buckets.append(('+Inf', total))
+        return buckets, value_sum, total
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-th quantile (None if empty or in +Inf)."""
+        buckets, _, total = self.cumulative()
+        if not total:
+            return None
+        for bound, seen in buckets[:-1]:
+            if seen >= q * total:
+                return float(bound)
+        return None
+
+    def snapshot(self) -> Dict:
+        buckets, value_sum, total = self.cumulative()
+        return {
+            'count': total,
+            'sum': round(value_sum, 6),
+            'buckets': dict(buckets),
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Counter:
+    """Monotonically increasing count."""
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+
+class MetricFamily:
+    """A named metric with one child Counter or Histogram per label combination."""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Sequence[str],
+                 factory: Callable):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def children(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+
+class Registry:
+    """Collection of metric families rendered together by render()."""
+
+    def __init__(self):
+        self._families: Dict[str, MetricFamily] = {}
+
+    def _register(self, family: MetricFamily) -> MetricFamily:
+        if family.name in self._families:
+            raise ValueError(f"Metric {family.name} is already registered")
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, 'counter', labelnames, Counter))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> MetricFamily:
+        return self._register(MetricFamily(name, documentation, 'histogram', labelnames,
+                                           lambda: Histogram(buckets)))
+
+    def get(self, name: str) -> Optional[MetricFamily]:
+        return self._families.get(name)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for family in self._families.values():
+            lines.append(f'# HELP {family.name} {family.documentation}')
+            lines.append(f'# TYPE {family.name} {family.kind}')
+            for values, child in family.children():
+                labels = list(zip(family.labelnames, values))
+                if family.kind == 'counter':
+                    lines.append(f'{family.name}{_format_labels(labels)} {_format_value(child.value)}')
+                    continue
+                buckets, value_sum, total = child.cumulative()
+                for bound, count in buckets:
+                    lines.append(f'{family.name}_bucket{_format_labels(labels + [("le", bound)])} {count}')
+                lines.append(f'{family.name}_sum{_format_labels(labels)} {_format_value(value_sum)}')
+                lines.append(f'{family.name}_count{_format_labels(labels)} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels: List[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'HTTP requests handled, by endpoint, method and status code.',
+    ('endpoint', 'method', 'status'))
+HTTP_LATENCY = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Time to handle an HTTP request, by endpoint and method.',
+    ('endpoint', 'method'))
+SERVICE_LATENCY = REGISTRY.histogram(
+    'library_service_duration_seconds', 'Time spent in library service operations.',
+    ('operation',))
+GATEWAY_LATENCY = REGISTRY.histogram(
+    'payment_gateway_duration_seconds', 'Round trip time of payment gateway calls.',
+    ('method', 'outcome'))
+
+
+class timer:
+    """
+    Context manager that observes the time spent in its block.
+
+    The block may set `outcome`; it defaults to 'ok', or 'error' if the
+    block raises. The outcome label is only used by families that have one.
+    """
+
+    def __init__(self, family: MetricFamily, **labels):
+        self.family = family
+        self.labels = labels
+        self.outcome = 'ok'
+
+    def __enter__(self) -> 'timer':
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._start
+        if exc_type is not None:
+            self.outcome = 'error'
+        labels = dict(self.labels, outcome=self.outcome) if 'outcome' in self.family.labelnames else self.labels
+        self.family.labels(**labels).observe(elapsed)
+        return False
+
+
+def timed(operation: str):
+    """Decorator timing every call of a service function in SERVICE_LATENCY."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(SERVICE_LATENCY, operation=operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def init_app(app):
+    """Count and time every request handled by the app."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            HTTP_LATENCY.labels(endpoint=endpoint, method=request.method).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(endpoint=endpoint, method=request.method, status=response.status_code).inc()
+        return response
+
+
+def render_latest() -> str:
+    """Current values of every registered metric in the Prometheus text format."""
+    return REGISTRY.render()
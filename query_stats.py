@@ -0,0 +1,231 @@
+"""
+Opt-in SQL instrumentation for the Library Management System
+Times every statement run on a pooled connection and keeps the most recent
+ones in a ring buffer for aggregation and slow-query logging
+"""
+
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 10000
+DEFAULT_SLOW_THRESHOLD = 0.1  # seconds
+
+
+class QueryLog:
+    """
+    Ring buffer of executed statements.
+
+    Each entry holds the statement text, duration (execute plus fetches),
+    rows returned, the function that issued it and when it finished.
+    Statements taking at least slow_threshold seconds are also logged as
+    warnings on the query_stats logger.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, slow_threshold: float = DEFAULT_SLOW_THRESHOLD):
+        self.capacity = capacity
+        self.slow_threshold = slow_threshold
+        self._entries: deque = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.slow = 0
+
+    def record(self, sql: str, duration: float, rows: int, caller: str):
+        entry = {
+            'sql': ' '.join(sql.split()),
+            'duration': duration,
+            'rows': rows,
+            'caller': caller,
+            'finished_at': time.time(),
+        }
+        slow = duration >= self.slow_threshold
+        with self._lock:
+            self._entries.append(entry)
+            self.recorded += 1
+            if slow:
+                self.slow += 1
+        if slow:
+            logger.warning('Slow query (%.1f ms, %d rows) in %s: %s',
+                           duration * 1000, rows, caller, entry['sql'])
+
+    def entries(self) -> List[Dict]:
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.recorded = 0
+            self.slow = 0
+
+    def stats(self, recent: int = 20) -> Dict:
+        """
+        Aggregate the buffered statements by statement text and by caller.
+
+        Groups are sorted by total time, most expensive first.
+        """
+        entries = self.entries()
+        return {
+            'capacity': self.capacity,
+            'slow_threshold_ms': self.slow_threshold * 1000,
+            'recorded': self.recorded,
+            'slow': self.slow,
+            'buffered': len(entries),
+            'statements': _aggregate(entries, 'sql'),
+            'callers': _aggregate(entries, 'caller'),
+            'recent': [_format_entry(entry) for entry in entries[-recent:]] if recent else [],
+        }
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def _aggregate(entries: List[Dict], key: str) -> List[Dict]:
+    groups: Dict[str, List[Dict]] = {}
+    for entry in entries:
+        groups.setdefault(entry[key], []).append(entry)
+
+    summary = []
+    for value, group in groups.items():
+        durations = sorted(entry['duration'] for entry in group)
+        summary.append({
+            key: value,
+            'count': len(group),
+            'rows': sum(entry['rows'] for entry in group),
+            'total_ms': round(sum(durations) * 1000, 3),
+            'p50_ms': round(_percentile(durations, 50) * 1000, 3),
+            'p95_ms': round(_percentile(durations, 95) * 1000, 3),
+            'p99_ms': round(_percentile(durations, 99) * 1000, 3),
+            'max_ms': round(durations[-1] * 1000, 3),
+        })
+    summary.sort(key=lambda group: group['total_ms'], reverse=True)
+    return summary
+
+
+def _format_entry(entry: Dict) -> Dict:
+    formatted = dict(entry, duration_ms=round(entry['duration'] * 1000, 3))
+    del formatted['duration']
+    return formatted
+
+
+_THIS_FILE = os.path.normcase(__file__)
+_SKIP_MODULES = ('contextlib',)
+
+
+def _caller() -> str:
+    """module.function of the first frame outside this module."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if os.path.normcase(frame.f_code.co_filename) != _THIS_FILE and module not in _SKIP_MODULES:
+            return f'{module}.{frame.f_code.co_name}'
+        frame = frame.f_back
+    return '?'
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Cursor that reports each statement to its connection's QueryLog.
+
+    A statement's time covers execute() and every fetch until the result is
+    exhausted, the cursor is reused or closed, or it is garbage collected.
+    """
+
+    _sql = None
+
+    def _finish(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            log = self.connection.query_log
+            if log is not None:
+                log.record(sql, self._elapsed, self._rows, self._caller)
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        self._sql, self._caller, self._elapsed, self._rows = sql, _caller(), 0.0, 0
+        try:
+            self._timed(super().execute, sql, parameters)
+        except BaseException:
+            self._finish()
+            raise
+        if self.description is None:
+            # Not a query: nothing to fetch
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        self._finish()
+        self._sql, self._caller, self._elapsed, self._rows = sql, _caller(), 0.0, 0
+        try:
+            self._timed(super().executemany, sql, seq_of_parameters)
+        finally:
+            self._rows = max(self.rowcount, 0)
+            self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, self.arraysize if size is None else size)
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose statements all go through InstrumentedCursor."""
+
+    query_log: Optional[QueryLog] = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -2,11 +2,26 @@
 API Routes - JSON API endpoints
 """
 
-from flask import Blueprint, jsonify, request
-from services.library_service import calculate_late_fee_for_book, search_books_in_catalog
+import io
+from datetime import date
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
+from database import get_book_cache_stats, get_query_stats
+from services.payment_service import get_payment_gateway_health
+from services.search_cache import get_search_cache_stats
+from routes.search_routes import is_truthy
+from services.library_service import (
+    calculate_late_fee_for_book, get_catalog_page, import_books,
+    borrow_books_by_patron, return_books_by_patron, export_books, export_loans, suggest_search_terms,
+    search_books_page, stream_search_results, CATALOG_PAGE_SIZE, IMPORT_FORMATS, SEARCH_PAGE_SIZE, SUGGEST_LIMIT
+)
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+MAX_PAGE_SIZE = 200
+MAX_SUGGEST_LIMIT = 50
+SEARCH_STREAM_LIMIT = 1000
+MAX_SEARCH_STREAM_LIMIT = 10000
+
 @api_bp.route('/late_fee/<patron_id>/<int:book_id>')
 def get_late_fee(patron_id, book_id):
     """
@@ -16,24 +31,215 @@ def get_late_fee(patron_id, book_id):
     result = calculate_late_fee_for_book(patron_id, book_id)
     return jsonify(result), 501 if 'not implemented' in result.get('status', '') else 200
 
+@api_bp.route('/catalog')
+def get_catalog_api():
+    """
+    Get one page of the catalog as JSON.
+    API interface for R2: Book Catalog Display
+
+    Query parameters: limit (1-200), after / before (cursors from a previous page)
+    """
+    default_limit = current_app.config.get('CATALOG_PAGE_SIZE', CATALOG_PAGE_SIZE)
+    limit = request.args.get('limit', default_limit, type=int)
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+    try:
+        page = get_catalog_page(request.args.get('after'), request.args.get('before'), limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    page['count'] = len(page['books'])
+    return jsonify(page)
+
 @api_bp.route('/search')
 def search_books_api():
     """
     Search for books via API endpoint.
     Alternative API interface for R5: Book Search Functionality
+
+    Query parameters: q, type (title, author or isbn), fuzzy (true to allow
+    typos), limit (1-200), cursor (next_cursor from a previous page),
+    format (json, or ndjson to stream up to 10000 results one per line)
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    fuzzy = is_truthy(request.args.get('fuzzy'))
+    cursor = request.args.get('cursor')
+    fmt = request.args.get('format', 'json')
     
     if not search_term:
         return jsonify({'error': 'Search term is required'}), 400
-    
+    if fmt not in ('json', 'ndjson'):
+        return jsonify({'error': 'format must be json or ndjson'}), 400
+    max_limit = MAX_SEARCH_STREAM_LIMIT if fmt == 'ndjson' else MAX_PAGE_SIZE
+    limit = request.args.get('limit', SEARCH_STREAM_LIMIT if fmt == 'ndjson' else SEARCH_PAGE_SIZE, type=int)
+    if not 1 <= limit <= max_limit:
+        return jsonify({'error': f'limit must be between 1 and {max_limit}'}), 400
+
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    try:
+        if fmt == 'ndjson':
+            summary, lines = stream_search_results(search_term, search_type, limit, cursor, fuzzy)
+        else:
+            page = search_books_page(search_term, search_type, limit, cursor, fuzzy)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if fmt == 'ndjson':
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson', headers={
+            'X-Total-Count': str(summary['total']),
+            'X-Total-Exact': str(summary['total_exact']).lower(),
+            'X-Result-Order': summary['order'],
+        })
     
     return jsonify({
         'search_term': search_term,
         'search_type': search_type,
-        'results': books,
-        'count': len(books)
+        'fuzzy': fuzzy,
+        'results': page['books'],
+        'count': len(page['books']),
+        'limit': limit,
+        'next_cursor': page['next_cursor'],
+        'total': page['total'],
+        'total_exact': page['total_exact'],
+        'order': page['order']
     })
+
+@api_bp.route('/suggest')
+def suggest_api():
+    """
+    Type-ahead completions of a title or author prefix.
+
+    Query parameters: q (prefix), type (title or author), limit (1-50)
+    """
+    prefix = request.args.get('q', '').strip()
+    search_type = request.args.get('type', 'title')
+    if search_type not in ('title', 'author'):
+        return jsonify({'error': 'type must be title or author'}), 400
+    limit = request.args.get('limit', SUGGEST_LIMIT, type=int)
+    if not 1 <= limit <= MAX_SUGGEST_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_SUGGEST_LIMIT}'}), 400
+
+    return jsonify({
+        'query': prefix,
+        'type': search_type,
+        'suggestions': suggest_search_terms(prefix, search_type, limit)
+    })
+
+@api_bp.route('/borrow/batch', methods=['POST'])
+def borrow_batch_api():
+    """
+    Borrow several books for one patron in one transaction.
+    Batch interface for R3: Book Borrowing
+
+    JSON body: {"patron_id": "123456", "book_ids": [1, 2, 3]}
+    """
+    return _batch_response(borrow_books_by_patron)
+
+@api_bp.route('/return/batch', methods=['POST'])
+def return_batch_api():
+    """
+    Return several books for one patron in one transaction.
+    Batch interface for R4: Book Return Processing
+
+    JSON body: {"patron_id": "123456", "book_ids": [1, 2, 3]}
+    """
+    return _batch_response(return_books_by_patron)
+
+def _batch_response(process):
+    payload = request.get_json(silent=True) or {}
+    patron_id = str(payload.get('patron_id', '')).strip()
+    book_ids = payload.get('book_ids')
+    if not isinstance(book_ids, list):
+        return jsonify({'success': False, 'message': 'book_ids must be a list of book IDs.', 'results': []}), 400
+
+    success, message, results = process(patron_id, book_ids)
+    return jsonify({'success': success, 'message': message, 'results': results}), 200 if success else 400
+
+@api_bp.route('/books/import', methods=['POST'])
+def import_books_api():
+    """
+    Bulk add books from an uploaded CSV or JSONL file.
+
+    Send the file as the multipart field `file`, or as the raw request body.
+    Query parameters: format (csv or jsonl; default from the file name or
+    Content-Type)
+    """
+    upload = request.files.get('file')
+    fmt = request.args.get('format')
+    if fmt is None:
+        name = upload.filename if upload else ''
+        ndjson = request.mimetype in ('application/x-ndjson', 'application/jsonl')
+        fmt = 'jsonl' if ndjson or name.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+    if fmt not in IMPORT_FORMATS:
+        return jsonify({'error': f"format must be one of: {', '.join(IMPORT_FORMATS)}"}), 400
+
+    raw = upload.stream if upload else request.stream
+    stream = io.TextIOWrapper(raw, encoding='utf-8', errors='surrogateescape', newline='')
+    return jsonify(import_books(stream, fmt))
+
+@api_bp.route('/export/books')
+def export_books_api():
+    """
+    Stream the full catalog as a download.
+
+    Query parameters: format (csv or ndjson, default csv)
+    """
+    fmt = request.args.get('format', 'csv')
+    try:
+        chunks = export_books(fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _export_response(chunks, 'books', fmt)
+
+@api_bp.route('/export/loans')
+def export_loans_api():
+    """
+    Stream borrow records as a download.
+
+    Query parameters: format (csv or ndjson, default csv), start / end
+    (YYYY-MM-DD, inclusive range on borrow_date)
+    """
+    fmt = request.args.get('format', 'csv')
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+        chunks = export_loans(fmt, start, end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return _export_response(chunks, 'loans', fmt)
+
+def _export_response(chunks, name, fmt):
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename={name}.{fmt}'})
+
+@api_bp.route('/debug/book_cache')
+def get_book_cache_stats_api():
+    """
+    Report hit/miss/eviction counters for the book lookup cache.
+    """
+    return jsonify(get_book_cache_stats())
+
+@api_bp.route('/debug/search_cache')
+def get_search_cache_stats_api():
+    """
+    Report hit rate, stale hits and invalidations of the search result cache.
+    """
+    return jsonify(get_search_cache_stats())
+
+@api_bp.route('/debug/queries')
+def get_query_stats_api():
+    """
+    Report per-statement timings when SQL_QUERY_LOG is enabled.
+
+    Query parameters: recent (number of latest statements to include, default 20)
+    """
+    recent = request.args.get('recent', 20, type=int)
+    return jsonify(get_query_stats(max(0, recent)))
+
+@api_bp.route('/payments/health')
+def payment_gateway_health():
+    """Payment gateway circuit breaker state, call outcomes and latency histograms."""
+    return jsonify(get_payment_gateway_health())
@@ -2,9 +2,8 @@
 Catalog Routes - Book catalog related endpoints
 """
 
-from flask import Blueprint, render_template, request, redirect, url_for, flash
-from database import get_all_books
-from services.library_service import add_book_to_catalog
+from flask import Blueprint, render_template, request, redirect, url_for, flash, current_app
+from services.library_service import add_book_to_catalog, get_catalog_page, CATALOG_PAGE_SIZE
 
 catalog_bp = Blueprint('catalog', __name__)
 
@@ -16,11 +15,18 @@ def index():
 @catalog_bp.route('/catalog')
 def catalog():
     """
-    Display all books in the catalog.
+    Display one page of books in the catalog.
     Implements R2: Book Catalog Display
     """
-    books = get_all_books()
-    return render_template('catalog.html', books=books)
+    page_size = current_app.config.get('CATALOG_PAGE_SIZE', CATALOG_PAGE_SIZE)
+    try:
+        page = get_catalog_page(request.args.get('after'), request.args.get('before'), page_size)
+    except ValueError:
+        flash('Invalid page link. Showing the first page.', 'error')
+        page = get_catalog_page(page_size=page_size)
+
+    return render_template('catalog.html', books=page['books'],
+                           next_cursor=page['next_cursor'], prev_cursor=page['prev_cursor'])
 
 @catalog_bp.route('/add_book', methods=['GET', 'POST'])
 def add_book():
@@ -0,0 +1,15 @@
+"""
+Metrics Routes - Prometheus scrape endpoint
+"""
+
+from flask import Blueprint, Response
+from metrics import render_latest
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('/metrics')
+def metrics():
+    """
+    Request, service and payment gateway metrics in the Prometheus text format.
+    """
+    return Response(render_latest(), mimetype='text/plain; version=0.0.4')
@@ -15,14 +15,20 @@ def search_books():
     """
     search_term = request.args.get('q', '').strip()
     search_type = request.args.get('type', 'title')
+    fuzzy = is_truthy(request.args.get('fuzzy'))
     
     if not search_term:
-        return render_template('search.html', books=[], search_term='', search_type=search_type)
+        return render_template('search.html', books=[], search_term='', search_type=search_type, fuzzy=fuzzy)
     
     # Use business logic function
-    books = search_books_in_catalog(search_term, search_type)
+    books = search_books_in_catalog(search_term, search_type, fuzzy=fuzzy)
     
     if not books:
         flash('Search functionality is not yet implemented.', 'error')
     
-    return render_template('search.html', books=books, search_term=search_term, search_type=search_type)
+    return render_template('search.html', books=books, search_term=search_term, search_type=search_type,
+                           fuzzy=fuzzy)
+
+def is_truthy(value) -> bool:
+    """Query string flags: true/1/yes/on (any case) are on, anything else off."""
+    return str(value).strip().lower() in ('true', '1', 'yes', 'on')
@@ -3,14 +3,69 @@ Library Service Module - Business Logic Functions
 Contains all the core business logic for the Library Management System
 """
 
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+import asyncio
+import base64
+import csv
+import io
+import json
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, TextIO, Tuple, Union
 from database import (
-    get_book_by_id, get_book_by_isbn, get_patron_borrow_count,
-    insert_book, insert_borrow_record, update_book_availability,
-    update_borrow_record_return_date, get_all_books, get_patron_borrowed_books
+    get_book_by_id, get_book_by_isbn, insert_book, insert_books, get_all_books,
+    get_patron_borrowed_books, borrow_book_record, return_book_record, borrow_book_records,
+    return_book_records, search_books, search_books_by_title, count_search_matches, get_books_by_ids,
+    get_book_text_marks,
+    iter_books, iter_borrow_records,
+    get_patron_loans_with_fees, write_fee_snapshot, claim_payment, settle_unknown_payment, record_payment_result
 )
-from services.payment_service import PaymentGateway
+from services import search_cache, search_index
+from services.payment_service import (
+    AsyncPaymentGateway, PaymentGateway, PaymentNotSentError, ThreadedAsyncPaymentGateway, get_payment_gateway,
+    key_argument
+)
+from metrics import GATEWAY_LATENCY, timed, timer
+
+MAX_BORROWED_BOOKS = 5
+MAX_BATCH_ITEMS = 50
+CATALOG_PAGE_SIZE = 50
+SUGGEST_LIMIT = 10
+
+# A payment still 'pending' after this many seconds was abandoned by a worker
+# that died mid-call; it is settled with the provider like an 'unknown' one.
+# Must exceed the longest a gateway call can take.
+PAYMENT_PENDING_TIMEOUT = 120.0
+SEARCH_PAGE_SIZE = 50
+
+# Searches that may match more books than this are paged in title order
+# instead of by relevance, so no page has to read and rank every match
+SEARCH_RANK_LIMIT = 1000
+# Books sampled to estimate how many such a search matches
+SEARCH_ESTIMATE_SAMPLE = 500
+# Books examined per title-ordered page; a rare term gets a short page and a cursor
+SEARCH_SCAN_LIMIT = 2000
+# Results fetched per page while streaming search results
+SEARCH_STREAM_PAGE_SIZE = 200
+
+# Bulk catalog import
+IMPORT_FORMATS = ('csv', 'jsonl')
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 1000
+_NOT_UTF8 = "Row is not valid UTF-8 text."
+_NOT_UTF8_STOPPED = "File is not valid UTF-8 text from here on; the rest was skipped."
+
+# Streaming exports
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_ROWS_PER_CHUNK = 500
+BOOK_EXPORT_FIELDS = ('id', 'title', 'author', 'isbn', 'total_copies', 'available_copies')
+LOAN_EXPORT_FIELDS = ('id', 'patron_id', 'book_id', 'borrow_date', 'due_date', 'return_date')
+
+# Late fee rule: $0.50/day for the first 7 overdue days, then $1.00/day, capped at $15.00
+LATE_FEE_RULE = {
+    'first_week_days': 7,
+    'first_week_rate': 0.50,
+    'daily_rate': 1.00,
+    'max_fee': 15.00,
+}
 
 def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -> Tuple[bool, str]:
     """
@@ -27,36 +82,189 @@ def add_book_to_catalog(title: str, author: str, isbn: str, total_copies: int) -
         tuple: (success: bool, message: str)
     """
     # Input validation
+    error = validate_book(title, author, isbn, total_copies)
+    if error:
+        return False, error
+
+    # Check for duplicate ISBN
+    existing = get_book_by_isbn(isbn)
+    if existing:
+        return False, "A book with this ISBN already exists."
+
+    # Insert new book
+    success = insert_book(title.strip(), author.strip(), isbn, total_copies, total_copies)
+    if success:
+        return True, f'Book "{title.strip()}" has been successfully added to the catalog.'
+    else:
+        return False, "Database error occurred while adding the book."
+
+def validate_book(title: str, author: str, isbn: str, total_copies: int) -> Optional[str]:
+    """
+    Check a new book against the R1 rules.
+
+    Returns:
+        The error message for the first rule broken, or None if the book is valid
+    """
     if not title or not title.strip():
-        return False, "Title is required."
+        return "Title is required."
 
     if len(title.strip()) > 200:
-        return False, "Title must be less than 200 characters."
+        return "Title must be less than 200 characters."
 
     if not author or not author.strip():
-        return False, "Author is required."
+        return "Author is required."
 
     if len(author.strip()) > 100:
-        return False, "Author must be less than 100 characters."
+        return "Author must be less than 100 characters."
 
     if len(isbn) != 13 or not isbn.isdigit():
-        return False, "ISBN must be exactly 13 digits."
+        return "ISBN must be exactly 13 digits."
 
     if not isinstance(total_copies, int) or total_copies <= 0:
-        return False, "Total copies must be a positive integer."
+        return "Total copies must be a positive integer."
 
-    # Check for duplicate ISBN
-    existing = get_book_by_isbn(isbn)
-    if existing:
-        return False, "A book with this ISBN already exists."
+    return None
 
-    # Insert new book
-    success = insert_book(title.strip(), author.strip(), isbn, total_copies, total_copies)
-    if success:
-        return True, f'Book "{title.strip()}" has been successfully added to the catalog.'
-    else:
-        return False, "Database error occurred while adding the book."
+def import_books(stream: TextIO, fmt: str = 'csv', batch_size: int = IMPORT_BATCH_SIZE,
+                 max_errors: int = IMPORT_MAX_ERRORS) -> Dict:
+    """
+    Bulk add books from a CSV or JSONL stream.
+
+    Rows are read one at a time and inserted in transactions of batch_size
+    books, so memory use does not grow with the size of the file. Each row
+    is validated with the R1 rules. Invalid rows and ISBNs already in the
+    catalog are reported and skipped; they do not stop the import.
+
+    Args:
+        stream: Text stream with a header row (csv) or one JSON object per line (jsonl),
+            each with title, author, isbn and total_copies. Open it with
+            errors='surrogateescape' so rows that are not valid UTF-8 are
+            reported one by one; with strict decoding the import stops at the
+            first such row and reports it.
+        fmt: 'csv' or 'jsonl'
+        batch_size: Books inserted per transaction
+        max_errors: Row errors kept in the report (all are counted)
 
+    Returns:
+        dict: rows, imported, failed, errors ([{'line', 'isbn', 'error'}] in line order)
+        and errors_truncated
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format '{fmt}'. Use one of: {', '.join(IMPORT_FORMATS)}.")
+
+    summary = {'rows': 0, 'imported': 0, 'failed': 0, 'errors': [], 'errors_truncated': False}
+    batch, batch_lines = [], {}
+
+    def report(line: int, isbn: Optional[str], message: str):
+        summary['failed'] += 1
+        if len(summary['errors']) < max_errors:
+            summary['errors'].append({'line': line, 'isbn': isbn, 'error': message})
+        else:
+            summary['errors_truncated'] = True
+
+    def flush():
+        try:
+            duplicates = insert_books(batch)
+        except Exception:
+            for book in batch:
+                report(batch_lines[book[2]], book[2], "Database error occurred while adding the book.")
+        else:
+            for isbn in duplicates:
+                report(batch_lines[isbn], isbn, "A book with this ISBN already exists.")
+            summary['imported'] += len(batch) - len(duplicates)
+        batch.clear()
+        batch_lines.clear()
+
+    for line, record, parse_error in _iter_import_records(stream, fmt):
+        summary['rows'] += 1
+        if parse_error:
+            report(line, None, parse_error)
+            continue
+
+        title = str(record.get('title') or '')
+        author = str(record.get('author') or '')
+        isbn = str(record.get('isbn') or '').strip()
+        total_copies = _parse_copies(record.get('total_copies'))
+        error = validate_book(title, author, isbn, total_copies)
+        if error:
+            report(line, isbn or None, error)
+            continue
+        if isbn in batch_lines:
+            report(line, isbn, "A book with this ISBN already exists.")
+            continue
+
+        batch.append((title.strip(), author.strip(), isbn, total_copies, total_copies))
+        batch_lines[isbn] = line
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    summary['errors'].sort(key=lambda e: e['line'])
+    return summary
+
+def _iter_import_records(stream: TextIO, fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Yield (line number, record, parse error) for each data row of an import stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        while True:
+            try:
+                record = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as e:
+                yield reader.line_num, None, f"Malformed CSV row: {e}"
+                continue
+            except UnicodeDecodeError:
+                yield reader.line_num + 1, None, _NOT_UTF8_STOPPED
+                return
+            if not all(_is_utf8(value) for value in record.values() if isinstance(value, str)):
+                yield reader.line_num, None, _NOT_UTF8
+                continue
+            yield reader.line_num, record, None
+    else:
+        lines = enumerate(stream, start=1)
+        line = 0
+        while True:
+            try:
+                line, text = next(lines)
+            except StopIteration:
+                return
+            except UnicodeDecodeError:
+                yield line + 1, None, _NOT_UTF8_STOPPED
+                return
+            if not text.strip():
+                continue
+            if not _is_utf8(text):
+                yield line, None, _NOT_UTF8
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError:
+                yield line, None, "Malformed JSON line."
+                continue
+            if not isinstance(record, dict):
+                yield line, None, "Each line must be a JSON object."
+                continue
+            yield line, record, None
+
+def _is_utf8(text: str) -> bool:
+    """False if the text holds bytes that failed to decode (see errors='surrogateescape')."""
+    try:
+        text.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+def _parse_copies(value):
+    """total_copies as an int when it is a whole number (CSV gives strings); otherwise unchanged."""
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, bool):
+        return None
+    return value
+
+@timed('borrow_book_by_patron')
 def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Allow a patron to borrow a book.
@@ -73,43 +281,22 @@ def borrow_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
 
-    # Check if book exists and is available
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found."
-
-    if book['available_copies'] <= 0:
-        return False, "This book is currently not available."
-
-    # Check patron's current borrowed books count
-    current_borrowed = get_patron_borrow_count(patron_id)
-
-    if current_borrowed >= 5:
-        return False, "You have reached the maximum borrowing limit of 5 books."
-
-    # Create borrow record
     borrow_date = datetime.now()
     due_date = borrow_date + timedelta(days=14)
 
-    # Insert borrow record and update availability
-    borrow_success = insert_borrow_record(patron_id, book_id, borrow_date, due_date)
-    if not borrow_success:
-        return False, "Database error occurred while creating borrow record."
-
-    availability_success = update_book_availability(book_id, -1)
-    if not availability_success:
-        return False, "Database error occurred while updating book availability."
-
-    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+    # Availability check, limit check and both writes happen in one transaction
+    status, book = borrow_book_record(patron_id, book_id, borrow_date, due_date, MAX_BORROWED_BOOKS)
+    return _borrow_result(status, book, due_date)
 
 
+@timed('return_book_by_patron')
 def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     """
     Process book return by a patron.
 
     Implements R4:
       - Accepts patron ID and book ID
-      - Verifies the book was borrowed by the patron (via DB update result)
+      - Verifies the book was borrowed by the patron
       - Records return date
       - Updates available copies (not exceeding total)
       - Calculates and displays any late fees owed
@@ -118,37 +305,121 @@ def return_book_by_patron(patron_id: str, book_id: int) -> Tuple[bool, str]:
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
         return False, "Invalid patron ID. Must be exactly 6 digits."
 
-    # Check book exists
-    book = get_book_by_id(book_id)
-    if not book:
-        return False, "Book not found."
-
-    # Verify there is an active borrow for this patron+book
-    active = get_patron_borrowed_books(patron_id) or []
-    is_active = False
-    for record in active:
-        if record.get("book_id") == book_id:
-            is_active = True
-            break
-    if not is_active:
-        return False, "No borrow record found for this patron and book"
+    # Verify the active borrow, record the return and restore availability atomically
+    status, book, due_date = return_book_record(patron_id, book_id, datetime.now())
 
     # Calculate late fee
-    fee_info = calculate_late_fee_for_book(patron_id, book_id)
-    fee_amount = round(float(fee_info.get("fee_amount", 0.0)), 2)
-    days_overdue = int(fee_info.get("days_overdue", 0))
+    fee_amount, days_overdue = compute_late_fee(due_date) if status == 'ok' else (0.0, 0)
+    return _return_result(status, book, fee_amount, days_overdue)
+
+
+@timed('borrow_books_by_patron')
+def borrow_books_by_patron(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Borrow a stack of books for one patron at once (self-checkout).
+
+    Patron validation and the borrowing limit are checked once and all
+    items are recorded in one transaction. Items are processed in order, so
+    once the limit is reached the remaining books are refused.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books to borrow (at most MAX_BATCH_ITEMS)
+
+    Returns:
+        tuple: (success: bool, message: str, results: list of
+        {'book_id', 'success', 'message'} in book_ids order). success is
+        False only when the whole request is rejected.
+    """
+    error = _validate_batch(patron_id, book_ids)
+    if error:
+        return False, error, []
+
+    borrow_date = datetime.now()
+    due_date = borrow_date + timedelta(days=14)
+    records = borrow_book_records(patron_id, book_ids, borrow_date, due_date, MAX_BORROWED_BOOKS)
+
+    results = []
+    for book_id, (status, book) in zip(book_ids, records):
+        success, message = _borrow_result(status, book, due_date)
+        results.append({'book_id': book_id, 'success': success, 'message': message})
+    borrowed = sum(result['success'] for result in results)
+    return True, f"Borrowed {borrowed} of {len(book_ids)} book(s).", results
+
+
+@timed('return_books_by_patron')
+def return_books_by_patron(patron_id: str, book_ids: List[int]) -> Tuple[bool, str, List[Dict]]:
+    """
+    Return a stack of books for one patron at once (self-checkout).
+
+    All returns are recorded in one transaction and their late fees are
+    assessed together against a single return time.
+
+    Args:
+        patron_id: 6-digit library card ID
+        book_ids: IDs of the books being returned (at most MAX_BATCH_ITEMS)
+
+    Returns:
+        tuple: (success: bool, message: str, results: list of
+        {'book_id', 'success', 'message', 'late_fee', 'days_overdue'} in
+        book_ids order). success is False only when the whole request is rejected.
+    """
+    error = _validate_batch(patron_id, book_ids)
+    if error:
+        return False, error, []
 
-    # Record return date
     return_date = datetime.now()
-    if not update_borrow_record_return_date(patron_id, book_id, return_date):
-        return False, "Database error occurred while recording the return."
+    records = return_book_records(patron_id, book_ids, return_date)
+
+    results, total_fee = [], 0.0
+    for book_id, (status, book, due_date) in zip(book_ids, records):
+        fee_amount, days_overdue = compute_late_fee(due_date, return_date) if status == 'ok' else (0.0, 0)
+        success, message = _return_result(status, book, fee_amount, days_overdue)
+        total_fee += fee_amount
+        results.append({'book_id': book_id, 'success': success, 'message': message,
+                        'late_fee': fee_amount, 'days_overdue': days_overdue})
+    returned = sum(result['success'] for result in results)
+    return True, f"Returned {returned} of {len(book_ids)} book(s). Total late fees: ${total_fee:.2f}.", results
+
 
-    # Increment availability without exceeding total
-    if book["available_copies"] < book["total_copies"]:
-        if not update_book_availability(book_id, +1):
-            return False, "Database error occurred while updating book availability."
+def _validate_batch(patron_id: str, book_ids: List[int]) -> Optional[str]:
+    if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
+        return "Invalid patron ID. Must be exactly 6 digits."
+    if not book_ids:
+        return "At least one book ID is required."
+    if len(book_ids) > MAX_BATCH_ITEMS:
+        return f"At most {MAX_BATCH_ITEMS} books can be processed at once."
+    if not all(isinstance(book_id, int) and not isinstance(book_id, bool) for book_id in book_ids):
+        return "Invalid book ID."
+    return None
+
+
+def _borrow_result(status: str, book: Optional[Dict], due_date: datetime) -> Tuple[bool, str]:
+    if status == 'not_found':
+        return False, "Book not found."
+
+    if status == 'unavailable':
+        return False, "This book is currently not available."
+
+    if status == 'limit_reached':
+        return False, f"You have reached the maximum borrowing limit of {MAX_BORROWED_BOOKS} books."
+
+    if status != 'ok':
+        return False, "Database error occurred while creating borrow record."
+
+    return True, f'Successfully borrowed "{book["title"]}". Due date: {due_date.strftime("%Y-%m-%d")}.'
+
+
+def _return_result(status: str, book: Optional[Dict], fee_amount: float, days_overdue: int) -> Tuple[bool, str]:
+    if status == 'not_found':
+        return False, "Book not found."
+
+    if status == 'no_record':
+        return False, "No borrow record found for this patron and book"
+
+    if status != 'ok':
+        return False, "Database error occurred while recording the return."
 
-    # Final message
     if days_overdue > 0 and fee_amount > 0:
         return True, (
             f'Book "{book["title"]}" returned. Your late fee is: '
@@ -165,45 +436,90 @@ def calculate_late_fee_for_book(patron_id: str, book_id: int) -> Dict:
         return {'fee_amount': 0.00, 'days_overdue': 0, 'status': 'Invalid patron ID'}
 
     # Find borrow record
-    due_date = None
+    due_date = loan_id = None
     for record in (get_patron_borrowed_books(patron_id) or []):
         if record.get("book_id") == book_id:
             due_date = record.get("due_date")
+            loan_id = record.get("loan_id")
             break
 
     if not isinstance(due_date, datetime):
         return {'fee_amount': 0.00, 'days_overdue': 0, 'status': 'Borrow record not found'}
 
+    fee_amount, days_overdue = compute_late_fee(due_date)
+
+    return {
+        'fee_amount': fee_amount,
+        'days_overdue': days_overdue,
+        'status': 'OK',
+        'loan_id': loan_id
+    }
+
+
+def compute_late_fee(due_date: datetime, now: Optional[datetime] = None) -> Tuple[float, int]:
+    """
+    Apply LATE_FEE_RULE to a due date.
+
+    Returns:
+        tuple: (fee_amount: float, days_overdue: int)
+    """
     # Calculate overdue days
-    now = datetime.now()
+    if now is None:
+        now = datetime.now()
     days_overdue = (now.date() - due_date.date()).days
     if days_overdue < 0:
         days_overdue = 0
 
     # Calculate fee
+    first_week_days = LATE_FEE_RULE['first_week_days']
     if days_overdue == 0:
         fee_amount = 0.00
-    elif days_overdue <= 7:
-        fee_amount = days_overdue * 0.50
+    elif days_overdue <= first_week_days:
+        fee_amount = days_overdue * LATE_FEE_RULE['first_week_rate']
     else:
-        first_week_fee = 7 * 0.50
-        remaining_days = days_overdue - 7
-        fee_amount = first_week_fee + remaining_days * 1.00
+        first_week_fee = first_week_days * LATE_FEE_RULE['first_week_rate']
+        remaining_days = days_overdue - first_week_days
+        fee_amount = first_week_fee + remaining_days * LATE_FEE_RULE['daily_rate']
+
+    # Cap fee
+    if fee_amount > LATE_FEE_RULE['max_fee']:
+        fee_amount = LATE_FEE_RULE['max_fee']
+
+    return round(fee_amount, 2), days_overdue
 
-    # Cap fee at $15
-    if fee_amount > 15.00:
-        fee_amount = 15.00
 
+def run_fee_batch(as_of: Optional[datetime] = None) -> Dict:
+    """
+    Compute the outstanding late fee on every overdue loan and record per-patron
+    totals in the fee_snapshots table (the end-of-day fee run).
+
+    Args:
+        as_of: Date to assess fees on (defaults to today)
+
+    Returns:
+        dict: snapshot_date, patron_totals (patron_id -> fee), num_patrons, total_late_fees
+    """
+    if as_of is None:
+        as_of = datetime.now()
+
+    totals = write_fee_snapshot(as_of, LATE_FEE_RULE)
     return {
-        'fee_amount': round(fee_amount,2),
-        'days_overdue': days_overdue,
-        'status': 'OK'
+        "snapshot_date": as_of.date().isoformat(),
+        "patron_totals": totals,
+        "num_patrons": len(totals),
+        "total_late_fees": round(sum(totals.values()), 2),
     }
 
 
-def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
+@timed('search_books_in_catalog')
+def search_books_in_catalog(search_term: str, search_type: str, fuzzy: bool = False) -> List[Dict]:
     """
     Search for books in the catalog.
+    Implements R6: title/author partial matches, ranked by relevance; ISBN exact match.
+
+    With fuzzy=True, title/author searches also return books whose words are
+    within a couple of typos of the term's words, after the exact matches,
+    and every result has a match_distance (0 for exact matches).
     """
     if search_type not in {"title", "author", "isbn"}:
         return []
@@ -215,33 +531,191 @@ def search_books_in_catalog(search_term: str, search_type: str) -> List[Dict]:
     if not term:
         return []
 
-    books = get_all_books()
-    matches = []
-
-    # Search by title
-    if search_type == "title":
-        t = term.lower()
-        for b in books:
-            title = b.get("title")
-            if isinstance(title, str) and t in title.lower():
-                matches.append(b)
-
-    # Search by author
-    elif search_type == "author":
-        t = term.lower()
-        for b in books:
-            author = b.get("author")
-            if isinstance(author, str) and t in author.lower():
-                matches.append(b)
-
-    # Search by ISBN (exact match)
-    elif search_type == "isbn":
-        for b in books:
-            isbn = str(b.get("isbn"))
-            if isbn == term:
-                matches.append(b)
-
-    return matches
+    # Search by ISBN (exact match, served by the UNIQUE index)
+    if search_type == "isbn":
+        book = get_book_by_isbn(term)
+        return [book] if book else []
+
+    # Title/author matching is case-insensitive, so case variants share a cache entry
+    if not search_cache.ENABLED:
+        return _search_text(term, search_type, fuzzy)
+    return search_cache.search_cache.get_or_compute(
+        ('search', search_type, term.lower(), fuzzy), lambda: _search_text(term, search_type, fuzzy))
+
+def _search_text(term: str, search_type: str, fuzzy: bool) -> List[Dict]:
+    # Search by title or author (partial, case-insensitive, ranked): the
+    # in-memory trigram index when it can answer, otherwise SQLite
+    if fuzzy and search_index.ENABLED:
+        return search_index.fuzzy_search(term, search_type)
+    if search_index.ENABLED and len(term) >= search_index.MIN_TERM_LENGTH:
+        return search_index.search(term, search_type)
+    return search_books(term, search_type)
+
+def search_books_page(search_term: str, search_type: str, limit: int = SEARCH_PAGE_SIZE,
+                      cursor: Optional[str] = None, fuzzy: bool = False) -> Dict:
+    """
+    One page of search_books_in_catalog() results.
+
+    Most searches are ranked as search_books_in_catalog() ranks them and
+    paged by position, with an exact total. Title/author searches that may
+    match more than SEARCH_RANK_LIMIT books, and terms too short for the
+    search index, are listed in title order instead (exact matches only,
+    even with fuzzy=True) and their total is estimated from a sample. Such a
+    page examines at most SEARCH_SCAN_LIMIT books, so when the term is rare
+    it may hold fewer than `limit` books (even none) and still have a
+    next_cursor. A fuzzy search whose typo matches may number more than
+    SEARCH_RANK_LIMIT is ranked on its exact matches only.
+
+    Args:
+        cursor: next_cursor from a previous page of the same search
+
+    Returns:
+        dict: books, next_cursor (None on the last page), total,
+        total_exact and order ('relevance' or 'title')
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    position = _decode_search_cursor(cursor) if cursor else None
+    term = str(search_term).strip() if search_term is not None else ""
+    population = _broad_search_population(term, search_type)
+
+    if population is None:
+        if position is not None and not isinstance(position, int):
+            raise ValueError("Invalid cursor.")
+        offset = position or 0
+        if fuzzy and _broad_fuzzy_search(term, search_type):
+            books = [dict(book, match_distance=0) for book in search_books_in_catalog(term, search_type)]
+        else:
+            books = search_books_in_catalog(term, search_type, fuzzy=fuzzy)
+        end = offset + limit
+        return {
+            "books": books[offset:end],
+            "next_cursor": _encode_search_cursor(end) if end < len(books) else None,
+            "total": len(books),
+            "total_exact": True,
+            "order": "relevance",
+        }
+
+    if position is not None and not isinstance(position, tuple):
+        raise ValueError("Invalid cursor.")
+    # Fetch one extra row to learn whether another page exists
+    books, resume = search_books_by_title(term, search_type, after=position, limit=limit + 1,
+                                          scan_limit=SEARCH_SCAN_LIMIT)
+    if len(books) > limit:
+        books = books[:limit]
+        resume = (books[-1]["title"], books[-1]["id"])
+    if fuzzy:
+        for book in books:
+            book["match_distance"] = 0
+    if position is None and resume is None:
+        total, total_exact = len(books), True
+    else:
+        total, total_exact = _estimate_matches(term, search_type, population)
+    return {
+        "books": books,
+        "next_cursor": _encode_search_cursor(resume) if resume else None,
+        "total": total,
+        "total_exact": total_exact,
+        "order": "title",
+    }
+
+def stream_search_results(search_term: str, search_type: str, limit: int, cursor: Optional[str] = None,
+                          fuzzy: bool = False) -> Tuple[Dict, Iterator[str]]:
+    """
+    Up to `limit` results of a search as NDJSON lines, fetched a page at a time.
+
+    The first page is read before returning, so a bad cursor raises here and
+    the total is known before anything is sent. After the books comes a
+    final {"next_cursor": ...} line, which also tells clients the stream is
+    complete.
+
+    Returns:
+        tuple: ({total, total_exact, order}, iterator of NDJSON lines)
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    page = search_books_page(search_term, search_type, min(limit, SEARCH_STREAM_PAGE_SIZE), cursor, fuzzy)
+    summary = {key: page[key] for key in ("total", "total_exact", "order")}
+
+    def lines(page: Dict) -> Iterator[str]:
+        remaining = limit
+        while True:
+            books = page["books"][:remaining]
+            for book in books:
+                yield json.dumps(book) + "\n"
+            remaining -= len(books)
+            if not page["next_cursor"] or not remaining:
+                break
+            page = search_books_page(search_term, search_type, min(remaining, SEARCH_STREAM_PAGE_SIZE),
+                                     page["next_cursor"], fuzzy)
+        yield json.dumps({"next_cursor": page["next_cursor"]}) + "\n"
+    return summary, lines(page)
+
+def _broad_search_population(term: str, search_type: str) -> Optional[Sequence[int]]:
+    """Ids of the books a search too broad to rank may match, or None if it can be ranked."""
+    if search_type not in {"title", "author"} or not term:
+        return None
+    if len(term) < search_index.MIN_TERM_LENGTH:
+        return range(1, get_book_text_marks()[0] + 1)
+    if search_index.ENABLED:
+        ids = search_index.match_candidates(term, search_type)
+        if len(ids) > SEARCH_RANK_LIMIT:
+            return ids
+    elif count_search_matches(term, search_type, SEARCH_RANK_LIMIT + 1) > SEARCH_RANK_LIMIT:
+        return range(1, get_book_text_marks()[0] + 1)
+    return None
+
+def _broad_fuzzy_search(term: str, search_type: str) -> bool:
+    """Whether the typo matches of a fuzzy search may number more than SEARCH_RANK_LIMIT."""
+    if not search_index.ENABLED or search_type not in {"title", "author"}:
+        return False
+    return search_index.fuzzy_match_count(term, search_type) > SEARCH_RANK_LIMIT
+
+def _estimate_matches(term: str, search_type: str, population: Sequence[int]) -> Tuple[int, bool]:
+    """(number of books in population matching the term, whether that number is exact)"""
+    step = max(1, -(-len(population) // SEARCH_ESTIMATE_SAMPLE))
+    sample = population[::step]
+    needle = term.lower()
+    matches = sum(needle in book[search_type].lower() for book in get_books_by_ids(list(sample)))
+    if step == 1:
+        return matches, True
+    return round(matches * len(population) / len(sample)), False
+
+def _encode_search_cursor(position: Union[int, Tuple[str, int]]) -> str:
+    """An offset into ranked results, or the (title, id) of the last book of a title-ordered page."""
+    raw = json.dumps(position, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_search_cursor(cursor: str) -> Union[int, Tuple[str, int]]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError as e:
+        raise ValueError("Invalid cursor.") from e
+    if type(position) is int and position >= 0:
+        return position
+    if (isinstance(position, list) and len(position) == 2 and isinstance(position[0], str)
+            and type(position[1]) is int):
+        return position[0], position[1]
+    raise ValueError("Invalid cursor.")
+
+def suggest_search_terms(prefix: str, search_type: str, limit: int = SUGGEST_LIMIT) -> List[Dict]:
+    """
+    Type-ahead completions for the search page.
+
+    Returns:
+        list: up to `limit` {'value', 'books'} titles or authors starting
+        with the prefix (case-insensitive, alphabetical), then ones with a
+        later word starting with it. Empty for ISBN searches or when the
+        search index is turned off.
+    """
+    if search_type not in {"title", "author"} or prefix is None or not search_index.ENABLED:
+        return []
+    prefix = str(prefix).strip()
+    if not prefix:
+        return []
+    return search_index.suggest(prefix, search_type, limit)
 
 def get_patron_status_report(patron_id: str) -> Dict:
     """
@@ -258,33 +732,29 @@ def get_patron_status_report(patron_id: str) -> Dict:
             "status": "Invalid patron ID"
         }
 
-    active = get_patron_borrowed_books(patron_id)
+    # One query returns every active loan with its fee already computed
+    loans = get_patron_loans_with_fees(patron_id, datetime.now(), LATE_FEE_RULE)
     borrowed = []
-    if active is None:
-        active = []
-    num_currently_borrowed = len(active)
     total_late_fees = 0.00
     #Can't implement borrowing history without database functions for it
     #borrowing_history = []
 
-    for record in active:
-        fee_info = calculate_late_fee_for_book(patron_id, record.get("book_id"))
-        if fee_info['status'] == 'OK':
-            total_late_fees += fee_info['fee_amount']
-            total_late_fees = round(total_late_fees, 2)
-            borrowed.append({
-                'book_id': record.get("book_id"),
-                'title': record.get("title"),
-                'author': record.get("author"),
-                'borrow_date': record.get("borrow_date"),
-                'due_date': record.get("due_date"),
-                'is_overdue': fee_info['days_overdue'] > 0,
-                'late_fee': fee_info['fee_amount']
-            })
+    for loan in loans:
+        late_fee = round(loan['late_fee'], 2)
+        total_late_fees += late_fee
+        borrowed.append({
+            'book_id': loan['book_id'],
+            'title': loan['title'],
+            'author': loan['author'],
+            'borrow_date': loan['borrow_date'],
+            'due_date': loan['due_date'],
+            'is_overdue': loan['days_overdue'] > 0,
+            'late_fee': late_fee
+        })
     return {
         "currently_borrowed": borrowed,
         "total_late_fees": round(total_late_fees,2),
-        "num_currently_borrowed": num_currently_borrowed,
+        "num_currently_borrowed": len(loans),
         #"borrowing_history": [],
     }
 
@@ -292,20 +762,139 @@ def get_catalog_display() -> List[Dict]:
     """
     R2: returns list of books for catalog display
     """
-    rows = get_all_books()
-    result = []
-    for r in rows:
-        result.append({
-            "id": r["id"],
-            "title": r["title"],
-            "author": r["author"],
-            "isbn": r["isbn"],
-            "available_copies": int(r["available_copies"]),
-            "total_copies": int(r["total_copies"]),
-        })
-    return result
+    return [_catalog_entry(r) for r in get_all_books()]
+
+
+def get_catalog_page(after: Optional[str] = None, before: Optional[str] = None,
+                     page_size: int = CATALOG_PAGE_SIZE) -> Dict:
+    """
+    R2: returns one page of the catalog, ordered by title.
+
+    Pages are keyset (seek) based on (title, id), so fetching a deep page
+    costs the same as fetching the first one.
 
+    Args:
+        after: next_cursor from a previous page
+        before: prev_cursor from a previous page
+        page_size: Number of books per page
+
+    Returns:
+        dict: books, next_cursor and prev_cursor (None when there is no such page)
+
+    Raises:
+        ValueError: If a cursor is malformed
+    """
+    after_key = decode_cursor(after) if after else None
+    before_key = decode_cursor(before) if before else None
+
+    # Fetch one extra row to learn whether another page exists
+    rows = get_all_books(limit=page_size + 1, after=after_key,
+                         before=None if after_key else before_key)
+
+    if before_key and not after_key:
+        has_prev = len(rows) > page_size
+        rows = rows[-page_size:] if has_prev else rows
+        has_next = True
+    else:
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after_key is not None
+
+    return {
+        "books": [_catalog_entry(r) for r in rows],
+        "next_cursor": encode_cursor(rows[-1]) if rows and has_next else None,
+        "prev_cursor": encode_cursor(rows[0]) if rows and has_prev else None,
+    }
+
+
+def encode_cursor(book: Dict) -> str:
+    """Encode a book's (title, id) catalog position as an opaque URL-safe cursor."""
+    raw = json.dumps([book["title"], book["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """Decode a cursor made by encode_cursor(); raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        title, book_id = json.loads(raw)
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor.") from e
+    if not isinstance(title, str) or not isinstance(book_id, int):
+        raise ValueError("Invalid cursor.")
+    return title, book_id
+
+
+def _catalog_entry(r: Dict) -> Dict:
+    return {
+        "id": r["id"],
+        "title": r["title"],
+        "author": r["author"],
+        "isbn": r["isbn"],
+        "available_copies": int(r["available_copies"]),
+        "total_copies": int(r["total_copies"]),
+    }
+
+
+def export_books(fmt: str = 'csv') -> Iterator[str]:
+    """
+    Stream the whole catalog as CSV or NDJSON text chunks.
+
+    Rows are read from the cursor in batches and written out as they
+    arrive, so memory use does not depend on the size of the catalog.
+
+    Raises:
+        ValueError: if fmt is not one of EXPORT_FORMATS
+    """
+    _check_export_format(fmt)
+    return _export_rows(iter_books(), BOOK_EXPORT_FIELDS, fmt)
+
+
+def export_loans(fmt: str = 'csv', start: Optional[date] = None, end: Optional[date] = None) -> Iterator[str]:
+    """
+    Stream borrow records as CSV or NDJSON text chunks, in borrow_date order.
+
+    Args:
+        fmt: 'csv' or 'ndjson'
+        start: Only loans borrowed on or after this date
+        end: Only loans borrowed on or before this date
 
+    Raises:
+        ValueError: if fmt is not one of EXPORT_FORMATS or start is after end
+    """
+    _check_export_format(fmt)
+    if start is not None and end is not None and start > end:
+        raise ValueError("Start date must be on or before end date.")
+    return _export_rows(iter_borrow_records(start, end), LOAN_EXPORT_FIELDS, fmt)
+
+
+def _check_export_format(fmt: str):
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}'. Use one of: {', '.join(EXPORT_FORMATS)}.")
+
+
+def _export_rows(rows: Iterator[Dict], fields: Tuple[str, ...], fmt: str,
+                 rows_per_chunk: int = EXPORT_ROWS_PER_CHUNK) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(fields)
+
+    for count, row in enumerate(rows, start=1):
+        if writer:
+            writer.writerow([row[field] for field in fields])
+        else:
+            buffer.write(json.dumps({field: row[field] for field in fields}) + '\n')
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@timed('pay_late_fees')
 def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway = None) -> Tuple[
     bool, str, Optional[str]]:
     """
@@ -328,48 +917,232 @@ def pay_late_fees(patron_id: str, book_id: int, payment_gateway: PaymentGateway
         mock_gateway.process_payment.return_value = (True, "txn_123", "Success")
         success, msg, txn = pay_late_fees("123456", 1, mock_gateway)
     """
+    error, fee_amount, book, loan_id = _late_fee_payment_details(patron_id, book_id)
+    if error:
+        return False, error, None
+
+    # Use provided gateway or the app's shared one
+    if payment_gateway is None:
+        payment_gateway = get_payment_gateway()
+
+    # Repeat requests for the same fee are answered from the ledger
+    idempotency_key = payment_idempotency_key(patron_id, book_id, loan_id, fee_amount)
+    while True:
+        status, payment, result = _claim_late_fee_payment(idempotency_key, patron_id, book_id, loan_id,
+                                                          fee_amount)
+        if status != 'unknown':
+            break
+        # An earlier attempt may have charged the patron: ask the provider first
+        try:
+            found = payment_gateway.verify_payment_status(idempotency_key=payment['idempotency_key'])
+        except Exception:
+            found = None
+        result = _settle_unknown_payment(payment['idempotency_key'], found)
+        if result:
+            return result
+    if status != 'claimed':
+        return result
+
+    # Process payment through external gateway
+    # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
+    try:
+        with timer(GATEWAY_LATENCY, method='process_payment') as call:
+            success, transaction_id, message = payment_gateway.process_payment(
+                patron_id=patron_id,
+                amount=payment['amount'],
+                description=f"Late fees for '{book['title']}'",
+                **key_argument(payment_gateway.process_payment, idempotency_key)
+            )
+            call.outcome = 'ok' if success else 'declined'
+    except Exception as e:
+        # Handle payment gateway errors
+        return _gateway_error_result(idempotency_key, e)
+
+    return _payment_result(idempotency_key, success, transaction_id, message)
+
+
+@timed('pay_late_fees_bulk')
+def pay_late_fees_bulk(payments: List[Tuple[str, int]], payment_gateway: AsyncPaymentGateway = None,
+                       max_concurrency: int = 50) -> List[Tuple[bool, str, Optional[str]]]:
+    """
+    Settle late fees for many patrons at once.
+
+    Gateway calls run concurrently (at most max_concurrency in flight), so a
+    batch takes roughly one gateway round trip per max_concurrency payments
+    instead of one per payment.
+
+    Args:
+        payments: (patron_id, book_id) pairs to charge
+        payment_gateway: Async payment gateway instance (injectable for testing);
+            by default the app's shared gateway, called from worker threads
+        max_concurrency: Maximum number of gateway calls in flight
+
+    Returns:
+        list: one pay_late_fees() result tuple per pair, in the same order
+    """
+    return asyncio.run(pay_late_fees_bulk_async(payments, payment_gateway, max_concurrency))
+
+
+async def pay_late_fees_bulk_async(payments: List[Tuple[str, int]], payment_gateway: AsyncPaymentGateway = None,
+                                   max_concurrency: int = 50) -> List[Tuple[bool, str, Optional[str]]]:
+    """Coroutine behind pay_late_fees_bulk(), for callers already running an event loop."""
+    if payment_gateway is None:
+        gateway = ThreadedAsyncPaymentGateway(get_payment_gateway(), max_workers=max_concurrency)
+        try:
+            return await pay_late_fees_bulk_async(payments, gateway, gateway.max_workers)
+        finally:
+            gateway.close()
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def settle(patron_id: str, book_id: int) -> Tuple[bool, str, Optional[str]]:
+        error, fee_amount, book, loan_id = _late_fee_payment_details(patron_id, book_id)
+        if error:
+            return False, error, None
+        idempotency_key = payment_idempotency_key(patron_id, book_id, loan_id, fee_amount)
+        async with semaphore:
+            while True:
+                status, payment, result = _claim_late_fee_payment(idempotency_key, patron_id, book_id, loan_id,
+                                                                  fee_amount)
+                if status != 'unknown':
+                    break
+                try:
+                    found = await payment_gateway.verify_payment_status(idempotency_key=payment['idempotency_key'])
+                except Exception:
+                    found = None
+                result = _settle_unknown_payment(payment['idempotency_key'], found)
+                if result:
+                    return result
+            if status != 'claimed':
+                return result
+            try:
+                with timer(GATEWAY_LATENCY, method='process_payment') as call:
+                    success, transaction_id, message = await payment_gateway.process_payment(
+                        patron_id=patron_id,
+                        amount=payment['amount'],
+                        description=f"Late fees for '{book['title']}'",
+                        **key_argument(payment_gateway.process_payment, idempotency_key)
+                    )
+                    call.outcome = 'ok' if success else 'declined'
+            except Exception as e:
+                return _gateway_error_result(idempotency_key, e)
+        return _payment_result(idempotency_key, success, transaction_id, message)
+
+    # gather() returns results in submission order
+    return list(await asyncio.gather(*(settle(patron_id, book_id) for patron_id, book_id in payments)))
+
+
+def payment_idempotency_key(patron_id: str, book_id: int, loan_id: Optional[int], fee_amount: float) -> str:
+    """
+    Ledger key identifying one late fee payment: the patron, the book, the
+    loan the fee accrued on and the fee so far, so a fee that grew after it
+    was paid can be paid again.
+    """
+    return f"{patron_id}:{book_id}:{loan_id}:{round(fee_amount * 100)}"
+
+
+def _late_fee_payment_details(patron_id: str, book_id: int) -> Tuple[Optional[str], float, Optional[Dict],
+                                                                     Optional[int]]:
+    """
+    Validate a late fee payment before it is sent to the gateway.
+
+    Returns:
+        tuple: (error_message or None, fee_amount, book, loan_id)
+    """
     # Validate patron ID
     if not patron_id or not patron_id.isdigit() or len(patron_id) != 6:
-        return False, "Invalid patron ID. Must be exactly 6 digits.", None
+        return "Invalid patron ID. Must be exactly 6 digits.", 0.0, None, None
 
     # Calculate late fee first
     fee_info = calculate_late_fee_for_book(patron_id, book_id)
 
     # Check if there's a fee to pay
     if not fee_info or 'fee_amount' not in fee_info:
-        return False, "Unable to calculate late fees.", None
+        return "Unable to calculate late fees.", 0.0, None, None
 
     fee_amount = fee_info.get('fee_amount', 0.0)
+    loan_id = fee_info.get('loan_id')
 
     if fee_amount <= 0:
-        return False, "No late fees to pay for this book.", None
+        return "No late fees to pay for this book.", 0.0, None, loan_id
 
     # Get book details for payment description
     book = get_book_by_id(book_id)
     if not book:
-        return False, "Book not found.", None
+        return "Book not found.", fee_amount, None, loan_id
 
-    # Use provided gateway or create new one
-    if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+    return None, fee_amount, book, loan_id
 
-    # Process payment through external gateway
-    # THIS IS WHAT YOU SHOULD MOCK IN THEIR TESTS!
-    try:
-        success, transaction_id, message = payment_gateway.process_payment(
-            patron_id=patron_id,
-            amount=fee_amount,
-            description=f"Late fees for '{book['title']}'"
-        )
 
-        if success:
-            return True, f"Payment successful! {message}", transaction_id
-        else:
-            return False, f"Payment failed: {message}", None
+def _claim_late_fee_payment(idempotency_key: str, patron_id: str, book_id: int, loan_id: Optional[int],
+                            fee_amount: float) -> Tuple[str, Optional[Dict], Optional[Tuple[bool, str, Optional[str]]]]:
+    """
+    Claim the ledger entry for a payment.
 
-    except Exception as e:
-        # Handle payment gateway errors
-        return False, f"Payment processing error: {str(e)}", None
+    Returns:
+        tuple: ('claimed', entry, None) if the gateway should be charged
+        entry['amount'], ('unknown', entry, None) if an earlier attempt
+        (possibly for an older key of the loan) must be settled with
+        _settle_unknown_payment() first, otherwise ('answered', None, result)
+        with the pay_late_fees() result to return instead
+    """
+    stale_before = (datetime.now() - timedelta(seconds=PAYMENT_PENDING_TIMEOUT)).isoformat()
+    status, payment = claim_payment(idempotency_key, patron_id, book_id, loan_id, fee_amount, stale_before)
+    if status in ('claimed', 'unknown'):
+        return status, payment, None
+    if status == 'completed':
+        return 'answered', None, (True, f"Payment already processed. {payment['message'] or ''}".rstrip(),
+                                  payment['transaction_id'])
+    if status == 'paid':
+        return 'answered', None, (False, "Late fees for this book have already been paid.", None)
+    if status == 'pending':
+        return 'answered', None, (False, "A payment for this late fee is already in progress.", None)
+    return 'answered', None, (False, "Payment processing error: could not record payment.", None)
+
+
+def _settle_unknown_payment(idempotency_key: str,
+                            found: Optional[Dict]) -> Optional[Tuple[bool, str, Optional[str]]]:
+    """
+    Settle an 'unknown' ledger entry from the provider's verify_payment_status() answer.
+
+    A charge the provider holds is recorded as completed; if it holds none,
+    the entry is recorded as failed and the fee can be claimed again.
+    Anything else (no answer, the charge still in flight) leaves it unknown,
+    so the patron is not charged twice.
+
+    Returns:
+        None once the entry is settled, otherwise the pay_late_fees() result to return
+    """
+    status = found.get('status') if isinstance(found, dict) else None
+    if status == 'completed':
+        transaction_id = found.get('transaction_id') or found.get('id')
+        settle_unknown_payment(idempotency_key, 'completed', transaction_id,
+                               "Payment confirmed by the payment provider.")
+        return None
+    if status == 'not_found':
+        settle_unknown_payment(idempotency_key, 'failed', message="Not received by the payment provider.")
+        return None
+    return (False, "The outcome of an earlier payment attempt is still being confirmed "
+                   "with the payment provider. Please try again shortly.", None)
+
+
+def _gateway_error_result(idempotency_key: str, error: Exception) -> Tuple[bool, str, None]:
+    """
+    Record a gateway exception. Only requests that never reached the provider
+    count as failed; after any other error the charge may have gone through.
+    """
+    status = 'failed' if isinstance(error, PaymentNotSentError) else 'unknown'
+    record_payment_result(idempotency_key, status, message=str(error))
+    return False, f"Payment processing error: {str(error)}", None
+
+
+def _payment_result(idempotency_key: str, success: bool, transaction_id: str,
+                    message: str) -> Tuple[bool, str, Optional[str]]:
+    """Record the gateway outcome in the ledger and build the pay_late_fees() result."""
+    if success:
+        record_payment_result(idempotency_key, 'completed', transaction_id, message)
+        return True, f"Payment successful! {message}", transaction_id
+    record_payment_result(idempotency_key, 'failed', message=message)
+    return False, f"Payment failed: {message}", None
 
 
 def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway: PaymentGateway = None) -> Tuple[
@@ -397,14 +1170,16 @@ def refund_late_fee_payment(transaction_id: str, amount: float, payment_gateway:
     if amount > 15.00:  # Maximum late fee per book
         return False, "Refund amount exceeds maximum late fee."
 
-    # Use provided gateway or create new one
+    # Use provided gateway or the app's shared one
     if payment_gateway is None:
-        payment_gateway = PaymentGateway()
+        payment_gateway = get_payment_gateway()
 
     # Process refund through external gateway
     # THIS IS WHAT YOU SHOULD MOCK IN YOUR TESTS!
     try:
-        success, message = payment_gateway.refund_payment(transaction_id, amount)
+        with timer(GATEWAY_LATENCY, method='refund_payment') as call:
+            success, message = payment_gateway.refund_payment(transaction_id, amount)
+            call.outcome = 'ok' if success else 'declined'
 
         if success:
             return True, message
@@ -6,10 +6,106 @@ For Assignment 3: You will learn to mock this service in their tests
 since we cannot make actual payment API calls during testing.
 """
 
+import asyncio
+import functools
+import inspect
+import threading
 import requests
-from typing import Dict, Tuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+from typing import Callable, Dict, Optional, Tuple
+from urllib3.exceptions import ConnectTimeoutError
+from urllib3.util.retry import Retry
 import time
 
+from metrics import Histogram
+
+DEFAULT_BASE_URL = "https://api.payment-gateway.example.com"
+
+# Simulated round-trip times (seconds) of the provider's endpoints
+PAYMENT_LATENCY = 0.5
+REFUND_LATENCY = 0.5
+STATUS_LATENCY = 0.3
+
+
+def _simulate_payment(patron_id: str, amount: float) -> Tuple[bool, str, str]:
+    if amount <= 0:
+        return False, "", "Invalid amount: must be greater than 0"
+    
+    if amount > 1000:
+        return False, "", "Payment declined: amount exceeds limit"
+    
+    if len(patron_id) != 6:
+        return False, "", "Invalid patron ID format"
+    
+    # Simulate successful payment
+    transaction_id = f"txn_{patron_id}_{int(time.time())}"
+    return True, transaction_id, f"Payment of ${amount:.2f} processed successfully"
+
+
+def _simulate_refund(transaction_id: str, amount: float) -> Tuple[bool, str]:
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return False, "Invalid transaction ID"
+    
+    if amount <= 0:
+        return False, "Invalid refund amount"
+    
+    refund_id = f"refund_{transaction_id}_{int(time.time())}"
+    return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"
+
+
+def _simulate_payment_status(transaction_id: str) -> Dict:
+    if not transaction_id or not transaction_id.startswith("txn_"):
+        return {"status": "not_found", "message": "Transaction not found"}
+    
+    # Simulate status check
+    return {
+        "transaction_id": transaction_id,
+        "status": "completed",
+        "amount": 10.50,
+        "timestamp": time.time()
+    }
+
+
+class PaymentNotSentError(Exception):
+    """Raised when a request never reached the provider, so nothing was charged."""
+
+
+def key_argument(method: Callable, idempotency_key: Optional[str]) -> Dict:
+    """
+    idempotency_key as a keyword argument for a gateway method, left out when
+    not given or when the method predates idempotency keys (a gateway written
+    against the original signatures).
+    """
+    if idempotency_key is None:
+        return {}
+    try:
+        parameters = inspect.signature(method).parameters.values()
+    except (TypeError, ValueError):
+        return {"idempotency_key": idempotency_key}
+    if any(p.name == "idempotency_key" or p.kind is p.VAR_KEYWORD for p in parameters):
+        return {"idempotency_key": idempotency_key}
+    return {}
+
+
+class _ChargesByKey:
+    """Transaction ids of the simulated charges, by the idempotency key they were made with."""
+
+    def __init__(self):
+        self._ids: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def record(self, idempotency_key: Optional[str], result: Tuple[bool, str, str]) -> Tuple[bool, str, str]:
+        if idempotency_key is not None and result[0]:
+            with self._lock:
+                self._ids[idempotency_key] = result[1]
+        return result
+
+    def get(self, idempotency_key: str) -> Optional[str]:
+        with self._lock:
+            return self._ids.get(idempotency_key)
+
 
 class PaymentGateway:
     """
@@ -30,9 +126,11 @@ class PaymentGateway:
             api_key: API key for authentication (default is test key)
         """
         self.api_key = api_key
-        self.base_url = "https://api.payment-gateway.example.com"
+        self.base_url = DEFAULT_BASE_URL
+        self._charges = _ChargesByKey()
     
-    def process_payment(self, patron_id: str, amount: float, description: str = "") -> Tuple[bool, str, str]:
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
         """
         Process a payment through the external gateway.
         
@@ -43,6 +141,8 @@ class PaymentGateway:
             patron_id: 6-digit patron/customer ID
             amount: Payment amount in dollars
             description: Payment description
+            idempotency_key: Caller's reference for the charge, for
+                verify_payment_status(idempotency_key=...) lookups
             
         Returns:
             tuple: (success: bool, transaction_id: str, message: str)
@@ -52,7 +152,7 @@ class PaymentGateway:
             success, txn_id, msg = gateway.process_payment("123456", 10.50, "Late fees")
         """
         # Simulate API call delay
-        time.sleep(0.5)
+        time.sleep(PAYMENT_LATENCY)
         
         # In a real implementation, this would make an HTTP request:
         # response = requests.post(
@@ -68,19 +168,7 @@ class PaymentGateway:
         
         # For this template, we simulate different scenarios based on amount
         # This allows testing without a real API
-        
-        if amount <= 0:
-            return False, "", "Invalid amount: must be greater than 0"
-        
-        if amount > 1000:
-            return False, "", "Payment declined: amount exceeds limit"
-        
-        if len(patron_id) != 6:
-            return False, "", "Invalid patron ID format"
-        
-        # Simulate successful payment
-        transaction_id = f"txn_{patron_id}_{int(time.time())}"
-        return True, transaction_id, f"Payment of ${amount:.2f} processed successfully"
+        return self._charges.record(idempotency_key, _simulate_payment(patron_id, amount))
     
     def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
         """
@@ -96,18 +184,11 @@ class PaymentGateway:
         Returns:
             tuple: (success: bool, message: str)
         """
-        time.sleep(0.5)
-        
-        if not transaction_id or not transaction_id.startswith("txn_"):
-            return False, "Invalid transaction ID"
-        
-        if amount <= 0:
-            return False, "Invalid refund amount"
-        
-        refund_id = f"refund_{transaction_id}_{int(time.time())}"
-        return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {refund_id}"
+        time.sleep(REFUND_LATENCY)
+        return _simulate_refund(transaction_id, amount)
     
-    def verify_payment_status(self, transaction_id: str) -> Dict:
+    def verify_payment_status(self, transaction_id: Optional[str] = None,
+                              idempotency_key: Optional[str] = None) -> Dict:
         """
         Check the status of a payment transaction.
         
@@ -116,19 +197,519 @@ class PaymentGateway:
         
         Args:
             transaction_id: Transaction ID to check
+            idempotency_key: Instead of the transaction ID, the key the charge
+                was made with (status 'not_found' if no such charge was made)
             
         Returns:
             dict: Payment status information
         """
-        time.sleep(0.3)
-        
-        if not transaction_id or not transaction_id.startswith("txn_"):
+        time.sleep(STATUS_LATENCY)
+        if idempotency_key is not None:
+            transaction_id = self._charges.get(idempotency_key)
+        return _simulate_payment_status(transaction_id)
+
+    def close(self):
+        """Release any resources held by the gateway."""
+
+
+class HttpPaymentGateway(PaymentGateway):
+    """
+    Payment gateway client for the provider's HTTP API.
+
+    Requests go through one requests.Session with a pooled, keep-alive
+    HTTPAdapter, so a charge reuses an open connection instead of paying
+    TCP+TLS setup each time. Create one instance and share it across
+    requests (see get_payment_gateway()).
+
+    Only connection failures and GET requests are retried; a POST that
+    reached the provider is never resent, so a charge cannot be duplicated
+    by the client. Errors raised before a request was sent (the connection
+    could not be opened) are PaymentNotSentError; any other error means the
+    provider may have acted on it. Charges carry the caller's idempotency
+    key in an Idempotency-Key header, so the provider can also refuse to
+    repeat them and verify_payment_status() can look them up by key.
+    """
+
+    def __init__(self, api_key: str = "test_key_12345", base_url: str = DEFAULT_BASE_URL,
+                 pool_size: int = 10, timeout: Tuple[float, float] = (3.05, 10.0),
+                 retries: int = 2, backoff_factor: float = 0.2):
+        """
+        Args:
+            api_key: API key for authentication
+            base_url: Root URL of the payment API
+            pool_size: Maximum keep-alive connections kept open to the provider
+            timeout: (connect, read) timeout in seconds for each request
+            retries: Retries for connection errors and idempotent requests
+            backoff_factor: Exponential backoff factor between retries
+        """
+        super().__init__(api_key)
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Authorization": f"Bearer {api_key}"})
+
+    def _request(self, method: str, path: str, **kwargs) -> Tuple[int, Dict]:
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        except requests.ConnectionError as e:
+            # Failing to connect (refused, unreachable, connect timeout) means nothing was sent
+            reason = getattr(e.args[0], "reason", e.args[0]) if e.args else None
+            if isinstance(e, requests.ConnectTimeout) or isinstance(reason, ConnectTimeoutError):
+                raise PaymentNotSentError(f"Could not connect to the payment gateway: {e}") from e
+            raise
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = {}
+        return response.status_code, payload
+
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        headers = {"Idempotency-Key": idempotency_key} if idempotency_key else {}
+        status, payload = self._request("POST", "/charges", headers=headers, json={
+            "customer_id": patron_id,
+            "amount": amount,
+            "currency": "usd",
+            "description": description
+        })
+        if status != 200:
+            return False, "", payload.get("error", f"Payment declined (HTTP {status})")
+        return True, payload["id"], f"Payment of ${amount:.2f} processed successfully"
+
+    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        status, payload = self._request("POST", "/refunds", json={
+            "charge": transaction_id,
+            "amount": amount
+        })
+        if status != 200:
+            return False, payload.get("error", f"Refund failed (HTTP {status})")
+        return True, f"Refund of ${amount:.2f} processed successfully. Refund ID: {payload['id']}"
+
+    def verify_payment_status(self, transaction_id: Optional[str] = None,
+                              idempotency_key: Optional[str] = None) -> Dict:
+        if idempotency_key is not None:
+            status, payload = self._request("GET", "/charges", params={"idempotency_key": idempotency_key})
+        else:
+            status, payload = self._request("GET", f"/charges/{transaction_id}")
+        if status == 404:
             return {"status": "not_found", "message": "Transaction not found"}
-        
-        # Simulate status check
+        return payload
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncPaymentGateway:
+    """
+    asyncio version of the simulated PaymentGateway.
+
+    Each call awaits its simulated network round trip instead of blocking a
+    thread, so many payments can be in flight at once on one event loop.
+    """
+
+    def __init__(self, api_key: str = "test_key_12345", payment_latency: float = PAYMENT_LATENCY,
+                 refund_latency: float = REFUND_LATENCY, status_latency: float = STATUS_LATENCY):
+        """
+        Args:
+            api_key: API key for authentication (default is test key)
+            payment_latency: Simulated round trip of process_payment, in seconds
+            refund_latency: Simulated round trip of refund_payment, in seconds
+            status_latency: Simulated round trip of verify_payment_status, in seconds
+        """
+        self.api_key = api_key
+        self.base_url = DEFAULT_BASE_URL
+        self.payment_latency = payment_latency
+        self.refund_latency = refund_latency
+        self.status_latency = status_latency
+        self._charges = _ChargesByKey()
+
+    async def process_payment(self, patron_id: str, amount: float, description: str = "",
+                              idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        """Async PaymentGateway.process_payment: (success, transaction_id, message)."""
+        await asyncio.sleep(self.payment_latency)
+        return self._charges.record(idempotency_key, _simulate_payment(patron_id, amount))
+
+    async def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        """Async PaymentGateway.refund_payment: (success, message)."""
+        await asyncio.sleep(self.refund_latency)
+        return _simulate_refund(transaction_id, amount)
+
+    async def verify_payment_status(self, transaction_id: Optional[str] = None,
+                                    idempotency_key: Optional[str] = None) -> Dict:
+        """Async PaymentGateway.verify_payment_status: payment status dict."""
+        await asyncio.sleep(self.status_latency)
+        if idempotency_key is not None:
+            transaction_id = self._charges.get(idempotency_key)
+        return _simulate_payment_status(transaction_id)
+
+
+class ThreadedAsyncPaymentGateway:
+    """
+    asyncio facade over a blocking gateway.
+
+    Each call runs on a thread of its own pool, so the real (shared,
+    breaker-wrapped) gateway can serve coroutines such as
+    pay_late_fees_bulk_async() with up to max_workers calls in flight. A
+    ResilientPaymentGateway caps that at its own worker count, since calls
+    beyond it would only queue for a thread while their deadline runs.
+    close() stops the pool; the wrapped gateway stays open.
+    """
+
+    def __init__(self, gateway: PaymentGateway, max_workers: int = 50):
+        self.gateway = gateway
+        self.api_key = gateway.api_key
+        self.base_url = gateway.base_url
+        if isinstance(gateway, ResilientPaymentGateway):
+            max_workers = min(max_workers, gateway.max_workers)
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="payment-async")
+
+    async def _run(self, func: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def process_payment(self, patron_id: str, amount: float, description: str = "",
+                              idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        return await self._run(self.gateway.process_payment, patron_id=patron_id, amount=amount,
+                               description=description,
+                               **key_argument(self.gateway.process_payment, idempotency_key))
+
+    async def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        return await self._run(self.gateway.refund_payment, transaction_id, amount)
+
+    async def verify_payment_status(self, transaction_id: Optional[str] = None,
+                                    idempotency_key: Optional[str] = None) -> Dict:
+        return await self._run(self.gateway.verify_payment_status, transaction_id,
+                               **key_argument(self.gateway.verify_payment_status, idempotency_key))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class CircuitOpenError(PaymentNotSentError):
+    """Raised instead of calling the provider while the circuit breaker is open."""
+
+
+class PaymentTimeoutError(Exception):
+    """Raised when a gateway call misses its deadline."""
+
+
+class PaymentOutcomeUnknownError(PaymentTimeoutError):
+    """Raised when a charge or refund misses its deadline; it may still complete at the provider."""
+
+
+class PaymentNotStartedError(PaymentTimeoutError, PaymentNotSentError):
+    """Raised when a call misses its deadline while still waiting for a free gateway thread."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    closed: calls go through; failure_threshold failures in a row open it.
+    open: calls are rejected until reset_timeout seconds have passed.
+    half_open: up to half_open_max_calls probe calls go through; a success
+    closes the circuit, a failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 half_open_max_calls: int = 1, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self.rejected = 0
+        self._probes = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go to the provider now."""
+        with self._lock:
+            if self.state == self.OPEN:
+                if self._clock() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probes = 0
+            if self.state == self.HALF_OPEN:
+                if self._probes >= self.half_open_max_calls:
+                    self.rejected += 1
+                    return False
+                self._probes += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state == self.HALF_OPEN:
+                self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.consecutive_failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = self._clock()
+                self.times_opened += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = round(max(0.0, self.reset_timeout - (self._clock() - self.opened_at)), 3)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "failure_threshold": self.failure_threshold,
+                "reset_timeout": self.reset_timeout,
+                "retry_in": retry_in,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+class ResilientPaymentGateway(PaymentGateway):
+    """
+    Wraps a gateway with a circuit breaker, per-call deadlines and hedging.
+
+    Each call runs on a worker thread and the caller waits at most its
+    deadline, so a degraded provider costs a request thread call_timeout
+    seconds, and nothing at all once the breaker has opened. Exceptions and
+    missed deadlines count as failures; declines are ordinary responses.
+
+    A running call cannot be stopped, so a charge or refund that misses its
+    deadline carries on in the background and the caller gets
+    PaymentOutcomeUnknownError rather than a plain timeout (or
+    PaymentNotStartedError if it was still queued for a thread, in which
+    case it is dropped unsent). Until such a
+    charge finishes, verify_payment_status(idempotency_key=...) answers
+    'pending' for its key without asking the provider, so it is not
+    mistaken for a charge that never happened.
+
+    verify_payment_status is read-only, so with hedge_after set a second,
+    identical request is sent if the first has not answered by then and the
+    first response wins. Charges and refunds are never hedged.
+    """
+
+    def __init__(self, gateway: PaymentGateway, breaker: Optional[CircuitBreaker] = None,
+                 call_timeout: float = 5.0, hedge_after: Optional[float] = None, max_workers: int = 32):
+        """
+        Args:
+            gateway: Gateway that talks to the provider
+            breaker: Circuit breaker (a default CircuitBreaker if omitted)
+            call_timeout: Deadline in seconds for each call
+            hedge_after: Seconds before verify_payment_status sends a hedged request (None disables)
+            max_workers: Threads available for in-flight provider calls
+        """
+        super().__init__(gateway.api_key)
+        self.gateway = gateway
+        self.base_url = gateway.base_url
+        self.breaker = breaker or CircuitBreaker()
+        self.call_timeout = call_timeout
+        self.hedge_after = hedge_after
+        self.hedged_requests = 0
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="payment-gateway")
+        self._latency = {name: Histogram() for name in ("process_payment", "refund_payment", "verify_payment_status")}
+        self._outcomes = {name: {"ok": 0, "error": 0, "timeout": 0, "rejected": 0} for name in self._latency}
+        self._in_flight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name: str, outcome: str):
+        with self._lock:
+            self._outcomes[name][outcome] += 1
+
+    def _call(self, name: str, *args, hedge_after: Optional[float] = None, idempotent: bool = True,
+              idempotency_key: Optional[str] = None):
+        if not self.breaker.allow():
+            self._count(name, "rejected")
+            raise CircuitOpenError("Payment gateway unavailable (circuit open)")
+
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            method = getattr(self.gateway, name)
+            result = self._run(functools.partial(method, **key_argument(method, idempotency_key)), args,
+                               hedge_after, idempotent, idempotency_key)
+        except PaymentTimeoutError:
+            outcome = "timeout"
+            raise
+        else:
+            outcome = "ok"
+            return result
+        finally:
+            self._latency[name].observe(time.perf_counter() - start)
+            self._count(name, outcome)
+            if outcome == "ok":
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    def _run(self, func: Callable, args: Tuple, hedge_after: Optional[float], idempotent: bool = True,
+             idempotency_key: Optional[str] = None):
+        deadline = time.monotonic() + self.call_timeout
+        futures = [self._executor.submit(func, *args)]
+        if hedge_after is not None and hedge_after < self.call_timeout:
+            done, _ = wait(futures, timeout=hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                with self._lock:
+                    self.hedged_requests += 1
+                futures.append(self._executor.submit(func, *args))
+
+        error = None
+        try:
+            for future in as_completed(futures, timeout=max(0.0, deadline - time.monotonic())):
+                try:
+                    return future.result()
+                except Exception as e:
+                    error = e
+        except FutureTimeoutError:
+            if futures[0].cancel():
+                raise PaymentNotStartedError(
+                    f"No payment gateway thread was free within {self.call_timeout}s") from None
+            if idempotent:
+                raise PaymentTimeoutError(f"Payment gateway did not respond within {self.call_timeout}s") from None
+            if idempotency_key is not None:
+                self._track_in_flight(idempotency_key, futures[0])
+            raise PaymentOutcomeUnknownError(
+                f"Payment gateway did not respond within {self.call_timeout}s; the call may still complete") from None
+        finally:
+            for future in futures:
+                future.cancel()
+        raise error
+
+    def _track_in_flight(self, idempotency_key: str, future: Future):
+        with self._lock:
+            self._in_flight[idempotency_key] = future
+
+        def finished(done: Future):
+            with self._lock:
+                if self._in_flight.get(idempotency_key) is done:
+                    del self._in_flight[idempotency_key]
+        future.add_done_callback(finished)
+
+    def process_payment(self, patron_id: str, amount: float, description: str = "",
+                        idempotency_key: Optional[str] = None) -> Tuple[bool, str, str]:
+        return self._call("process_payment", patron_id, amount, description, idempotent=False,
+                          idempotency_key=idempotency_key)
+
+    def refund_payment(self, transaction_id: str, amount: float) -> Tuple[bool, str]:
+        return self._call("refund_payment", transaction_id, amount, idempotent=False)
+
+    def verify_payment_status(self, transaction_id: Optional[str] = None,
+                              idempotency_key: Optional[str] = None) -> Dict:
+        if idempotency_key is not None:
+            with self._lock:
+                in_flight = idempotency_key in self._in_flight
+            if in_flight:
+                return {"status": "pending", "message": "The charge is still in progress."}
+        return self._call("verify_payment_status", transaction_id, hedge_after=self.hedge_after,
+                          idempotency_key=idempotency_key)
+
+    def stats(self) -> Dict:
+        """Breaker state plus per-method outcome counts and latency histograms."""
+        with self._lock:
+            outcomes = {name: dict(counts) for name, counts in self._outcomes.items()}
+            hedged = self.hedged_requests
+            in_flight = len(self._in_flight)
         return {
-            "transaction_id": transaction_id,
-            "status": "completed",
-            "amount": 10.50,
-            "timestamp": time.time()
+            "breaker": self.breaker.snapshot(),
+            "call_timeout": self.call_timeout,
+            "hedge_after": self.hedge_after,
+            "hedged_requests": hedged,
+            "late_charges_in_flight": in_flight,
+            "calls": {
+                name: dict(outcomes[name], latency=histogram.snapshot())
+                for name, histogram in self._latency.items()
+            },
         }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.gateway.close()
+
+
+_gateway: Optional[PaymentGateway] = None
+
+
+def get_payment_gateway() -> PaymentGateway:
+    """Get the shared gateway, creating the simulated one if none is configured."""
+    global _gateway
+    if _gateway is None:
+        _gateway = PaymentGateway()
+    return _gateway
+
+
+def set_payment_gateway(gateway: Optional[PaymentGateway]):
+    """Replace the shared gateway (closing the previous one)."""
+    global _gateway
+    if _gateway is not None and _gateway is not gateway:
+        _gateway.close()
+    _gateway = gateway
+
+
+def get_payment_gateway_health() -> Dict:
+    """Breaker state and call statistics of the shared gateway (breaker is None if it has none)."""
+    gateway = get_payment_gateway()
+    if isinstance(gateway, ResilientPaymentGateway):
+        return gateway.stats()
+    return {"breaker": None}
+
+
+def init_app(app):
+    """
+    Create the shared gateway from the app config.
+
+    PAYMENT_GATEWAY_URL selects the HTTP gateway; without it the simulated
+    PaymentGateway is used. PAYMENT_API_KEY, PAYMENT_POOL_SIZE,
+    PAYMENT_TIMEOUT and PAYMENT_RETRIES tune the HTTP client.
+
+    The gateway is wrapped in a ResilientPaymentGateway configured by
+    PAYMENT_BREAKER_THRESHOLD, PAYMENT_BREAKER_RESET, PAYMENT_CALL_TIMEOUT
+    and PAYMENT_HEDGE_AFTER.
+    """
+    api_key = app.config.get("PAYMENT_API_KEY", "test_key_12345")
+    base_url = app.config.get("PAYMENT_GATEWAY_URL")
+    if base_url:
+        gateway = HttpPaymentGateway(
+            api_key=api_key,
+            base_url=base_url,
+            pool_size=app.config.get("PAYMENT_POOL_SIZE", 10),
+            timeout=app.config.get("PAYMENT_TIMEOUT", (3.05, 10.0)),
+            retries=app.config.get("PAYMENT_RETRIES", 2),
+        )
+    else:
+        gateway = PaymentGateway(api_key)
+    breaker = CircuitBreaker(
+        failure_threshold=app.config.get("PAYMENT_BREAKER_THRESHOLD", 5),
+        reset_timeout=app.config.get("PAYMENT_BREAKER_RESET", 30.0),
+    )
+    set_payment_gateway(ResilientPaymentGateway(
+        gateway,
+        breaker=breaker,
+        call_timeout=app.config.get("PAYMENT_CALL_TIMEOUT", 5.0),
+        hedge_after=app.config.get("PAYMENT_HEDGE_AFTER"),
+    ))
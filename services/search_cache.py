@@ -0,0 +1,125 @@
+"""
+Search result cache for the Library Management System
+Keeps recent search results in a bounded LRU cache that is only trusted
+while the catalog is unchanged
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional
+
+import database
+from cache import LRUCache
+
+DEFAULT_SIZE = 2048
+DEFAULT_TTL = 60.0           # seconds; also bounds how late other processes' writes are seen
+DEFAULT_STALE_SECONDS = 0.0  # availability staleness allowed (0 = never stale)
+DEFAULT_MAX_RESULTS = 1000   # larger result lists are not cached
+
+
+class SearchResultCache:
+    """
+    LRU cache of search results, validated against the catalog version.
+
+    Each entry remembers database.catalog_version (bumped by every books
+    write in this process) and the book text marks (highest book id, last
+    book_edits seq, which see inserts, edits and deletes from any process)
+    it was computed under. An entry is used only if both still match, or,
+    with stale_seconds > 0, if the titles/authors are unchanged and the
+    entry is younger than stale_seconds: then only availability can be out
+    of date, by at most that long.
+    """
+
+    def __init__(self, size: int = DEFAULT_SIZE, ttl: Optional[float] = DEFAULT_TTL,
+                 stale_seconds: float = DEFAULT_STALE_SECONDS, max_results: int = DEFAULT_MAX_RESULTS):
+        self._cache = LRUCache(size, ttl)
+        self.stale_seconds = stale_seconds
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.outdated = 0
+        self.too_large = 0
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], List[Dict]]) -> List[Dict]:
+        """Cached results for key, or compute() them (and cache them if small enough)."""
+        # Read the versions before computing, so a write that lands meanwhile
+        # makes the new entry outdated instead of hiding the write
+        version = database.catalog_version
+        marks = database.get_book_text_marks()
+        key = (database.DATABASE, key)
+
+        entry = self._cache.get(key)
+        if entry is not None:
+            entry_version, entry_marks, stored_at, results = entry
+            fresh = entry_version == version
+            if entry_marks == marks and (fresh or time.monotonic() - stored_at <= self.stale_seconds):
+                with self._lock:
+                    self.hits += 1
+                    if not fresh:
+                        self.stale_hits += 1
+                return [dict(book) for book in results]
+            with self._lock:
+                self.outdated += 1
+
+        with self._lock:
+            self.misses += 1
+        results = compute()
+        if len(results) <= self.max_results:
+            self._cache.set(key, (version, marks, time.monotonic(), [dict(book) for book in results]))
+        else:
+            with self._lock:
+                self.too_large += 1
+        return results
+
+    def clear(self):
+        self._cache.clear()
+
+    def configure(self, size: int, ttl: Optional[float], stale_seconds: float, max_results: int):
+        self._cache.resize(size, ttl)
+        self.stale_seconds = stale_seconds
+        self.max_results = max_results
+
+    def stats(self) -> Dict:
+        cache_stats = self._cache.stats()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': cache_stats['size'],
+                'maxsize': cache_stats['maxsize'],
+                'ttl': cache_stats['ttl'],
+                'stale_seconds': self.stale_seconds,
+                'max_results': self.max_results,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'outdated': self.outdated,
+                'too_large': self.too_large,
+                'evictions': cache_stats['evictions'],
+                'expirations': cache_stats['expirations'],
+            }
+
+
+search_cache = SearchResultCache()
+
+# Off switch (SEARCH_CACHE = False)
+ENABLED = True
+
+
+def get_search_cache_stats() -> Dict:
+    return dict(search_cache.stats(), enabled=ENABLED)
+
+
+def init_app(app):
+    """
+    Configure the cache from SEARCH_CACHE (on/off), SEARCH_CACHE_SIZE,
+    SEARCH_CACHE_TTL, SEARCH_CACHE_STALE_SECONDS and SEARCH_CACHE_MAX_RESULTS.
+    """
+    global ENABLED
+    ENABLED = bool(app.config.get('SEARCH_CACHE', True))
+    search_cache.configure(app.config.get('SEARCH_CACHE_SIZE', DEFAULT_SIZE),
+                           app.config.get('SEARCH_CACHE_TTL', DEFAULT_TTL),
+                           app.config.get('SEARCH_CACHE_STALE_SECONDS', DEFAULT_STALE_SECONDS),
+                           app.config.get('SEARCH_CACHE_MAX_RESULTS', DEFAULT_MAX_RESULTS))
@@ -0,0 +1,690 @@
+"""
+In-memory search index for the Library Management System
+Answers title/author substring searches from trigram posting lists held in
+process memory, so a query only reads the rows that can match
+"""
+
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from itertools import accumulate
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import database
+from database import (
+    get_book_edits, get_book_text_marks, get_books_by_ids, iter_book_text, prune_book_edits, transaction
+)
+
+FIELDS = ('title', 'author')
+
+# Terms shorter than a trigram cannot be looked up; callers fall back to SQL
+MIN_TERM_LENGTH = 3
+
+# Posting lists hold book ids as unsigned 32-bit ints
+POSTING_TYPECODE = 'I'
+
+# Prefix index: values buffered before they are sorted into a run, and the
+# character that separates values packed into one string
+PENDING_LIMIT = 256
+SEPARATOR = '\0'
+
+# Fuzzy search: edits allowed per query word, by word length (as in
+# Elasticsearch's AUTO fuzziness), and the gram size of the vocabulary index
+FUZZY_MAX_DISTANCE = 2
+FUZZY_GRAM = 2
+
+# book_edits rows left behind the newest edit an index has applied, so that
+# indexes in other processes can still catch up without a rebuild, and how
+# far past that the log may grow before it is pruned again
+EDIT_LOG_KEEP = 1000
+EDIT_LOG_PRUNE_BATCH = 1000
+
+# bm25 parameters, the same defaults FTS5 uses
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Off switch (SEARCH_INDEX = False): searches go to SQLite and type-ahead is off
+ENABLED = True
+
+
+def trigrams(text: str) -> set:
+    """Distinct 3-character substrings of an already lower-cased string."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+_WORD = re.compile(r'\w+')
+
+
+def words(text: str) -> List[str]:
+    """Lower-cased words of a title or author."""
+    return _WORD.findall(text.lower())
+
+
+def max_edits(word: str) -> int:
+    """Edits a query word may be off by: none up to 2 letters, 1 up to 5, then 2."""
+    if len(word) <= 2:
+        return 0
+    return 1 if len(word) <= 5 else FUZZY_MAX_DISTANCE
+
+
+def _word_grams(word: str) -> set:
+    """Distinct bigrams of a word padded with ^ and $, so its ends count too."""
+    padded = f'^{word}$'
+    return {padded[i:i + FUZZY_GRAM] for i in range(len(padded) - FUZZY_GRAM + 1)}
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> Optional[int]:
+    """Edit distance between a and b, or None as soon as it must exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for i, char_b in enumerate(b, 1):
+        current = [i]
+        for j, char_a in enumerate(a, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+def _token_count(text: str) -> int:
+    """Tokens the FTS5 trigram tokenizer makes of a text: one per position."""
+    return max(len(text) - 2, 0)
+
+
+def _occurrences(text: str, term: str) -> int:
+    """Occurrences of term in text, overlapping ones included."""
+    count, start = 0, text.find(term)
+    while start != -1:
+        count += 1
+        start = text.find(term, start + 1)
+    return count
+
+
+# The space before each word after the first in a packed block of values
+_WORD_START = re.compile(f' (?=[^ {SEPARATOR}])')
+
+
+def _offsets(values: List[str]) -> array:
+    """Where each value starts once they are joined with SEPARATOR."""
+    offsets = array(POSTING_TYPECODE, accumulate((len(value) + 1 for value in values), initial=0))
+    offsets.pop()
+    return offsets
+
+
+class _SortedRun:
+    """
+    Immutable block of distinct values for prefix lookups.
+
+    The lower-cased values are packed into one NUL-separated string; `starts`
+    holds the offset of every value and `words` the offset of every later
+    word, each sorted by the text from that offset to the end of its value.
+    A prefix is then a contiguous range of either array, found by bisection.
+    """
+
+    def __init__(self, entries: List[Tuple[str, int]]):
+        # entries: (display value, number of books), one per lower-cased value
+        values = [value for value, _ in entries]
+        lowered = [value.lower() for value in values]
+        self.keys = SEPARATOR.join(lowered) + SEPARATOR
+        self.display = SEPARATOR.join(values) + SEPARATOR
+        self.counts = array(POSTING_TYPECODE, (count for _, count in entries))
+        self.key_offsets = _offsets(lowered)
+        self.display_offsets = _offsets(values)
+        order = sorted(range(len(lowered)), key=lowered.__getitem__)
+        self.starts = array(POSTING_TYPECODE, (self.key_offsets[i] for i in order))
+        words = [match.end() for match in _WORD_START.finditer(self.keys)]
+        end_of = self.keys.index
+        suffixes = [self.keys[offset:end_of(SEPARATOR, offset)] for offset in words]
+        order = sorted(range(len(words)), key=suffixes.__getitem__)
+        self.words = array(POSTING_TYPECODE, (words[i] for i in order))
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def _key(self, offset: int) -> str:
+        return self.keys[offset:self.keys.index(SEPARATOR, offset)]
+
+    def _entry(self, offset: int) -> int:
+        return bisect_right(self.key_offsets, offset) - 1
+
+    def entries(self) -> Iterator[Tuple[str, int]]:
+        """(display value, books) of every value still held by some book."""
+        for i, count in enumerate(self.counts):
+            if count:
+                start = self.display_offsets[i]
+                yield self.display[start:self.display.index(SEPARATOR, start)], count
+
+    def find(self, key: str) -> Optional[int]:
+        """Entry number of a lower-cased value, if the run holds it."""
+        i = bisect_left(self.starts, key, key=self._key)
+        if i < len(self.starts) and self._key(self.starts[i]) == key:
+            return self._entry(self.starts[i])
+        return None
+
+    def matches(self, prefix: str, words: bool, limit: int) -> List[Tuple[str, str, int]]:
+        """Up to `limit` (key, display value, books) whose value (or a later word) starts with prefix."""
+        offsets = self.words if words else self.starts
+        # Comparing only len(prefix) characters keeps the order of the full keys
+        i = bisect_left(offsets, prefix, key=lambda offset: self.keys[offset:offset + len(prefix)])
+        found, seen = [], set()
+        while i < len(offsets) and len(found) < limit and self.keys.startswith(prefix, offsets[i]):
+            entry = self._entry(offsets[i])
+            # Two words of one value can both match
+            if self.counts[entry] and entry not in seen:
+                seen.add(entry)
+                start = self.display_offsets[entry]
+                key_start = self.key_offsets[entry]
+                found.append((self.keys[key_start:self.keys.index(SEPARATOR, key_start)],
+                              self.display[start:self.display.index(SEPARATOR, start)],
+                              self.counts[entry]))
+            i += 1
+        return found
+
+
+class PrefixIndex:
+    """
+    Sorted index of the distinct values of one field, for type-ahead.
+
+    Values live in a few _SortedRun blocks plus a small buffer of recent
+    additions. When the buffer passes PENDING_LIMIT it becomes a run, and
+    runs are merged like a binary counter (a run is merged into the one
+    before it once it is at least half its size), so there are O(log n)
+    runs and memory stays a few bytes per value and word beyond the text.
+    A value can sit in more than one run; lookups add up their counts.
+    """
+
+    def __init__(self):
+        self._runs: List[_SortedRun] = []
+        self._pending: Dict[str, List] = {}  # lower-cased value -> [display value, books]
+
+    def add(self, value: str):
+        entry = self._pending.setdefault(value.lower(), [value, 0])
+        entry[1] += 1
+
+    def remove(self, value: str):
+        key = value.lower()
+        entry = self._pending.get(key)
+        if entry and entry[1] > 0:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._pending[key]
+            return
+        for run in self._runs:
+            i = run.find(key)
+            if i is not None and run.counts[i]:
+                run.counts[i] -= 1
+                return
+
+    def compact(self):
+        """Turn a full buffer into a run and merge runs that have grown alike in size."""
+        if not self._pending or (self._runs and len(self._pending) < PENDING_LIMIT):
+            return
+        self._runs.append(_SortedRun([tuple(entry) for entry in self._pending.values()]))
+        self._pending = {}
+        while len(self._runs) > 1 and len(self._runs[-1]) * 2 >= len(self._runs[-2]):
+            newer, older = self._runs.pop(), self._runs.pop()
+            merged: Dict[str, List] = {}
+            for run in (older, newer):
+                for value, count in run.entries():
+                    entry = merged.setdefault(value.lower(), [value, 0])
+                    entry[1] += count
+            self._runs.append(_SortedRun([tuple(entry) for entry in merged.values()]))
+
+    def suggest(self, prefix: str, limit: int) -> List[Dict]:
+        """
+        Up to `limit` values starting with prefix (case-insensitive), in
+        alphabetical order, followed by values with a later word starting
+        with it. Each comes with the number of books that have it.
+        """
+        prefix = prefix.lower()
+        found: Dict[str, List] = {}
+        for words in (False, True):
+            matches = []
+            for run in self._runs:
+                matches.extend(run.matches(prefix, words, limit))
+            for key, (value, count) in self._pending.items():
+                if key.startswith(prefix) if not words else f' {prefix}' in key:
+                    matches.append((key, value, count))
+            matches.sort()
+            for key, value, count in matches:
+                if key in found:
+                    if found[key][2] == words:
+                        found[key][1] += count
+                elif len(found) < limit:
+                    found[key] = [value, count, words]
+            if len(found) >= limit:
+                break
+        return [{'value': value, 'books': count} for value, count, _ in found.values()]
+
+    def stats(self) -> Dict:
+        return {
+            'runs': [len(run) for run in self._runs],
+            'pending': len(self._pending),
+            'bytes': sum(len(run.keys) + len(run.display) + array(POSTING_TYPECODE).itemsize *
+                         (len(run.counts) * 3 + len(run.starts) + len(run.words)) for run in self._runs),
+        }
+
+
+class FuzzyWordIndex:
+    """
+    The words of one field, for typo-tolerant lookups.
+
+    Each distinct word maps to a sorted array of the ids of the books using
+    it, and each padded bigram to the ids of the words containing it. A word
+    within k edits of a query word keeps all but at most 2k of the query's
+    distinct bigrams, so only words sharing enough of them (and of a close
+    enough length) are compared with bounded_levenshtein.
+    """
+
+    def __init__(self):
+        self._books: Dict[str, array] = {}
+        self._word_ids: Dict[str, int] = {}
+        self._words: List[str] = []
+        self._grams: Dict[str, array] = {}
+
+    def add(self, book_id: int, text: str):
+        for word in set(words(text)):
+            ids = self._books.get(word)
+            if ids is None:
+                self._books[word] = array(POSTING_TYPECODE, (book_id,))
+            elif not ids or ids[-1] < book_id:
+                ids.append(book_id)
+            else:
+                insort(ids, book_id)
+            if word not in self._word_ids:
+                word_id = self._word_ids[word] = len(self._words)
+                self._words.append(word)
+                for gram in _word_grams(word):
+                    self._grams.setdefault(gram, array(POSTING_TYPECODE)).append(word_id)
+
+    def remove(self, book_id: int, text: str):
+        # Words stay in the vocabulary; one no book uses has an empty posting list
+        for word in set(words(text)):
+            ids = self._books.get(word)
+            if ids and _contains(ids, book_id):
+                del ids[bisect_left(ids, book_id)]
+
+    def close_words(self, word: str, limit: int) -> Dict[str, int]:
+        """Words of the field within `limit` edits of word, with their distances."""
+        if limit == 0:
+            return {word: 0} if self._books.get(word) else {}
+        grams = _word_grams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+        needed = len(grams) - FUZZY_GRAM * limit
+        close = {}
+        for word_id, count in shared.items():
+            candidate = self._words[word_id]
+            if count < needed or abs(len(candidate) - len(word)) > limit or not self._books[candidate]:
+                continue
+            distance = bounded_levenshtein(word, candidate, limit)
+            if distance is not None:
+                close[candidate] = distance
+        return close
+
+    def books(self, word: str) -> array:
+        return self._books.get(word, array(POSTING_TYPECODE))
+
+    def stats(self) -> Dict:
+        return {
+            'words': len(self._words),
+            'postings': sum(len(ids) for ids in self._books.values()),
+            'grams': len(self._grams),
+        }
+
+
+class TrigramIndex:
+    """
+    Trigram inverted index over book titles and authors.
+
+    For each field, every distinct trigram of the lower-cased text maps to a
+    sorted array of the ids of the books containing it. A term matches a
+    subset of the intersection of its trigrams' posting lists; those
+    candidate rows are read by id and checked with a substring test, so
+    results are exactly the books whose field contains the term.
+
+    The index is built on first use and brought up to date before every
+    search: books with ids above the highest one indexed are added, and the
+    book_edits log (filled by triggers) says which titles/authors were
+    changed or deleted since. Writes from other connections and processes
+    are therefore picked up too. The index prunes the log behind it (see
+    EDIT_LOG_KEEP); an index that finds edits it has not seen already pruned
+    rebuilds from the books table.
+
+    The same updates feed a PrefixIndex per field for type-ahead and a
+    FuzzyWordIndex per field for typo-tolerant search.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, array]] = {field: {} for field in FIELDS}
+        self._tokens = 0
+        self._docs = 0
+        self.prefixes = {field: PrefixIndex() for field in FIELDS}
+        self.words = {field: FuzzyWordIndex() for field in FIELDS}
+        self.max_id = 0
+        self.edit_seq = 0
+        self.pruned_seq = 0
+        self.built = False
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.queries = 0
+        self.candidates = 0
+        self.matches = 0
+
+    ## Maintenance
+
+    def _add(self, book_id: int, title: str, author: str):
+        for field, text in zip(FIELDS, (title, author)):
+            self.prefixes[field].add(text)
+            self.words[field].add(book_id, text)
+            text = text.lower()
+            postings = self._postings[field]
+            for gram in trigrams(text):
+                ids = postings.get(gram)
+                if ids is None:
+                    postings[gram] = array(POSTING_TYPECODE, (book_id,))
+                elif ids[-1] < book_id:
+                    ids.append(book_id)
+                else:
+                    insort(ids, book_id)
+            self._tokens += _token_count(text)
+        self._docs += 1
+
+    def _remove(self, book_id: int, title: str, author: str):
+        for field, text in zip(FIELDS, (title, author)):
+            self.prefixes[field].remove(text)
+            self.words[field].remove(book_id, text)
+            text = text.lower()
+            postings = self._postings[field]
+            for gram in trigrams(text):
+                ids = postings.get(gram)
+                if ids is None:
+                    continue
+                i = bisect_left(ids, book_id)
+                if i < len(ids) and ids[i] == book_id:
+                    del ids[i]
+                    if not ids:
+                        del postings[gram]
+            self._tokens -= _token_count(text)
+        self._docs -= 1
+
+    def _build(self):
+        start = time.perf_counter()
+        self._postings = {field: {} for field in FIELDS}
+        self._tokens = 0
+        self._docs = 0
+        self.prefixes = {field: PrefixIndex() for field in FIELDS}
+        self.words = {field: FuzzyWordIndex() for field in FIELDS}
+        with transaction(immediate=False):
+            self.max_id, self.edit_seq = get_book_text_marks()
+            for book_id, title, author in iter_book_text():
+                self._add(book_id, title, author)
+        for prefixes in self.prefixes.values():
+            prefixes.compact()
+        self.built = True
+        self.builds += 1
+        self.build_seconds = time.perf_counter() - start
+
+    def _catch_up(self) -> bool:
+        """Apply the books added and edited since the last sync; False if the log no longer reaches back."""
+        with transaction(immediate=False):
+            max_id, edit_seq = get_book_text_marks()
+            edits = get_book_edits(self.edit_seq)
+            if edit_seq > self.edit_seq and (not edits or edits[0][0] != self.edit_seq + 1):
+                # Edits this index has not seen were pruned (by another process)
+                return False
+            edited = {}
+            for seq, book_id, old_title, old_author in edits:
+                # The first logged edit holds the text the index has for the book
+                if book_id <= self.max_id and book_id not in edited:
+                    edited[book_id] = (old_title, old_author)
+            for book_id, (old_title, old_author) in edited.items():
+                self._remove(book_id, old_title, old_author)
+            for book in get_books_by_ids(sorted(edited)):
+                self._add(book['id'], book['title'], book['author'])
+            for book_id, title, author in iter_book_text(self.max_id):
+                self._add(book_id, title, author)
+            self.max_id, self.edit_seq = max_id, edit_seq
+        for prefixes in self.prefixes.values():
+            prefixes.compact()
+        return True
+
+    def sync(self):
+        """Bring the index up to date with the books table (building it on first use)."""
+        if self.built and get_book_text_marks() == (self.max_id, self.edit_seq):
+            return
+        with self._lock:
+            if not self.built:
+                self._build()
+            elif get_book_text_marks() != (self.max_id, self.edit_seq) and not self._catch_up():
+                self._build()
+            self._prune_edits()
+
+    def _prune_edits(self):
+        """Drop book_edits rows this index no longer needs, EDIT_LOG_PRUNE_BATCH at a time."""
+        through = self.edit_seq - EDIT_LOG_KEEP
+        if through - self.pruned_seq < EDIT_LOG_PRUNE_BATCH:
+            return
+        try:
+            prune_book_edits(through)
+        except sqlite3.Error:
+            return  # the database is busy; try again after a later sync
+        self.pruned_seq = through
+
+    ## Queries
+
+    def candidate_ids(self, term: str, field: str) -> List[int]:
+        """Sorted ids of the books whose `field` holds every trigram of the term."""
+        postings = self._postings[field]
+        lists = []
+        for gram in trigrams(term.lower()):
+            ids = postings.get(gram)
+            if ids is None:
+                return []
+            lists.append(ids)
+        if not lists:
+            return []
+        lists.sort(key=len)
+        result: Iterable[int] = lists[0]
+        for ids in lists[1:]:
+            if len(result) * 16 < len(ids):
+                # Few candidates left: binary search the long list for each one
+                result = [book_id for book_id in result if _contains(ids, book_id)]
+            else:
+                result = sorted(set(result).intersection(ids))
+            if not result:
+                return []
+        return list(result)
+
+    def match_candidates(self, term: str, field: str) -> List[int]:
+        """Synced candidate_ids(): a superset of the ids search() would return."""
+        if field not in FIELDS:
+            raise ValueError(f"Unsupported search field: {field}")
+        self.sync()
+        with self._lock:
+            return self.candidate_ids(term.lower(), field)
+
+    def search(self, term: str, field: str) -> List[Dict]:
+        """
+        Books whose title or author contains the term (case-insensitive).
+
+        Results are ranked by bm25 relevance, then title, like the FTS5 search.
+        """
+        if field not in FIELDS:
+            raise ValueError(f"Unsupported search field: {field}")
+        self.sync()
+        needle = term.lower()
+        with self._lock:
+            ids = self.candidate_ids(needle, field)
+            average_tokens = self._tokens / self._docs if self._docs else 1.0
+
+        # Trigram hits can be spread over the text, so check the substring on each row
+        books = [book for book in get_books_by_ids(ids) if needle in book[field].lower()]
+        with self._lock:
+            self.queries += 1
+            self.candidates += len(ids)
+            self.matches += len(books)
+
+        # FTS5's bm25: term frequency in the field, length normalised by the
+        # token count of the whole row (title and author) against the average
+        def rank(book):
+            hits = _occurrences(book[field].lower(), needle)
+            tokens = _token_count(book['title']) + _token_count(book['author'])
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * tokens / (average_tokens or 1.0))
+            return -hits * (BM25_K1 + 1) / (hits + norm), book['title'], book['id']
+        books.sort(key=rank)
+        return books
+
+    def fuzzy_search(self, term: str, field: str) -> List[Dict]:
+        """
+        Books matching the term exactly (as search() does) or with typos.
+
+        Exact matches come first, in relevance order, with match_distance 0.
+        Otherwise every word of the term must be within max_edits() of some
+        word of the field; those books follow, by total distance and title.
+        """
+        if field not in FIELDS:
+            raise ValueError(f"Unsupported search field: {field}")
+        self.sync()
+        exact = self.search(term, field) if len(term) >= MIN_TERM_LENGTH else database.search_books(term, field)
+        for book in exact:
+            book['match_distance'] = 0
+
+        with self._lock:
+            distances = self._fuzzy_distances(term, field)
+        if not distances:
+            return exact
+
+        seen = {book['id'] for book in exact}
+        fuzzy = [dict(book, match_distance=distances[book['id']])
+                 for book in get_books_by_ids(sorted(set(distances) - seen))]
+        fuzzy.sort(key=lambda book: (book['match_distance'], book['title'], book['id']))
+        return exact + fuzzy
+
+    def fuzzy_match_count(self, term: str, field: str) -> int:
+        """Upper bound on the typo matches fuzzy_search() would add to the exact ones (no rows are read)."""
+        if field not in FIELDS:
+            raise ValueError(f"Unsupported search field: {field}")
+        self.sync()
+        with self._lock:
+            return len(self._fuzzy_distances(term, field))
+
+    def _fuzzy_distances(self, term: str, field: str) -> Dict[int, int]:
+        """Book id -> total edit distance, for books with every word of the term within max_edits()."""
+        distances: Optional[Dict[int, int]] = None
+        for word in words(term):
+            best: Dict[int, int] = {}
+            for close, distance in self.words[field].close_words(word, max_edits(word)).items():
+                for book_id in self.words[field].books(close):
+                    if distance < best.get(book_id, distance + 1):
+                        best[book_id] = distance
+            if distances is None:
+                distances = best
+            else:
+                distances = {book_id: total + best[book_id]
+                             for book_id, total in distances.items() if book_id in best}
+            if not distances:
+                break
+        return distances or {}
+
+    def suggest(self, prefix: str, field: str, limit: int) -> List[Dict]:
+        """Completions of a title or author prefix (see PrefixIndex.suggest)."""
+        if field not in FIELDS:
+            raise ValueError(f"Unsupported search field: {field}")
+        self.sync()
+        with self._lock:
+            return self.prefixes[field].suggest(prefix, limit)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            prefixes = {field: index.stats() for field, index in self.prefixes.items()}
+            vocabulary = {field: index.stats() for field, index in self.words.items()}
+            sizes = {field: sum(len(ids) for ids in postings.values())
+                     for field, postings in self._postings.items()}
+            trigram_counts = {field: len(postings) for field, postings in self._postings.items()}
+        itemsize = array(POSTING_TYPECODE).itemsize
+        return {
+            'built': self.built,
+            'books': self._docs,
+            'trigrams': trigram_counts,
+            'postings': sizes,
+            'posting_bytes': sum(sizes.values()) * itemsize,
+            'max_id': self.max_id,
+            'edit_seq': self.edit_seq,
+            'prefixes': prefixes,
+            'words': vocabulary,
+            'builds': self.builds,
+            'build_seconds': round(self.build_seconds, 3),
+            'queries': self.queries,
+            'candidates': self.candidates,
+            'matches': self.matches,
+        }
+
+
+def _contains(ids: array, book_id: int) -> bool:
+    i = bisect_left(ids, book_id)
+    return i < len(ids) and ids[i] == book_id
+
+
+# One index per connection pool, so a database file that is closed and
+# replaced (database.close_all_connections()) gets a fresh index
+_indexes: "weakref.WeakKeyDictionary[database.ConnectionPool, TrigramIndex]" = weakref.WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def get_search_index() -> TrigramIndex:
+    """The index for the currently configured database."""
+    pool = database.get_pool()
+    index = _indexes.get(pool)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(pool)
+            if index is None:
+                index = _indexes[pool] = TrigramIndex()
+    return index
+
+
+def search(term: str, field: str) -> List[Dict]:
+    """Substring search of titles or authors through the index of the current database."""
+    return get_search_index().search(term, field)
+
+
+def match_candidates(term: str, field: str) -> List[int]:
+    """Ids of the books that may contain the term, from the index of the current database."""
+    return get_search_index().match_candidates(term, field)
+
+
+def fuzzy_search(term: str, field: str) -> List[Dict]:
+    """Typo-tolerant title or author search through the index of the current database."""
+    return get_search_index().fuzzy_search(term, field)
+
+
+def fuzzy_match_count(term: str, field: str) -> int:
+    """Upper bound on the typo matches of a fuzzy_search(), from the index of the current database."""
+    return get_search_index().fuzzy_match_count(term, field)
+
+
+def suggest(prefix: str, field: str, limit: int) -> List[Dict]:
+    """Title or author completions through the index of the current database."""
+    return get_search_index().suggest(prefix, field, limit)
+
+
+def get_search_index_stats() -> Dict:
+    return dict(get_search_index().stats(), enabled=ENABLED)
+
+
+def init_app(app):
+    """Turn the index on or off from the SEARCH_INDEX setting (default on)."""
+    global ENABLED
+    ENABLED = bool(app.config.get('SEARCH_INDEX', True))
@@ -10,6 +10,8 @@ def clearData ():
     database.DATABASE = test_datab
     init_database()
     yield
+    database.close_all_connections()
     database.DATABASE = o_datab
-    if os.path.exists(test_datab):
-        os.remove(test_datab)
+    for path in (test_datab, test_datab + "-wal", test_datab + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+from database import get_book_by_id, get_db_connection, insert_book, insert_borrow_record
+from services.library_service import borrow_books_by_patron, compute_late_fee, return_books_by_patron
+
+
+def add_books(n, copies=1):
+    for i in range(n):
+        insert_book(f"Stack Book {i}", "Author", str(9800000000000 + i), copies, copies)
+    rows = get_db_connection().execute("SELECT id FROM books ORDER BY id DESC LIMIT ?", (n,)).fetchall()
+    return sorted(row["id"] for row in rows)
+
+
+def active_loans(patron_id):
+    return get_db_connection().execute(
+        "SELECT COUNT(*) FROM borrow_records WHERE patron_id = ? AND return_date IS NULL", (patron_id,)).fetchone()[0]
+
+## Batch borrow
+
+def test_batch_borrow_enforces_limit_once_in_order():
+    ids = add_books(7)
+    success, message, results = borrow_books_by_patron("123456", ids)
+
+    assert success is True and message == "Borrowed 5 of 7 book(s)."
+    assert [r["success"] for r in results] == [True] * 5 + [False] * 2
+    assert "maximum borrowing limit of 5" in results[5]["message"]
+    assert active_loans("123456") == 5
+    assert get_book_by_id(ids[0])["available_copies"] == 0
+
+def test_batch_borrow_per_item_failures():
+    ids = add_books(1)
+    _, _, results = borrow_books_by_patron("123456", [ids[0], 99999, ids[0]])
+    assert [r["message"] for r in results] == [
+        results[0]["message"], "Book not found.", "This book is currently not available."]
+    assert results[0]["success"] and "Due date" in results[0]["message"]
+
+def test_batch_borrow_is_one_transaction():
+    ids = add_books(3)
+    conn = get_db_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        borrow_books_by_patron("123456", ids)
+    finally:
+        conn.set_trace_callback(None)
+    assert sum(s.startswith("BEGIN") for s in statements) == 1
+
+def test_batch_rejects_bad_requests():
+    assert borrow_books_by_patron("12", [1])[:2] == (False, "Invalid patron ID. Must be exactly 6 digits.")
+    assert borrow_books_by_patron("123456", [])[0] is False
+    assert return_books_by_patron("123456", ["1"])[1] == "Invalid book ID."
+    assert return_books_by_patron("123456", list(range(51)))[0] is False
+
+## Batch return
+
+def test_batch_return_computes_fees_together():
+    ids = add_books(3)
+    now = datetime.now()
+    insert_borrow_record("123456", ids[0], now - timedelta(days=24), now - timedelta(days=10))
+    insert_borrow_record("123456", ids[1], now - timedelta(days=5), now + timedelta(days=9))
+
+    success, message, results = return_books_by_patron("123456", ids)
+
+    fee = compute_late_fee(now - timedelta(days=10))[0]
+    assert success is True
+    assert message == f"Returned 2 of 3 book(s). Total late fees: ${fee:.2f}."
+    assert [(r["success"], r["late_fee"], r["days_overdue"]) for r in results] == [
+        (True, fee, 10), (True, 0.0, 0), (False, 0.0, 0)]
+    assert results[2]["message"] == "No borrow record found for this patron and book"
+    assert active_loans("123456") == 0
+
+def test_batch_return_does_not_exceed_total_copies():
+    ids = add_books(1)
+    now = datetime.now()
+    insert_borrow_record("123456", ids[0], now, now + timedelta(days=14))
+    return_books_by_patron("123456", ids)
+    assert get_book_by_id(ids[0])["available_copies"] == 1
+
+## API
+
+def test_batch_api_endpoints():
+    from app import create_app
+    client = create_app().test_client()
+    ids = add_books(2)
+
+    borrowed = client.post("/api/borrow/batch", json={"patron_id": "654321", "book_ids": ids})
+    assert borrowed.status_code == 200
+    assert [r["success"] for r in borrowed.get_json()["results"]] == [True, True]
+
+    returned = client.post("/api/return/batch", json={"patron_id": "654321", "book_ids": ids}).get_json()
+    assert returned["message"].startswith("Returned 2 of 2 book(s).")
+
+    assert client.post("/api/borrow/batch", json={"patron_id": "654321", "book_ids": "1"}).status_code == 400
+    assert client.post("/api/return/batch", json={"patron_id": "x", "book_ids": ids}).status_code == 400
@@ -0,0 +1,77 @@
+import time
+import database
+from cache import LRUCache
+from database import get_book_by_id, get_book_by_isbn, insert_book, update_book_availability
+from services.library_service import borrow_book_by_patron
+
+## LRUCache
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=0.01)
+    cache.set("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+def test_lru_cache_drops_value_read_before_invalidation():
+    cache = LRUCache()
+    generation = cache.generation
+    cache.pop("a")  # a writer invalidates while the reader is loading
+    cache.set("a", "stale", generation)
+    assert cache.get("a") is None
+
+## Book cache
+
+def test_book_lookup_hits_cache():
+    insert_book("Cached", "Author", "7100000000001", 2, 2)
+    book = get_book_by_isbn("7100000000001")
+    before = database.get_book_cache_stats()["hits"]
+    assert get_book_by_id(book["id"]) == book
+    assert get_book_by_isbn("7100000000001") == book
+    assert database.get_book_cache_stats()["hits"] >= before + 2
+
+def test_book_cache_returns_copies():
+    insert_book("Cached", "Author", "7100000000002", 2, 2)
+    book = get_book_by_isbn("7100000000002")
+    book["title"] = "Mutated"
+    assert get_book_by_id(book["id"])["title"] == "Cached"
+
+def test_book_cache_invalidated_by_writes():
+    insert_book("Cached", "Author", "7100000000003", 2, 2)
+    book_id = get_book_by_isbn("7100000000003")["id"]
+    update_book_availability(book_id, -1)
+    assert get_book_by_id(book_id)["available_copies"] == 1
+    assert borrow_book_by_patron("123456", book_id)[0] is True
+    assert get_book_by_id(book_id)["available_copies"] == 0
+
+def test_book_cache_stats_endpoint():
+    from app import create_app
+    stats = create_app().test_client().get("/api/debug/book_cache").get_json()
+    assert {"hits", "misses", "evictions", "size", "maxsize"} <= set(stats)
+
+def test_book_cache_separates_databases(tmp_path, monkeypatch):
+    for name, title in (("a.db", "Book from A"), ("b.db", "Book from B")):
+        monkeypatch.setattr(database, "DATABASE", str(tmp_path / name))
+        database.init_database()
+        insert_book(title, "Author", "7100000000004", 1, 1)
+        assert get_book_by_id(1)["title"] == title
+        assert get_book_by_isbn("7100000000004")["title"] == title
+    monkeypatch.setattr(database, "DATABASE", str(tmp_path / "a.db"))
+    assert get_book_by_id(1)["title"] == "Book from A"
+
+def test_book_cache_cleared_with_connections():
+    insert_book("Cached", "Author", "7100000000005", 1, 1)
+    book_id = get_book_by_isbn("7100000000005")["id"]
+    database.close_all_connections()
+    assert len(database.book_cache) == 0
+    assert get_book_by_id(book_id)["title"] == "Cached"
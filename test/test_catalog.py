@@ -0,0 +1,72 @@
+import pytest
+from database import get_db_connection, insert_book
+from services.library_service import get_catalog_page, get_catalog_display, encode_cursor
+
+
+def add_books(n):
+    for i in range(n):
+        # Duplicate titles make sure ties are broken by id
+        insert_book(f"Title {i // 2:03d}", "Author", f"{8100000000000 + i}", 1, 1)
+
+## Keyset pagination
+
+def test_catalog_pages_cover_catalog_in_order():
+    add_books(7)
+    seen, cursor = [], None
+    while True:
+        page = get_catalog_page(after=cursor, page_size=3)
+        seen.extend(b["id"] for b in page["books"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [b["id"] for b in get_catalog_display()]
+    assert len(seen) == len(set(seen)) == 7
+
+def test_catalog_prev_cursor_returns_previous_page():
+    add_books(7)
+    first = get_catalog_page(page_size=3)
+    assert first["prev_cursor"] is None
+    second = get_catalog_page(after=first["next_cursor"], page_size=3)
+    back = get_catalog_page(before=second["prev_cursor"], page_size=3)
+    assert back["books"] == first["books"]
+    assert back["prev_cursor"] is None and back["next_cursor"] is not None
+
+def test_catalog_invalid_cursor_rejected():
+    with pytest.raises(ValueError):
+        get_catalog_page(after="not-a-cursor")
+
+def test_catalog_deep_page_is_index_seek():
+    add_books(4)
+    cursor = encode_cursor({"title": "Title 001", "id": 3})
+    conn = get_db_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        get_catalog_page(after=cursor, page_size=2)
+    finally:
+        conn.set_trace_callback(None)
+    plan = [r["detail"] for sql in statements for r in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+    assert any("idx_books_title" in step for step in plan)
+    assert not any(step.startswith("SCAN") or "TEMP B-TREE" in step for step in plan)
+
+def test_catalog_api_pages():
+    from app import create_app
+    client = create_app().test_client()
+    add_books(3)  # plus the 3 sample books
+
+    first = client.get("/api/catalog?limit=4").get_json()
+    assert first["count"] == 4 and first["next_cursor"]
+    rest = client.get(f"/api/catalog?limit=4&after={first['next_cursor']}").get_json()
+    assert rest["count"] == 2 and rest["next_cursor"] is None
+
+    assert client.get("/api/catalog?after=bogus").status_code == 400
+    assert client.get("/api/catalog?limit=0").status_code == 400
+
+def test_catalog_page_links():
+    from app import create_app
+    app = create_app()
+    app.config["CATALOG_PAGE_SIZE"] = 2
+    client = app.test_client()
+    html = client.get("/catalog").get_data(as_text=True)
+    assert "Next" in html and "Previous" not in html
+    assert client.get("/catalog?after=bogus").status_code == 200
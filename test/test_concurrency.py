@@ -0,0 +1,66 @@
+import threading
+from database import close_db, get_db_connection, get_book_by_isbn, insert_book
+from services.library_service import borrow_book_by_patron, return_book_by_patron
+
+THREADS = 16
+
+
+def run_threads(worker, count=THREADS):
+    """Start `count` threads on the same barrier so they hit the database together."""
+    barrier = threading.Barrier(count)
+    errors = []
+
+    def run(i):
+        try:
+            barrier.wait()
+            worker(i)
+        except Exception as e:  # surface failures from worker threads
+            errors.append(e)
+        finally:
+            close_db()
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+
+
+def test_concurrent_borrows_never_oversell_last_copies():
+    insert_book("Hot Book", "Author", "7700000000001", 3, 3)
+    book_id = get_book_by_isbn("7700000000001")["id"]
+    results = []
+
+    def worker(i):
+        results.append(borrow_book_by_patron(f"{200000 + i}", book_id))
+
+    run_threads(worker)
+
+    assert sum(1 for success, _ in results if success) == 3
+    assert get_book_by_isbn("7700000000001")["available_copies"] == 0
+    active = get_db_connection().execute(
+        "SELECT COUNT(*) FROM borrow_records WHERE book_id = ? AND return_date IS NULL", (book_id,)
+    ).fetchone()[0]
+    assert active == 3
+
+
+def test_concurrent_borrow_return_keeps_availability_consistent():
+    insert_book("Churn Book", "Author", "7700000000002", 2, 2)
+    book_id = get_book_by_isbn("7700000000002")["id"]
+    low_water = []
+
+    def worker(i):
+        patron_id = f"{300000 + i}"
+        conn = get_db_connection()
+        for _ in range(10):
+            if borrow_book_by_patron(patron_id, book_id)[0]:
+                return_book_by_patron(patron_id, book_id)
+            low_water.append(conn.execute(
+                "SELECT available_copies FROM books WHERE id = ?", (book_id,)).fetchone()[0])
+
+    run_threads(worker)
+
+    assert min(low_water) >= 0
+    book = get_book_by_isbn("7700000000002")
+    assert book["available_copies"] == book["total_copies"] == 2
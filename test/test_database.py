@@ -0,0 +1,149 @@
+import threading
+from datetime import datetime
+import pytest
+import database
+from database import get_db_connection, get_pool, close_db, get_book_by_id, insert_book
+
+## Connection pool
+
+def test_pool_reuses_connection_within_thread():
+    """Repeated helper calls in one thread share a single connection"""
+    conn = get_db_connection()
+    insert_book("Pool Book", "Pool Author", "5100000000001", 1, 1)
+    get_book_by_id(1)
+    assert get_db_connection() is conn
+    assert get_pool().stats()["open"] == 1
+
+def test_pool_gives_threads_separate_connections():
+    main_conn = get_db_connection()
+    seen = []
+
+    def worker():
+        seen.append(get_db_connection())
+        close_db()
+
+    t = threading.Thread(target=worker)
+    t.start()
+    t.join()
+    assert seen and seen[0] is not main_conn
+
+def test_pool_release_keeps_idle_connection_for_reuse():
+    conn = get_db_connection()
+    close_db()
+    assert get_pool().stats()["idle"] == 1
+    assert get_db_connection() is conn
+
+def test_pool_release_rolls_back_open_transaction():
+    conn = get_db_connection()
+    conn.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                 "VALUES ('T', 'A', '5100000000002', 1, 1)")
+    assert conn.in_transaction
+    close_db()
+    assert database.get_book_by_isbn("5100000000002") is None
+
+def test_pool_replaces_unhealthy_connection():
+    conn = get_db_connection()
+    close_db()
+    conn.close()  # simulate a connection that died while idle
+    fresh = get_db_connection()
+    assert fresh is not conn
+    assert fresh.execute("SELECT 1").fetchone()[0] == 1
+
+def test_pool_size_limits_idle_connections():
+    old_size = database.POOL_SIZE
+    database.configure_pool(1)
+    try:
+        conns = []
+
+        def worker():
+            get_db_connection()
+            conns.append(1)
+            barrier.wait()
+            close_db()
+
+        barrier = threading.Barrier(3)
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(conns) == 3
+        assert get_pool().stats()["idle"] == 1
+    finally:
+        database.configure_pool(old_size)
+
+def test_app_teardown_returns_connection_to_pool():
+    from app import create_app
+    app = create_app()
+    client = app.test_client()
+    assert client.get("/catalog").status_code == 200
+    assert get_pool().stats()["idle"] >= 1
+
+## Storage profile
+
+def pragma(name):
+    return get_db_connection().execute(f"PRAGMA {name}").fetchone()[0]
+
+def test_connections_use_wal_storage_profile():
+    assert pragma("journal_mode") == "wal"
+    assert pragma("synchronous") == 1  # NORMAL
+    assert pragma("temp_store") == 2  # MEMORY
+    assert pragma("busy_timeout") == database.DEFAULT_STORAGE_PROFILE["busy_timeout"]
+    assert pragma("cache_size") == database.DEFAULT_STORAGE_PROFILE["cache_size"]
+
+def test_create_app_overrides_storage_profile():
+    from app import create_app
+    try:
+        create_app({"SQLITE_PRAGMAS": {"synchronous": "FULL", "busy_timeout": 250}})
+        assert pragma("synchronous") == 2  # FULL
+        assert pragma("busy_timeout") == 250
+        assert pragma("journal_mode") == "wal"
+    finally:
+        database.configure_storage()
+
+def test_storage_profile_rejects_unknown_pragma():
+    with pytest.raises(ValueError):
+        database.configure_storage({"writable_schema": 1})
+    with pytest.raises(ValueError):
+        database.configure_storage({"journal_mode": "WAL; DROP TABLE books"})
+    assert database.STORAGE_PROFILE == database.DEFAULT_STORAGE_PROFILE
+
+## Schema migrations and indexes
+
+def test_migrations_record_schema_version():
+    conn = get_db_connection()
+    assert pragma("user_version") == len(database.MIGRATIONS)
+    database.init_database()  # re-running is a no-op
+    assert pragma("user_version") == len(database.MIGRATIONS)
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"idx_borrow_records_active_patron", "idx_borrow_records_active_loan",
+            "idx_borrow_records_book"} <= names
+
+def test_hot_borrow_record_queries_use_indexes():
+    """EXPLAIN every statement the loan helpers run; borrow_records must only be searched through an index"""
+    from services.library_service import LATE_FEE_RULE, borrow_book_by_patron, return_book_by_patron
+    insert_book("Plan Book", "Plan Author", "5100000000003", 2, 2)
+    book_id = database.get_book_by_isbn("5100000000003")["id"]
+
+    conn = get_db_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        borrow_book_by_patron("123456", book_id)
+        database.get_patron_borrowed_books("123456")
+        database.get_patron_borrow_count("123456")
+        database.get_patron_loans_with_fees("123456", datetime.now(), LATE_FEE_RULE)
+        database.update_borrow_record_return_date("123456", book_id, datetime.now())
+        borrow_book_by_patron("123456", book_id)
+        return_book_by_patron("123456", book_id)
+    finally:
+        conn.set_trace_callback(None)
+
+    hot = [sql for sql in statements
+           if "borrow_records" in sql and sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE"))]
+    assert any("julianday" in sql for sql in hot)
+    for sql in hot:
+        plan = [row["detail"] for row in conn.execute("EXPLAIN QUERY PLAN " + sql)]
+        loan_steps = [step for step in plan if step.split()[1] in ("borrow_records", "br")]
+        # A SCAN ... USING (COVERING) INDEX still reads every row; only SEARCHes are bounded
+        assert loan_steps and all(step.startswith("SEARCH") for step in loan_steps), f"{sql.strip()} -> {plan}"
@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+from datetime import date, datetime
+from database import get_db_connection, insert_book, insert_borrow_record
+from services.library_service import export_books, export_loans
+
+
+def add_history():
+    for i in range(3):
+        insert_book(f"Export {i}", "Author, Jr.", str(9900000000000 + i), 2, 2)
+    for day in (1, 15, 28):
+        borrowed = datetime(2025, 2, day, 10, 30)
+        insert_borrow_record("123456", 1, borrowed, datetime(2025, 3, day, 10, 30))
+
+## Streaming exports
+
+def test_export_books_csv_round_trips():
+    add_history()
+    text = "".join(export_books("csv"))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert [r["title"] for r in rows] == ["Export 0", "Export 1", "Export 2"]
+    assert rows[0]["author"] == "Author, Jr." and rows[0]["isbn"] == "9900000000000"
+
+def test_export_loans_ndjson_with_date_range():
+    add_history()
+    lines = "".join(export_loans("ndjson", date(2025, 2, 2), date(2025, 2, 28))).splitlines()
+    loans = [json.loads(line) for line in lines]
+    assert [loan["borrow_date"][:10] for loan in loans] == ["2025-02-15", "2025-02-28"]
+    assert set(loans[0]) == {"id", "patron_id", "book_id", "borrow_date", "due_date", "return_date"}
+
+def test_export_fetches_in_batches(mocker):
+    import services.library_service as library_service
+    for i in range(1200):
+        get_db_connection().execute(
+            "INSERT INTO books (title, author, isbn, total_copies, available_copies) VALUES (?, 'A', ?, 1, 1)",
+            (f"Bulk {i}", str(9910000000000 + i)))
+    get_db_connection().commit()
+    mocker.patch.object(library_service, "EXPORT_ROWS_PER_CHUNK", 500)
+
+    chunks = export_books("ndjson")
+    first = next(chunks)
+    assert first.count("\n") == 500  # rows are yielded before the table is fully read
+    assert sum(chunk.count("\n") for chunk in chunks) == 700
+
+def test_export_rejects_bad_arguments():
+    import pytest
+    with pytest.raises(ValueError):
+        export_books("xml")
+    with pytest.raises(ValueError):
+        export_loans("csv", date(2025, 3, 1), date(2025, 2, 1))
+
+def test_export_endpoints_stream():
+    from app import create_app
+    client = create_app().test_client()
+    add_history()
+
+    books = client.get("/api/export/books")
+    assert books.status_code == 200 and books.is_streamed
+    assert books.mimetype == "text/csv"
+    assert "attachment; filename=books.csv" in books.headers["Content-Disposition"]
+
+    loans = client.get("/api/export/loans?format=ndjson&start=2025-02-10&end=2025-12-31")
+    assert loans.mimetype == "application/x-ndjson"
+    assert len(loans.get_data(as_text=True).splitlines()) == 2
+
+    assert client.get("/api/export/loans?start=yesterday").status_code == 400
+    assert client.get("/api/export/books?format=xml").status_code == 400
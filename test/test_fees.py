@@ -0,0 +1,96 @@
+from datetime import datetime, timedelta
+from database import get_db_connection, insert_book, insert_borrow_record, update_borrow_record_return_date
+from services.library_service import (
+    calculate_late_fee_for_book,
+    compute_late_fee,
+    get_patron_status_report,
+    run_fee_batch
+)
+
+OVERDUE_OFFSETS = [-3, 0, 1, 6, 7, 8, 10, 18, 19, 40]
+
+
+def add_loans(patron_id, offsets, isbn_base=9100000000000):
+    """Borrow one new book per offset, due `offset` days ago."""
+    now = datetime.now()
+    book_ids = []
+    for i, days in enumerate(offsets):
+        insert_book(f"Fee Book {i}", "Author", str(isbn_base + i), 1, 1)
+        book_id = get_db_connection().execute("SELECT MAX(id) FROM books").fetchone()[0]
+        insert_borrow_record(patron_id, book_id, now - timedelta(days=days + 14), now - timedelta(days=days))
+        book_ids.append(book_id)
+    return book_ids
+
+## Late fees computed in SQL
+
+def test_report_fees_match_python_fee_rule():
+    book_ids = add_loans("555555", OVERDUE_OFFSETS)
+    report = get_patron_status_report("555555")
+
+    fees = {b["book_id"]: b["late_fee"] for b in report["currently_borrowed"]}
+    for book_id in book_ids:
+        assert fees[book_id] == calculate_late_fee_for_book("555555", book_id)["fee_amount"]
+    assert report["num_currently_borrowed"] == len(OVERDUE_OFFSETS)
+    assert report["total_late_fees"] == round(sum(fees.values()), 2)
+
+def test_report_overdue_flags_and_cap():
+    add_loans("555555", [0, 1, 40])
+    borrowed = get_patron_status_report("555555")["currently_borrowed"]
+    assert [b["is_overdue"] for b in borrowed] == [True, True, False]  # ordered by borrow date
+    assert borrowed[0]["late_fee"] == 15.00
+    assert isinstance(borrowed[0]["due_date"], datetime)
+
+def test_report_is_a_single_query():
+    add_loans("555555", OVERDUE_OFFSETS)
+    conn = get_db_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        get_patron_status_report("555555")
+    finally:
+        conn.set_trace_callback(None)
+    assert len(statements) == 1
+
+def test_compute_late_fee_tiers():
+    now = datetime(2025, 3, 20, 9, 0)
+    assert compute_late_fee(now + timedelta(days=2), now) == (0.0, 0)
+    assert compute_late_fee(now - timedelta(days=7), now) == (3.5, 7)
+    assert compute_late_fee(now - timedelta(days=8), now) == (4.5, 8)
+    assert compute_late_fee(now - timedelta(days=30), now) == (15.0, 30)
+
+## Batch fee run
+
+def test_fee_batch_totals_per_patron():
+    now = datetime.now()
+    add_loans("111111", [1, 10], isbn_base=9200000000000)
+    add_loans("222222", [30, 0, -5], isbn_base=9300000000000)
+    returned = add_loans("333333", [12], isbn_base=9400000000000)
+    update_borrow_record_return_date("333333", returned[0], now)
+
+    result = run_fee_batch()
+
+    expected_111 = compute_late_fee(now - timedelta(days=1))[0] + compute_late_fee(now - timedelta(days=10))[0]
+    assert result["patron_totals"] == {"111111": expected_111, "222222": 15.0}
+    assert result["total_late_fees"] == round(expected_111 + 15.0, 2)
+
+    rows = get_db_connection().execute(
+        "SELECT patron_id, overdue_loans, total_fee FROM fee_snapshots WHERE snapshot_date = ? ORDER BY patron_id",
+        (now.date().isoformat(),)).fetchall()
+    assert [tuple(r) for r in rows] == [("111111", 2, expected_111), ("222222", 1, 15.0)]
+
+def test_fee_batch_rerun_replaces_snapshot():
+    add_loans("111111", [3], isbn_base=9200000000000)
+    run_fee_batch()
+    get_db_connection().execute("UPDATE borrow_records SET return_date = due_date")
+    get_db_connection().commit()
+
+    assert run_fee_batch()["patron_totals"] == {}
+    count = get_db_connection().execute("SELECT COUNT(*) FROM fee_snapshots").fetchone()[0]
+    assert count == 0
+
+def test_fee_batch_cli_command():
+    from app import create_app
+    add_loans("111111", [9], isbn_base=9200000000000)
+    result = create_app().test_cli_runner().invoke(args=["fee-batch"])
+    assert result.exit_code == 0
+    assert "owe $" in result.output
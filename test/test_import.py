@@ -0,0 +1,112 @@
+import io
+import json
+from database import get_book_by_isbn, get_db_connection, insert_book
+from services.library_service import import_books
+
+CSV_FEED = """title,author,isbn,total_copies
+Feed One,Author A,9600000000001,2
+Feed Two,Author B,9600000000002,1
+,Author C,9600000000003,1
+Feed Four,Author D,123,1
+Feed Five,Author E,9600000000005,zero
+Feed Dup,Author F,9600000000001,1
+Existing,Author G,9780743273565,1
+"""
+
+
+def book_count():
+    return get_db_connection().execute("SELECT COUNT(*) FROM books").fetchone()[0]
+
+## Bulk import
+
+def test_csv_import_reports_row_errors_and_continues():
+    insert_book("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565", 3, 3)
+    before = book_count()
+    result = import_books(io.StringIO(CSV_FEED), "csv", batch_size=2)
+
+    assert result["rows"] == 7 and result["imported"] == 2 and result["failed"] == 5
+    assert [(e["line"], e["error"]) for e in result["errors"]] == [
+        (4, "Title is required."),
+        (5, "ISBN must be exactly 13 digits."),
+        (6, "Total copies must be a positive integer."),
+        (7, "A book with this ISBN already exists."),
+        (8, "A book with this ISBN already exists."),
+    ]
+    assert book_count() == before + 2
+    book = get_book_by_isbn("9600000000001")
+    assert book["title"] == "Feed One" and book["total_copies"] == book["available_copies"] == 2
+
+def test_jsonl_import_handles_bad_lines():
+    lines = [
+        json.dumps({"title": "J One", "author": "A", "isbn": "9600000000011", "total_copies": 3}),
+        "{not json",
+        "",
+        json.dumps(["not", "an", "object"]),
+        json.dumps({"title": "J Two", "author": "A", "isbn": 9600000000012, "total_copies": True}),
+    ]
+    result = import_books(io.StringIO("\n".join(lines)), "jsonl")
+    assert result["imported"] == 1
+    assert [e["line"] for e in result["errors"]] == [2, 4, 5]
+    assert get_book_by_isbn("9600000000011")["total_copies"] == 3
+
+def test_import_uses_batched_executemany():
+    rows = "".join(f"Title {i},Author,{9610000000000 + i},1\n" for i in range(25))
+    conn = get_db_connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        result = import_books(io.StringIO("title,author,isbn,total_copies\n" + rows), "csv", batch_size=10)
+    finally:
+        conn.set_trace_callback(None)
+    assert result["imported"] == 25
+    assert sum(s.startswith("BEGIN") for s in statements) == 3
+
+def test_import_error_list_is_capped():
+    rows = "".join(f"Bad {i},Author,1,1\n" for i in range(5))
+    result = import_books(io.StringIO("title,author,isbn,total_copies\n" + rows), "csv", max_errors=2)
+    assert result["failed"] == 5 and len(result["errors"]) == 2 and result["errors_truncated"]
+
+def test_import_cli_command(tmp_path):
+    from app import create_app
+    feed = tmp_path / "feed.jsonl"
+    feed.write_text(json.dumps({"title": "Cli", "author": "A", "isbn": "9600000000021", "total_copies": 1}) + "\n")
+    result = create_app().test_cli_runner().invoke(args=["import-books", str(feed)])
+    assert result.exit_code == 0
+    assert "Imported 1 of 1 row(s); 0 failed." in result.output
+
+def test_import_api_accepts_upload_and_raw_body():
+    from app import create_app
+    client = create_app().test_client()
+    insert_book("The Great Gatsby", "F. Scott Fitzgerald", "9780743273565", 3, 3)
+    upload = client.post("/api/books/import",
+                         data={"file": (io.BytesIO(CSV_FEED.encode()), "feed.csv")},
+                         content_type="multipart/form-data")
+    assert upload.status_code == 200 and upload.get_json()["imported"] == 2
+
+    raw = client.post("/api/books/import", content_type="application/x-ndjson",
+                      data=json.dumps({"title": "Raw", "author": "A", "isbn": "9600000000031", "total_copies": 1}))
+    assert raw.get_json()["imported"] == 1
+    assert client.post("/api/books/import?format=xml", data="").status_code == 400
+
+def test_import_api_reports_invalid_utf8_rows():
+    from app import create_app
+    client = create_app().test_client()
+    body = (b"title,author,isbn,total_copies\n"
+            b"Good One,Author,9600000000041,1\n"
+            b"Bad \xff Title,Author,9600000000042,1\n"
+            b"Good Two,Author,9600000000043,1\n")
+    response = client.post("/api/books/import?format=csv", data=body)
+    assert response.status_code == 200
+    result = response.get_json()
+    assert result["imported"] == 2 and result["failed"] == 1
+    assert result["errors"] == [{"line": 3, "isbn": None, "error": "Row is not valid UTF-8 text."}]
+    assert get_book_by_isbn("9600000000042") is None
+
+    jsonl = client.post("/api/books/import?format=jsonl", data=b'{"title": "\xc3\x28"}\n')
+    assert jsonl.status_code == 200 and jsonl.get_json()["errors"][0]["line"] == 1
+
+def test_import_strict_stream_stops_at_invalid_utf8():
+    stream = io.TextIOWrapper(io.BytesIO(b"title,author,isbn,total_copies\nBad \xff,A,9600000000051,1\n"),
+                              encoding="utf-8", newline="")
+    result = import_books(stream, "csv")
+    assert result["failed"] == 1 and "not valid UTF-8" in result["errors"][0]["error"]
@@ -0,0 +1,77 @@
+from unittest.mock import Mock
+from metrics import GATEWAY_LATENCY, HTTP_REQUESTS, SERVICE_LATENCY, Registry, timer
+from services.payment_service import PaymentGateway
+
+
+def count(family, **labels):
+    return family.labels(**labels).cumulative()[2]
+
+## Registry and exposition format
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = registry.counter("demo_requests_total", "Demo requests.", ("path",))
+    latency = registry.histogram("demo_seconds", "Demo latency.", buckets=(0.1, 1.0))
+    requests.labels(path='/a"b').inc()
+    latency.labels().observe(0.5)
+    latency.labels().observe(2.0)
+
+    assert registry.render().splitlines() == [
+        "# HELP demo_requests_total Demo requests.",
+        "# TYPE demo_requests_total counter",
+        'demo_requests_total{path="/a\\"b"} 1',
+        "# HELP demo_seconds Demo latency.",
+        "# TYPE demo_seconds histogram",
+        'demo_seconds_bucket{le="0.1"} 0',
+        'demo_seconds_bucket{le="1.0"} 1',
+        'demo_seconds_bucket{le="+Inf"} 2',
+        "demo_seconds_sum 2.5",
+        "demo_seconds_count 2",
+    ]
+
+def test_timer_records_outcome():
+    registry = Registry()
+    calls = registry.histogram("calls_seconds", "Calls.", ("method", "outcome"))
+    with timer(calls, method="charge") as call:
+        call.outcome = "declined"
+    try:
+        with timer(calls, method="charge"):
+            raise ValueError
+    except ValueError:
+        pass
+    assert count(calls, method="charge", outcome="declined") == 1
+    assert count(calls, method="charge", outcome="error") == 1
+
+## Instrumented app
+
+def test_metrics_endpoint_counts_requests_by_endpoint():
+    from app import create_app
+    client = create_app().test_client()
+    before = HTTP_REQUESTS.labels(endpoint="catalog.catalog", method="GET", status="200").value
+    client.get("/catalog")
+    client.get("/no-such-page")
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    body = response.get_data(as_text=True)
+    assert HTTP_REQUESTS.labels(endpoint="catalog.catalog", method="GET", status="200").value == before + 1
+    assert 'http_requests_total{endpoint="unmatched",method="GET",status="404"}' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="catalog.catalog",method="GET",le="+Inf"}' in body
+
+def test_service_and_gateway_calls_timed(mocker):
+    from services.library_service import borrow_book_by_patron, pay_late_fees
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 return_value={"fee_amount": 2.0, "days_overdue": 4, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Timed", "available_copies": 1, "total_copies": 1})
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (False, "", "declined")
+    borrows = count(SERVICE_LATENCY, operation="borrow_book_by_patron")
+    declines = count(GATEWAY_LATENCY, method="process_payment", outcome="declined")
+
+    borrow_book_by_patron("123456", 999)
+    pay_late_fees("123456", 1, gateway)
+
+    assert count(SERVICE_LATENCY, operation="borrow_book_by_patron") == borrows + 1
+    assert count(GATEWAY_LATENCY, method="process_payment", outcome="declined") == declines + 1
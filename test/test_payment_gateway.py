@@ -0,0 +1,336 @@
+import pytest
+from benchmarks.payment_standin import StandInPaymentServer
+from services import payment_service
+from services.payment_service import (
+    CircuitBreaker, CircuitOpenError, HttpPaymentGateway, PaymentGateway, PaymentNotSentError,
+    PaymentOutcomeUnknownError, PaymentTimeoutError, ResilientPaymentGateway, get_payment_gateway,
+    set_payment_gateway
+)
+
+
+@pytest.fixture
+def standin():
+    server = StandInPaymentServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(autouse=True)
+def reset_shared_gateway():
+    yield
+    set_payment_gateway(None)
+
+## HttpPaymentGateway against the local stand-in
+
+def test_http_gateway_reuses_one_connection(standin):
+    gateway = HttpPaymentGateway(base_url=standin.url)
+    for _ in range(5):
+        success, txn, msg = gateway.process_payment("123456", 4.5, "Late fees")
+        assert success is True and txn.startswith("txn_123456_")
+    assert standin.connections == 1
+    gateway.close()
+
+def test_http_gateway_maps_declines(standin):
+    gateway = HttpPaymentGateway(base_url=standin.url)
+    success, txn, msg = gateway.process_payment("123456", 5000.0, "Late fees")
+    assert success is False and txn == ""
+    assert "exceeds limit" in msg
+    gateway.close()
+
+def test_http_gateway_refund_and_status(standin):
+    gateway = HttpPaymentGateway(base_url=standin.url)
+    _, txn, _ = gateway.process_payment("123456", 6.0, "Late fees")
+    assert gateway.verify_payment_status(txn)["status"] == "completed"
+    assert gateway.verify_payment_status("txn_missing")["status"] == "not_found"
+    success, msg = gateway.refund_payment(txn, 6.0)
+    assert success is True and "refund id" in msg.lower()
+    assert gateway.refund_payment(txn, 60.0)[0] is False
+    gateway.close()
+
+def test_http_gateway_timeout_raises(standin):
+    import requests
+    standin.latency = 0.3
+    gateway = HttpPaymentGateway(base_url=standin.url, timeout=(1.0, 0.05), retries=0)
+    with pytest.raises(requests.exceptions.Timeout):
+        gateway.process_payment("123456", 4.5, "Late fees")
+    gateway.close()
+
+def test_http_gateway_looks_up_charges_by_idempotency_key(standin):
+    gateway = HttpPaymentGateway(base_url=standin.url)
+    _, txn, _ = gateway.process_payment("123456", 4.5, "Late fees", idempotency_key="123456:1:1")
+    assert gateway.process_payment("123456", 4.5, "Late fees", idempotency_key="123456:1:1")[1] == txn
+    assert list(standin.charges) == [txn]
+    found = gateway.verify_payment_status(idempotency_key="123456:1:1")
+    assert found["status"] == "completed" and found["transaction_id"] == txn
+    assert gateway.verify_payment_status(idempotency_key="123456:1:2")["status"] == "not_found"
+    gateway.close()
+
+def test_http_gateway_connection_refused_is_not_sent():
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    gateway = HttpPaymentGateway(base_url=f"http://127.0.0.1:{port}", retries=0)
+    with pytest.raises(PaymentNotSentError):
+        gateway.process_payment("123456", 4.5, "Late fees")
+    gateway.close()
+
+def test_simulated_gateway_looks_up_charges_by_idempotency_key(mocker):
+    mocker.patch("services.payment_service.time.sleep")
+    gateway = PaymentGateway()
+    _, txn, _ = gateway.process_payment("123456", 4.5, idempotency_key="123456:1:1")
+    assert gateway.verify_payment_status(idempotency_key="123456:1:1")["transaction_id"] == txn
+    assert gateway.verify_payment_status(idempotency_key="123456:1:2")["status"] == "not_found"
+
+## Shared gateway
+
+def test_shared_gateway_defaults_to_simulated():
+    assert type(get_payment_gateway()) is PaymentGateway
+    assert get_payment_gateway() is get_payment_gateway()
+
+def test_create_app_configures_http_gateway(standin):
+    from app import create_app
+    create_app({"PAYMENT_GATEWAY_URL": standin.url, "PAYMENT_POOL_SIZE": 4})
+    gateway = get_payment_gateway().gateway
+    assert isinstance(gateway, HttpPaymentGateway)
+    assert gateway.base_url == standin.url
+    assert gateway.session.get_adapter(standin.url)._pool_maxsize == 4
+
+def test_pay_late_fees_uses_shared_gateway(mocker):
+    from unittest.mock import Mock
+    from services.library_service import pay_late_fees
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 return_value={"fee_amount": 2.0, "days_overdue": 4, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Shared", "available_copies": 1, "total_copies": 1})
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.return_value = (True, "txn_1", "OK")
+    payment_service.set_payment_gateway(gateway)
+
+    assert pay_late_fees("123456", 1) == (True, "Payment successful! OK", "txn_1")
+
+## Async gateway and bulk settlement
+
+def test_async_gateway_matches_sync_outcomes():
+    import asyncio
+    from services.payment_service import AsyncPaymentGateway
+    gateway = AsyncPaymentGateway(payment_latency=0, refund_latency=0, status_latency=0)
+
+    success, txn, _ = asyncio.run(gateway.process_payment("123456", 4.5, "Late fees"))
+    assert success is True and txn.startswith("txn_123456_")
+    assert asyncio.run(gateway.process_payment("123456", 5000.0))[0] is False
+    assert asyncio.run(gateway.refund_payment(txn, 4.5))[0] is True
+    assert asyncio.run(gateway.verify_payment_status(txn))["status"] == "completed"
+
+def test_bulk_payments_keep_order_and_isolate_errors(mocker):
+    from unittest.mock import AsyncMock
+    from services.library_service import pay_late_fees_bulk
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 side_effect=lambda patron_id, book_id: {"fee_amount": float(book_id), "days_overdue": 3, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Bulk", "available_copies": 1, "total_copies": 1})
+
+    async def process(patron_id, amount, description="", idempotency_key=None):
+        if amount == 2.0:
+            raise ConnectionError("reset")
+        if amount == 3.0:
+            return False, "", "declined"
+        return True, f"txn_{patron_id}", "OK"
+    gateway = AsyncMock()
+    gateway.process_payment.side_effect = process
+
+    results = pay_late_fees_bulk([("111111", 1), ("222222", 2), ("333333", 3), ("bad", 4)], gateway)
+    assert results == [
+        (True, "Payment successful! OK", "txn_111111"),
+        (False, "Payment processing error: reset", None),
+        (False, "Payment failed: declined", None),
+        (False, "Invalid patron ID. Must be exactly 6 digits.", None),
+    ]
+
+def test_bulk_payments_overlap_gateway_calls(mocker):
+    import time
+    from services.library_service import pay_late_fees_bulk
+    from services.payment_service import AsyncPaymentGateway
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 return_value={"fee_amount": 2.0, "days_overdue": 4, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Bulk", "available_copies": 1, "total_copies": 1})
+    gateway = AsyncPaymentGateway(payment_latency=0.05)
+
+    start = time.perf_counter()
+    results = pay_late_fees_bulk([(f"{100000 + i}", 1) for i in range(200)], gateway, max_concurrency=50)
+    elapsed = time.perf_counter() - start
+
+    assert all(r[0] for r in results)
+    assert elapsed < 1.0  # 10s if run one at a time
+
+def test_bulk_payments_default_to_shared_gateway(standin, mocker):
+    from app import create_app
+    from services.library_service import pay_late_fees_bulk
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 return_value={"fee_amount": 2.0, "days_overdue": 4, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Bulk", "available_copies": 1, "total_copies": 1})
+    create_app({"PAYMENT_GATEWAY_URL": standin.url})
+
+    results = pay_late_fees_bulk([("111111", 1), ("222222", 1)])
+    assert all(success for success, _, _ in results)
+    assert sorted(txn for _, _, txn in results) == sorted(standin.charges)
+
+def test_bulk_payments_respect_shared_breaker(mocker):
+    from unittest.mock import Mock
+    from services.library_service import pay_late_fees_bulk
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 return_value={"fee_amount": 2.0, "days_overdue": 4, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Bulk", "available_copies": 1, "total_copies": 1})
+    inner = Mock(spec=PaymentGateway)
+    inner.api_key, inner.base_url = "key", "http://provider"
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+    set_payment_gateway(ResilientPaymentGateway(inner, breaker=breaker))
+
+    success, message, _ = pay_late_fees_bulk([("111111", 1)])[0]
+    assert success is False and "circuit open" in message
+    inner.process_payment.assert_not_called()
+
+## Circuit breaker and deadlines
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def flaky_gateway(*results):
+    from unittest.mock import Mock
+    gateway = Mock(spec=PaymentGateway)
+    gateway.api_key, gateway.base_url = "key", "http://gateway"
+    gateway.process_payment.side_effect = list(results)
+    return gateway
+
+def test_breaker_opens_fails_fast_and_recovers_after_probe():
+    clock = FakeClock()
+    inner = flaky_gateway(ConnectionError("down"), ConnectionError("down"), (True, "txn_1", "OK"))
+    gateway = ResilientPaymentGateway(inner, CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock))
+
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            gateway.process_payment("123456", 1.0)
+    assert gateway.breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        gateway.process_payment("123456", 1.0)
+    assert inner.process_payment.call_count == 2
+
+    clock.now = 10.0
+    assert gateway.process_payment("123456", 1.0) == (True, "txn_1", "OK")
+    stats = gateway.stats()
+    assert stats["breaker"]["state"] == "closed" and stats["breaker"]["times_opened"] == 1
+    assert stats["calls"]["process_payment"]["rejected"] == 1
+    assert stats["calls"]["process_payment"]["latency"]["count"] == 3
+    gateway.close()
+
+def test_failed_half_open_probe_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=5, clock=clock)
+    breaker.record_failure()
+    clock.now = 5.0
+    assert breaker.allow() is True and breaker.state == "half_open"
+    assert breaker.allow() is False  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.snapshot()["retry_in"] == 5.0
+
+def test_declines_do_not_trip_breaker():
+    inner = flaky_gateway(*[(False, "", "declined")] * 3)
+    gateway = ResilientPaymentGateway(inner, CircuitBreaker(failure_threshold=2))
+    for _ in range(3):
+        assert gateway.process_payment("123456", 1.0)[0] is False
+    assert gateway.breaker.state == "closed"
+    gateway.close()
+
+def test_call_deadline_bounds_slow_provider(standin):
+    import time
+    standin.latency = 0.5
+    gateway = ResilientPaymentGateway(HttpPaymentGateway(base_url=standin.url), call_timeout=0.1)
+    start = time.perf_counter()
+    with pytest.raises(PaymentTimeoutError):
+        gateway.process_payment("123456", 4.5, "Late fees")
+    assert time.perf_counter() - start < 0.4
+    assert gateway.stats()["calls"]["process_payment"]["timeout"] == 1
+    gateway.close()
+
+def test_charge_queued_past_deadline_is_not_sent():
+    import time
+    inner = flaky_gateway()
+    inner.process_payment.side_effect = lambda *args, **kwargs: time.sleep(0.3) or (True, "txn_1", "OK")
+    gateway = ResilientPaymentGateway(inner, call_timeout=0.1, max_workers=1)
+
+    with pytest.raises(PaymentOutcomeUnknownError):
+        gateway.process_payment("123456", 1.0)
+    with pytest.raises(PaymentNotSentError):  # the only thread is still busy with the first charge
+        gateway.process_payment("123456", 2.0)
+    time.sleep(0.3)
+    assert inner.process_payment.call_count == 1
+    gateway.close()
+
+def test_bulk_payments_fit_the_gateway_threads(mocker):
+    import time
+    from services.library_service import pay_late_fees_bulk
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 return_value={"fee_amount": 2.0, "days_overdue": 4, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Bulk", "available_copies": 1, "total_copies": 1})
+    inner = flaky_gateway()
+    inner.process_payment.side_effect = lambda *args, **kwargs: time.sleep(0.15) or (True, "txn_1", "OK")
+    gateway = ResilientPaymentGateway(inner, call_timeout=0.25, max_workers=2)
+    set_payment_gateway(gateway)
+    try:
+        results = pay_late_fees_bulk([(f"{100000 + i}", 1) for i in range(6)])
+    finally:
+        set_payment_gateway(None)
+        gateway.close()
+    assert all(success for success, _, _ in results)
+    assert gateway.stats()["calls"]["process_payment"]["timeout"] == 0
+
+def test_hedged_status_check_takes_first_answer():
+    import time
+    from unittest.mock import Mock
+    delays = iter([1.0, 0.0])
+
+    def verify(transaction_id):
+        time.sleep(next(delays))
+        return {"status": "completed", "transaction_id": transaction_id}
+    inner = Mock(spec=PaymentGateway)
+    inner.api_key, inner.base_url = "key", "http://gateway"
+    inner.verify_payment_status.side_effect = verify
+    gateway = ResilientPaymentGateway(inner, call_timeout=2.0, hedge_after=0.05)
+
+    start = time.perf_counter()
+    assert gateway.verify_payment_status("txn_1")["status"] == "completed"
+    assert time.perf_counter() - start < 0.5
+    assert gateway.stats()["hedged_requests"] == 1
+    gateway.close()
+
+def test_pay_late_fees_fails_fast_when_circuit_open(mocker):
+    from services.library_service import pay_late_fees
+    mocker.patch("services.library_service.calculate_late_fee_for_book",
+                 return_value={"fee_amount": 2.0, "days_overdue": 4, "status": "OK"})
+    mocker.patch("services.library_service.get_book_by_id",
+                 return_value={"id": 1, "title": "Open", "available_copies": 1, "total_copies": 1})
+    inner = flaky_gateway()
+    breaker = CircuitBreaker(failure_threshold=1)
+    breaker.record_failure()
+
+    success, msg, txn = pay_late_fees("123456", 1, ResilientPaymentGateway(inner, breaker))
+    assert success is False and "circuit open" in msg
+    inner.process_payment.assert_not_called()
+
+def test_payment_health_endpoint():
+    from app import create_app
+    client = create_app({"PAYMENT_BREAKER_THRESHOLD": 3}).test_client()
+    health = client.get("/api/payments/health").get_json()
+    assert health["breaker"]["state"] == "closed"
+    assert health["breaker"]["failure_threshold"] == 3
+    assert set(health["calls"]) == {"process_payment", "refund_payment", "verify_payment_status"}
@@ -0,0 +1,223 @@
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock
+from database import get_db_connection, get_payment, insert_book, insert_borrow_record
+from services.library_service import (
+    PAYMENT_PENDING_TIMEOUT, pay_late_fees, pay_late_fees_bulk, payment_idempotency_key
+)
+from services.payment_service import PaymentGateway, PaymentNotSentError
+
+
+def overdue_loan(patron_id="123456", days=10, isbn="9500000000000"):
+    insert_book("Ledger Book", "Author", isbn, 1, 1)
+    book_id = get_db_connection().execute("SELECT MAX(id) FROM books").fetchone()[0]
+    now = datetime.now()
+    insert_borrow_record(patron_id, book_id, now - timedelta(days=days + 14), now - timedelta(days=days))
+    loan_id = get_db_connection().execute("SELECT MAX(id) FROM borrow_records").fetchone()[0]
+    return book_id, loan_id
+
+
+def gateway_returning(*results):
+    gateway = Mock(spec=PaymentGateway)
+    gateway.process_payment.side_effect = list(results)
+    return gateway
+
+## Idempotent payments
+
+def test_repeat_payment_answered_from_ledger():
+    book_id, loan_id = overdue_loan()
+    gateway = gateway_returning((True, "txn_1", "Charged $6.50"))
+
+    first = pay_late_fees("123456", book_id, gateway)
+    repeat = pay_late_fees("123456", book_id, gateway)
+
+    assert first == (True, "Payment successful! Charged $6.50", "txn_1")
+    assert repeat == (True, "Payment already processed. Charged $6.50", "txn_1")
+    gateway.process_payment.assert_called_once()
+    payment = get_payment(payment_idempotency_key("123456", book_id, loan_id, 6.5))
+    assert payment["status"] == "completed" and payment["transaction_id"] == "txn_1"
+    assert payment["amount"] == 6.5
+
+def test_failed_payment_can_be_retried():
+    book_id, loan_id = overdue_loan()
+    gateway = gateway_returning((False, "", "declined"), PaymentNotSentError("refused"), (True, "txn_2", "OK"))
+
+    assert pay_late_fees("123456", book_id, gateway)[0] is False
+    assert pay_late_fees("123456", book_id, gateway)[1] == "Payment processing error: refused"
+    assert get_payment(payment_idempotency_key("123456", book_id, loan_id, 6.5))["status"] == "failed"
+    assert pay_late_fees("123456", book_id, gateway) == (True, "Payment successful! OK", "txn_2")
+    assert gateway.process_payment.call_count == 3
+    gateway.verify_payment_status.assert_not_called()
+
+def test_timed_out_payment_is_settled_before_retry():
+    book_id, loan_id = overdue_loan()
+    key = payment_idempotency_key("123456", book_id, loan_id, 6.5)
+    gateway = gateway_returning(TimeoutError("read timed out"), (True, "txn_8", "OK"))
+    gateway.verify_payment_status.return_value = {"status": "completed", "transaction_id": "txn_8"}
+
+    assert pay_late_fees("123456", book_id, gateway)[1] == "Payment processing error: read timed out"
+    assert get_payment(key)["status"] == "unknown"
+    success, message, txn = pay_late_fees("123456", book_id, gateway)
+    assert success is True and message.startswith("Payment already processed") and txn == "txn_8"
+    gateway.process_payment.assert_called_once()
+    gateway.verify_payment_status.assert_called_once_with(idempotency_key=key)
+    assert get_payment(key)["status"] == "completed"
+
+def test_unknown_payment_charged_again_only_when_provider_has_none():
+    book_id, loan_id = overdue_loan()
+    gateway = gateway_returning(ConnectionError("reset"), (True, "txn_9", "OK"))
+    gateway.verify_payment_status.side_effect = [ConnectionError("down"), {"status": "not_found"}]
+
+    pay_late_fees("123456", book_id, gateway)
+    success, message, _ = pay_late_fees("123456", book_id, gateway)
+    assert success is False and "still being confirmed" in message
+    assert gateway.process_payment.call_count == 1
+    assert pay_late_fees("123456", book_id, gateway) == (True, "Payment successful! OK", "txn_9")
+    assert gateway.process_payment.call_count == 2
+
+def test_timeout_then_retry_charges_provider_once():
+    from benchmarks.payment_standin import StandInPaymentServer
+    from services.payment_service import HttpPaymentGateway
+    book_id, _ = overdue_loan()
+    standin = StandInPaymentServer(latency=0.3).start()
+    gateway = HttpPaymentGateway(base_url=standin.url, timeout=(1.0, 0.1), retries=0)
+    try:
+        assert "Payment processing error" in pay_late_fees("123456", book_id, gateway)[1]
+        time.sleep(0.4)  # the provider finishes the charge after the client gave up
+        standin.latency = 0
+        success, _, txn = pay_late_fees("123456", book_id, gateway)
+        assert success is True and list(standin.charges) == [txn]
+    finally:
+        gateway.close()
+        standin.stop()
+
+def test_abandoned_charge_is_not_charged_again():
+    from benchmarks.payment_standin import StandInPaymentServer
+    from services.payment_service import HttpPaymentGateway, ResilientPaymentGateway
+    book_id, loan_id = overdue_loan()
+    key = payment_idempotency_key("123456", book_id, loan_id, 6.5)
+    standin = StandInPaymentServer(latency=0.3).start()
+    gateway = ResilientPaymentGateway(HttpPaymentGateway(base_url=standin.url, retries=0), call_timeout=0.1)
+    try:
+        assert "may still complete" in pay_late_fees("123456", book_id, gateway)[1]
+        assert get_payment(key)["status"] == "unknown"
+        success, message, _ = pay_late_fees("123456", book_id, gateway)
+        assert success is False and "still being confirmed" in message
+        time.sleep(0.4)  # the abandoned charge completes on its worker thread
+        standin.latency = 0
+        success, message, txn = pay_late_fees("123456", book_id, gateway)
+        assert success is True and message.startswith("Payment already processed")
+        assert list(standin.charges) == [txn]
+    finally:
+        gateway.close()
+        standin.stop()
+
+class LegacyGateway(PaymentGateway):
+    """A gateway written before process_payment took an idempotency key."""
+
+    def process_payment(self, patron_id, amount, description=""):
+        return True, f"txn_{patron_id}_legacy", "OK"
+
+def test_gateway_without_idempotency_keys_still_charges():
+    from services.payment_service import ResilientPaymentGateway
+    book_id, loan_id = overdue_loan()
+    assert pay_late_fees("123456", book_id, LegacyGateway()) == (True, "Payment successful! OK", "txn_123456_legacy")
+    assert get_payment(payment_idempotency_key("123456", book_id, loan_id, 6.5))["status"] == "completed"
+
+    book_id, _ = overdue_loan(patron_id="654321", isbn="9500000000001")
+    gateway = ResilientPaymentGateway(LegacyGateway())
+    try:
+        assert pay_late_fees("654321", book_id, gateway)[2] == "txn_654321_legacy"
+    finally:
+        gateway.close()
+
+def test_pending_payment_is_not_charged_again():
+    book_id, loan_id = overdue_loan()
+    conn = get_db_connection()
+    conn.execute('''INSERT INTO payments (idempotency_key, patron_id, book_id, loan_id, amount, status,
+                                          created_at, updated_at)
+                    VALUES (?, '123456', ?, ?, 6.5, 'pending', ?, ?)''',
+                 (payment_idempotency_key("123456", book_id, loan_id, 6.5), book_id, loan_id,
+                  datetime.now().isoformat(), datetime.now().isoformat()))
+    conn.commit()
+    gateway = gateway_returning((True, "txn_3", "OK"))
+
+    success, msg, txn = pay_late_fees("123456", book_id, gateway)
+    assert success is False and "in progress" in msg and txn is None
+    gateway.process_payment.assert_not_called()
+
+def test_stale_pending_payment_is_reconciled():
+    book_id, loan_id = overdue_loan()
+    key = payment_idempotency_key("123456", book_id, loan_id, 6.5)
+    abandoned = (datetime.now() - timedelta(seconds=PAYMENT_PENDING_TIMEOUT + 60)).isoformat()
+    conn = get_db_connection()
+    conn.execute('''INSERT INTO payments (idempotency_key, patron_id, book_id, loan_id, amount, status,
+                                          created_at, updated_at)
+                    VALUES (?, '123456', ?, ?, 6.5, 'pending', ?, ?)''', (key, book_id, loan_id, abandoned, abandoned))
+    conn.commit()
+    gateway = gateway_returning((True, "txn_10", "OK"))
+    gateway.verify_payment_status.return_value = {"status": "not_found"}
+
+    assert pay_late_fees("123456", book_id, gateway) == (True, "Payment successful! OK", "txn_10")
+    gateway.verify_payment_status.assert_called_once_with(idempotency_key=key)
+
+def advance_due_date(loan_id, days):
+    conn = get_db_connection()
+    conn.execute("UPDATE borrow_records SET due_date = datetime(due_date, ?) WHERE id = ?", (f"-{days} days", loan_id))
+    conn.commit()
+
+def test_fee_accrued_after_payment_is_charged_as_difference():
+    book_id, loan_id = overdue_loan()
+    gateway = gateway_returning((True, "txn_11", "OK"), (True, "txn_12", "OK"))
+
+    assert pay_late_fees("123456", book_id, gateway)[2] == "txn_11"
+    advance_due_date(loan_id, 3)
+    assert pay_late_fees("123456", book_id, gateway) == (True, "Payment successful! OK", "txn_12")
+    assert [c.kwargs["amount"] for c in gateway.process_payment.call_args_list] == [6.5, 3.0]
+    assert pay_late_fees("123456", book_id, gateway)[1].startswith("Payment already processed")
+    assert get_payment(payment_idempotency_key("123456", book_id, loan_id, 9.5))["amount"] == 3.0
+
+def test_unknown_payment_settled_before_accrued_fee_is_charged():
+    book_id, loan_id = overdue_loan()
+    first_key = payment_idempotency_key("123456", book_id, loan_id, 6.5)
+    gateway = gateway_returning(TimeoutError("read timed out"), (True, "txn_14", "OK"))
+    gateway.verify_payment_status.return_value = {"status": "completed", "transaction_id": "txn_13"}
+
+    pay_late_fees("123456", book_id, gateway)
+    advance_due_date(loan_id, 3)
+    assert pay_late_fees("123456", book_id, gateway) == (True, "Payment successful! OK", "txn_14")
+    gateway.verify_payment_status.assert_called_once_with(idempotency_key=first_key)
+    assert get_payment(first_key)["status"] == "completed"
+    assert gateway.process_payment.call_args.kwargs["amount"] == 3.0
+
+def test_new_loan_of_same_book_is_a_new_payment():
+    book_id, _ = overdue_loan()
+    gateway = gateway_returning((True, "txn_4", "OK"), (True, "txn_5", "OK"))
+    pay_late_fees("123456", book_id, gateway)
+
+    conn = get_db_connection()
+    conn.execute("UPDATE borrow_records SET return_date = ?", (datetime.now().isoformat(),))
+    conn.commit()
+    now = datetime.now()
+    insert_borrow_record("123456", book_id, now - timedelta(days=20), now - timedelta(days=6))
+
+    assert pay_late_fees("123456", book_id, gateway)[2] == "txn_5"
+    assert conn.execute("SELECT COUNT(*) FROM payments").fetchone()[0] == 2
+
+def test_bulk_payments_deduplicate_through_ledger():
+    import asyncio
+    from unittest.mock import AsyncMock
+    book_id, _ = overdue_loan()
+
+    async def process(patron_id, amount, description="", idempotency_key=None):
+        await asyncio.sleep(0.01)  # second request arrives while the first is in flight
+        return True, "txn_6", "OK"
+    gateway = AsyncMock()
+    gateway.process_payment.side_effect = process
+
+    results = pay_late_fees_bulk([("123456", book_id), ("123456", book_id)], gateway)
+
+    assert results[0] == (True, "Payment successful! OK", "txn_6")
+    assert results[1][0] is False and "in progress" in results[1][1]
+    assert pay_late_fees_bulk([("123456", book_id)], gateway)[0][1] == "Payment already processed. OK"
+    gateway.process_payment.assert_awaited_once()
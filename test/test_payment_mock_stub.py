@@ -1,6 +1,7 @@
 from unittest.mock import Mock
 from services.payment_service import PaymentGateway
 from datetime import datetime, timedelta
+from database import get_db_connection, get_book_by_id, get_book_by_isbn, get_patron_borrow_count, insert_book
 from services.library_service import (
     add_book_to_catalog,
     borrow_book_by_patron,
@@ -196,107 +197,85 @@ def test_add_book_database_insert_failure(mocker):
 
 ## borrow_book
 def test_borrow_book_unavailable_via_stub(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 10, "title": "U", "available_copies": 0, "total_copies": 1})
+    mocker.patch("services.library_service.borrow_book_record",
+                 return_value=("unavailable", {"id": 10, "title": "U", "available_copies": 0, "total_copies": 1}))
     success, msg = borrow_book_by_patron("123456", 10)
     assert success is False and "not available" in msg.lower()
 
 def test_borrow_reaches_limit(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 11, "title": "L", "available_copies": 1, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=5)
+    mocker.patch("services.library_service.borrow_book_record",
+                 return_value=("limit_reached", {"id": 11, "title": "L", "available_copies": 1, "total_copies": 1}))
     success, msg = borrow_book_by_patron("123456", 11)
     assert success is False and "maximum borrowing limit" in msg.lower()
 
 def test_borrow_insert_record_failure(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 12, "title": "I", "available_copies": 1, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=False)
+    mocker.patch("services.library_service.borrow_book_record", return_value=("error", None))
     success, msg = borrow_book_by_patron("123456", 12)
     assert success is False and "creating borrow record" in msg.lower()
 
-def test_borrow_update_availability_failure(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 13, "title": "A", "available_copies": 1, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=False)
-    success, msg = borrow_book_by_patron("123456", 13)
-    assert success is False and "updating book availability" in msg.lower()
+def test_borrow_insert_failure_rolls_back_availability():
+    insert_book("Rollback", "A", "3300000000001", 1, 1)
+    book_id = get_book_by_isbn("3300000000001")["id"]
+    conn = get_db_connection()
+    conn.execute("CREATE TRIGGER fail_borrow BEFORE INSERT ON borrow_records "
+                 "BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+    conn.commit()
+
+    success, msg = borrow_book_by_patron("123456", book_id)
+    assert success is False and "database error" in msg.lower()
+    assert get_book_by_id(book_id)["available_copies"] == 1
 
 def test_borrow_success(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 14, "title": "S", "available_copies": 2, "total_copies": 2})
-    mocker.patch("services.library_service.get_patron_borrow_count", return_value=0)
-    mocker.patch("services.library_service.insert_borrow_record", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.borrow_book_record",
+                 return_value=("ok", {"id": 14, "title": "S", "available_copies": 2, "total_copies": 2}))
     success, msg = borrow_book_by_patron("123456", 14)
     assert success is True and "successfully borrowed" in msg.lower()
 
 ## return_book
 def test_return_no_borrow_stubbed(mocker):
     # Valid book, but no records
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 21, "title": "R", "available_copies": 0, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrowed_books", return_value=[])
+    mocker.patch("services.library_service.return_book_record",
+                 return_value=("no_record", {"id": 21, "title": "R", "available_copies": 0, "total_copies": 1}, None))
     success, msg = return_book_by_patron("123456", 21)
     assert success is False and "no borrow record" in msg.lower()
 
 def test_return_update_record_failure(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 22, "title": "T", "available_copies": 0, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrowed_books",
-                 return_value=[{"book_id": 22, "title": "T"}])
-    mocker.patch("services.library_service.calculate_late_fee_for_book",
-                 return_value={"fee_amount": 0.0, "days_overdue": 0, "status": "OK"})
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=False)
+    mocker.patch("services.library_service.return_book_record", return_value=("error", None, None))
 
     success, msg = return_book_by_patron("123456", 22)
     assert success is False
     assert "recording the return" in msg.lower()
 
-def test_return_update_availability_failure(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 23, "title": "U", "available_copies": 0, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrowed_books",
-                 return_value=[{"book_id": 23, "title": "U"}])
-    mocker.patch("services.library_service.calculate_late_fee_for_book",
-                 return_value={"fee_amount": 0.0, "days_overdue": 0, "status": "OK"})
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=False)
+def test_return_update_failure_keeps_borrow_record_open():
+    insert_book("Rollback", "A", "3300000000002", 1, 1)
+    book_id = get_book_by_isbn("3300000000002")["id"]
+    assert borrow_book_by_patron("123456", book_id)[0] is True
+    conn = get_db_connection()
+    conn.execute("CREATE TRIGGER fail_return BEFORE UPDATE ON books "
+                 "BEGIN SELECT RAISE(ABORT, 'disk full'); END")
+    conn.commit()
 
-    success, msg = return_book_by_patron("123456", 23)
+    success, msg = return_book_by_patron("123456", book_id)
     assert success is False
-    assert "updating book availability" in msg.lower()
+    assert get_patron_borrow_count("123456") == 1
 
 def test_return_update_success(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 24, "title": "N", "available_copies": 0, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrowed_books",
-                 return_value=[{"book_id": 24, "title": "N"}])
-    mocker.patch("services.library_service.calculate_late_fee_for_book",
-                 return_value={"fee_amount": 0.0, "days_overdue": 0, "status": "OK"})
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.return_book_record",
+                 return_value=("ok", {"id": 24, "title": "N", "available_copies": 0, "total_copies": 1},
+                               datetime.now() + timedelta(days=3)))
 
     success, msg = return_book_by_patron("123456", 24)
     assert success is True
     assert "returned on time" in msg.lower()
 
 def test_return_with_late_fee(mocker):
-    mocker.patch("services.library_service.get_book_by_id",
-                 return_value={"id": 25, "title": "L", "available_copies": 0, "total_copies": 1})
-    mocker.patch("services.library_service.get_patron_borrowed_books",
-                 return_value=[{"book_id": 25, "title": "L"}])
-    mocker.patch("services.library_service.calculate_late_fee_for_book",
-                 return_value={"fee_amount": 3.00, "days_overdue": 10, "status": "OK"})
-    mocker.patch("services.library_service.update_borrow_record_return_date", return_value=True)
-    mocker.patch("services.library_service.update_book_availability", return_value=True)
+    mocker.patch("services.library_service.return_book_record",
+                 return_value=("ok", {"id": 25, "title": "L", "available_copies": 0, "total_copies": 1},
+                               datetime.now() - timedelta(days=10)))
 
     success, msg = return_book_by_patron("123456", 25)
     assert success is True
-    assert "your late fee is: $3.00 for 10 overdue day(s)." in msg.lower()
+    assert "your late fee is: $6.50 for 10 overdue day(s)." in msg.lower()
 
 ## calculate_late_fee
 def test_calculate_late_fee_no_fee(mocker):
@@ -320,28 +299,22 @@ def test_calculate_late_fee_with_fee(mocker):
     assert info["fee_amount"] == 6.5
 
 ## search_books
-def test_search_books_found(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[
-        {"id": 41, "title": "Python 101", "author": "A", "isbn": "111", "available_copies": 3, "total_copies": 3},
-        {"id": 42, "title": "Other", "author": "B", "isbn": "222", "available_copies": 1, "total_copies": 1},
-    ])
+def test_search_books_found():
+    insert_book("Python 101", "A", "1110000000001", 3, 3)
+    insert_book("Other", "B", "2220000000002", 1, 1)
     results = search_books_in_catalog("Python", "title")
     assert len(results) == 1
     assert results[0]["title"] == "Python 101"
 
-def test_search_author_positive(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[
-        {"id": 1, "title": "A", "author": "Martin Fowler", "isbn": "111", "available_copies": 1, "total_copies": 1},
-        {"id": 2, "title": "B", "author": "Someone Else", "isbn": "222", "available_copies": 1, "total_copies": 1},
-    ])
+def test_search_author_positive():
+    insert_book("A", "Martin Fowler", "1110000000001", 1, 1)
+    insert_book("B", "Someone Else", "2220000000002", 1, 1)
     results = search_books_in_catalog("fowler", "author")
     assert len(results) == 1 and results[0]["author"] == "Martin Fowler"
 
-def test_search_isbn_exact_positive(mocker):
-    mocker.patch("services.library_service.get_all_books", return_value=[
-        {"id": 1, "title": "A", "author": "B", "isbn": "9780132350884", "available_copies": 1, "total_copies": 1},
-        {"id": 2, "title": "C", "author": "D", "isbn": "1111111111111", "available_copies": 1, "total_copies": 1},
-    ])
+def test_search_isbn_exact_positive():
+    insert_book("A", "B", "9780132350884", 1, 1)
+    insert_book("C", "D", "1111111111111", 1, 1)
     results = search_books_in_catalog("9780132350884", "isbn")
     assert len(results) == 1 and results[0]["id"] == 1
 
@@ -0,0 +1,69 @@
+import logging
+import pytest
+import database
+from database import configure_query_log, get_all_books, get_book_by_id, get_query_stats, insert_book, iter_books
+from query_stats import QueryLog
+
+
+@pytest.fixture
+def query_log():
+    configure_query_log(True, capacity=100, slow_threshold_ms=1000)
+    yield database.query_log
+    configure_query_log(False)
+
+## Query instrumentation
+
+def test_query_log_off_by_default():
+    assert get_query_stats() == {"enabled": False}
+
+def test_statements_recorded_with_caller_and_rows(query_log):
+    for i in range(3):
+        insert_book(f"Timed {i}", "Author", str(9920000000000 + i), 1, 1)
+    query_log.clear()
+
+    assert len(get_all_books()) == 3
+    get_book_by_id(999)
+
+    entries = query_log.entries()
+    assert [e["caller"] for e in entries] == ["database.get_all_books", "database.get_book_by_id"]
+    assert entries[0]["rows"] == 3 and entries[0]["sql"].startswith("SELECT * FROM books")
+    assert entries[1]["rows"] == 0
+    assert all(e["duration"] > 0 for e in entries)
+
+def test_streamed_cursor_counts_every_fetch(query_log):
+    for i in range(5):
+        insert_book(f"Streamed {i}", "Author", str(9921000000000 + i), 1, 1)
+    query_log.clear()
+    assert len(list(iter_books(batch_size=2))) == 5
+    assert [e["rows"] for e in query_log.entries()] == [5]
+
+def test_stats_aggregate_percentiles(query_log):
+    log = QueryLog(capacity=3)
+    for ms in (1, 2, 3, 4):
+        log.record("SELECT  1", ms / 1000, 1, "test.caller")
+    stats = log.stats(recent=2)
+    assert stats["recorded"] == 4 and stats["buffered"] == 3  # ring buffer keeps the newest
+    [statement] = stats["statements"]
+    assert statement["sql"] == "SELECT 1" and statement["count"] == 3
+    assert (statement["p50_ms"], statement["p95_ms"], statement["max_ms"]) == (3.0, 4.0, 4.0)
+    assert [e["duration_ms"] for e in stats["recent"]] == [3.0, 4.0]
+
+def test_slow_queries_logged(caplog):
+    log = QueryLog(slow_threshold=0.01)
+    with caplog.at_level(logging.WARNING, logger="query_stats"):
+        log.record("SELECT slow", 0.02, 0, "test.caller")
+        log.record("SELECT fast", 0.001, 0, "test.caller")
+    assert log.slow == 1
+    assert [r.getMessage() for r in caplog.records] == ["Slow query (20.0 ms, 0 rows) in test.caller: SELECT slow"]
+
+def test_debug_queries_endpoint():
+    from app import create_app
+    client = create_app({"SQL_QUERY_LOG": True, "SQL_SLOW_QUERY_MS": 500}).test_client()
+    try:
+        client.get("/api/catalog")
+        stats = client.get("/api/debug/queries?recent=5").get_json()
+        assert stats["enabled"] is True and stats["slow_threshold_ms"] == 500
+        assert any(c["caller"] == "database.get_all_books" for c in stats["callers"])
+        assert len(stats["recent"]) == 5
+    finally:
+        configure_query_log(False)
@@ -0,0 +1,459 @@
+import json
+import sqlite3
+from array import array
+
+import database
+from database import get_db_connection, insert_book, update_book_availability
+from services import library_service, search_cache, search_index
+from services.library_service import (
+    search_books_in_catalog, search_books_page, stream_search_results, suggest_search_terms
+)
+
+
+def titles(results):
+    return [b["title"] for b in results]
+
+## Full-text search
+
+def test_search_matches_substring_inside_word():
+    insert_book("The Great Gatsby", "F. Scott Fitzgerald", "6100000000001", 1, 1)
+    assert titles(search_books_in_catalog("atsb", "title")) == ["The Great Gatsby"]
+    assert titles(search_books_in_catalog("SCOTT fitz", "author")) == ["The Great Gatsby"]
+
+def test_search_short_term_falls_back_to_scan():
+    insert_book("Go in Action", "Kennedy", "6100000000002", 1, 1)
+    insert_book("Rust", "Klabnik", "6100000000003", 1, 1)
+    assert titles(search_books_in_catalog("go", "title")) == ["Go in Action"]
+    assert search_books_in_catalog("%", "title") == []
+
+def test_search_short_term_ignores_non_ascii_case():
+    insert_book("Émaux et camées", "Théophile Gautier", "6100000000201", 1, 1)
+    insert_book("Ödön", "Ágota", "6100000000202", 1, 1)
+    assert titles(search_books_in_catalog("é", "title")) == ["Émaux et camées"]
+    assert titles(search_books_in_catalog("ÉM", "title")) == ["Émaux et camées"]
+    assert titles(search_books_in_catalog("öd", "title")) == ["Ödön"]
+    assert titles(search_books_in_catalog("á", "author")) == ["Ödön"]
+
+def test_search_ranks_closer_matches_first():
+    insert_book("Notes on Python packaging and the wider tooling ecosystem", "A", "6100000000004", 1, 1)
+    insert_book("Python", "B", "6100000000005", 1, 1)
+    assert titles(search_books_in_catalog("python", "title"))[0] == "Python"
+
+def test_search_term_with_quotes_is_literal():
+    insert_book('The "Quoted" Title', "A", "6100000000006", 1, 1)
+    assert titles(search_books_in_catalog('"quoted"', "title")) == ['The "Quoted" Title']
+    assert search_books_in_catalog('OR "', "title") == []
+
+def test_search_index_follows_title_updates():
+    insert_book("Old Name", "A", "6100000000007", 1, 1)
+    conn = get_db_connection()
+    conn.execute("UPDATE books SET title = 'New Name' WHERE isbn = '6100000000007'")
+    conn.commit()
+    assert search_books_in_catalog("old name", "title") == []
+    assert titles(search_books_in_catalog("new name", "title")) == ["New Name"]
+
+def test_search_migration_indexes_existing_books():
+    insert_book("Existing Book", "A", "6100000000008", 1, 1)
+    conn = get_db_connection()
+    for trigger in ("books_fts_insert", "books_fts_delete", "books_fts_update"):
+        conn.execute(f"DROP TRIGGER {trigger}")
+    conn.execute("DROP TABLE books_fts")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+
+    database.migrate_database()
+    assert titles(search_books_in_catalog("existing", "title")) == ["Existing Book"]
+
+## In-memory trigram index
+
+def test_index_matches_fts_results():
+    insert_book("The Great Gatsby", "F. Scott Fitzgerald", "6100000000011", 1, 1)
+    insert_book("Gatsby Revisited", "Scott Free", "6100000000012", 1, 1)
+    insert_book("Python", "Guido", "6100000000013", 1, 1)
+    for term, field in (("gatsby", "title"), ("SCOTT", "author"), ("at", "title"), ("zzz", "title")):
+        assert titles(search_books_in_catalog(term, field)) == titles(database.search_books(term, field))
+
+def test_index_posting_lists_are_arrays():
+    insert_book("Python", "Guido", "6100000000014", 1, 1)
+    index = search_index.get_search_index()
+    index.sync()
+    postings = index._postings["title"]["pyt"]
+    assert isinstance(postings, array) and list(postings) == [1]
+    assert index.stats()["books"] == 1
+
+def test_index_reads_only_candidate_rows():
+    insert_book("Dune", "Herbert", "6100000000015", 1, 1)
+    insert_book("Emma", "Austen", "6100000000016", 1, 1)
+    index = search_index.get_search_index()
+    assert titles(search_books_in_catalog("dun", "title")) == ["Dune"]
+    assert index.stats()["candidates"] == 1
+
+def test_index_follows_inserts_edits_and_deletes():
+    insert_book("First Book", "A", "6100000000017", 1, 1)
+    assert titles(search_books_in_catalog("book", "title")) == ["First Book"]
+
+    insert_book("Second Book", "B", "6100000000018", 1, 1)
+    conn = get_db_connection()
+    conn.execute("UPDATE books SET title = 'Renamed' WHERE isbn = '6100000000017'")
+    conn.commit()
+    assert titles(search_books_in_catalog("book", "title")) == ["Second Book"]
+    assert titles(search_books_in_catalog("renamed", "title")) == ["Renamed"]
+
+    conn.execute("DELETE FROM books WHERE isbn = '6100000000018'")
+    conn.commit()
+    assert search_books_in_catalog("book", "title") == []
+    assert search_index.get_search_index().stats()["builds"] == 1
+
+def test_index_sees_writes_from_other_connections():
+    insert_book("Local", "A", "6100000000019", 1, 1)
+    assert search_books_in_catalog("remote", "title") == []
+    other = sqlite3.connect(database.DATABASE)
+    other.execute("INSERT INTO books (title, author, isbn, total_copies, available_copies) "
+                  "VALUES ('Remote Book', 'B', '6100000000020', 1, 1)")
+    other.commit()
+    other.close()
+    assert titles(search_books_in_catalog("remote", "title")) == ["Remote Book"]
+
+def test_index_prunes_edit_log(mocker):
+    mocker.patch("services.search_index.EDIT_LOG_KEEP", 2)
+    mocker.patch("services.search_index.EDIT_LOG_PRUNE_BATCH", 1)
+    insert_book("Draft 0", "A", "6100000000022", 1, 1)
+    conn = get_db_connection()
+    for i in range(1, 6):
+        conn.execute("UPDATE books SET title = ? WHERE isbn = '6100000000022'", (f"Draft {i}",))
+        conn.commit()
+        assert titles(search_books_in_catalog("draft", "title")) == [f"Draft {i}"]
+    assert conn.execute("SELECT COUNT(*) FROM book_edits").fetchone()[0] <= 3
+    assert database.get_book_text_marks()[1] == 5
+
+def test_index_behind_pruned_edit_log_rebuilds(mocker):
+    mocker.patch("services.search_index.EDIT_LOG_KEEP", 0)
+    mocker.patch("services.search_index.EDIT_LOG_PRUNE_BATCH", 1)
+    insert_book("Before", "A", "6100000000023", 1, 1)
+    lagging = search_index.TrigramIndex()  # as in another process
+    assert titles(lagging.search("before", "title")) == ["Before"]
+
+    conn = get_db_connection()
+    conn.execute("UPDATE books SET title = 'After' WHERE isbn = '6100000000023'")
+    conn.commit()
+    assert titles(search_books_in_catalog("after", "title")) == ["After"]
+    assert conn.execute("SELECT COUNT(*) FROM book_edits").fetchone()[0] == 0
+
+    assert lagging.search("before", "title") == []
+    assert titles(lagging.search("after", "title")) == ["After"] and lagging.stats()["builds"] == 2
+
+def test_index_returns_current_availability():
+    insert_book("Borrowable", "A", "6100000000021", 2, 2)
+    assert search_books_in_catalog("borrow", "title")[0]["available_copies"] == 2
+    database.update_book_availability(1, -1)
+    assert search_books_in_catalog("borrow", "title")[0]["available_copies"] == 1
+
+def test_index_can_be_turned_off(mocker):
+    insert_book("Searchable", "A", "6100000000022", 1, 1)
+    mocker.patch("services.search_index.ENABLED", False)
+    index_search = mocker.patch("services.search_index.search")
+    assert titles(search_books_in_catalog("search", "title")) == ["Searchable"]
+    index_search.assert_not_called()
+
+## Type-ahead suggestions
+
+def test_suggest_prefix_then_word_matches():
+    insert_book("The Great Gatsby", "F. Scott Fitzgerald", "6100000000031", 1, 1)
+    insert_book("Great Expectations", "Charles Dickens", "6100000000032", 1, 1)
+    insert_book("great expectations", "Charles Dickens", "6100000000033", 1, 1)
+    assert suggest_search_terms("GRE", "title") == [
+        {"value": "Great Expectations", "books": 2},
+        {"value": "The Great Gatsby", "books": 1},
+    ]
+    assert suggest_search_terms("dick", "author") == [{"value": "Charles Dickens", "books": 2}]
+    assert suggest_search_terms("gre", "title", limit=1) == [{"value": "Great Expectations", "books": 2}]
+
+def test_suggest_rejects_isbn_and_blank_prefix():
+    insert_book("Isbn Lookup", "A", "6100000000034", 1, 1)
+    assert suggest_search_terms("610", "isbn") == []
+    assert suggest_search_terms("   ", "title") == []
+    assert suggest_search_terms(None, "title") == []
+
+def test_suggest_follows_inserts_and_edits():
+    insert_book("Alpha", "A", "6100000000035", 1, 1)
+    assert suggest_search_terms("al", "title") == [{"value": "Alpha", "books": 1}]
+    insert_book("Almanac", "A", "6100000000036", 1, 1)
+    conn = get_db_connection()
+    conn.execute("UPDATE books SET title = 'Beta' WHERE isbn = '6100000000035'")
+    conn.commit()
+    assert suggest_search_terms("al", "title") == [{"value": "Almanac", "books": 1}]
+    assert suggest_search_terms("be", "title") == [{"value": "Beta", "books": 1}]
+
+def test_prefix_index_merges_runs():
+    index = search_index.PrefixIndex()
+    for i in range(search_index.PENDING_LIMIT * 3):
+        index.add(f"Book {i:04d}")
+        index.compact()
+    index.remove("Book 0001")
+    stats = index.stats()
+    assert len(stats["runs"]) <= 3 and stats["pending"] < search_index.PENDING_LIMIT
+    assert [s["value"] for s in index.suggest("book 000", 3)] == ["Book 0000", "Book 0002", "Book 0003"]
+
+def test_suggest_endpoint():
+    from app import create_app
+    client = create_app().test_client()
+    insert_book("Dune Messiah", "Frank Herbert", "6100000000037", 1, 1)
+
+    response = client.get("/api/suggest?q=dun&type=title")
+    assert response.status_code == 200
+    assert response.get_json()["suggestions"] == [{"value": "Dune Messiah", "books": 1}]
+    assert client.get("/api/suggest?q=her&type=author").get_json()["suggestions"][0]["value"] == "Frank Herbert"
+    assert client.get("/api/suggest?q=").get_json()["suggestions"] == []
+    assert client.get("/api/suggest?q=x&type=isbn").status_code == 400
+    assert client.get("/api/suggest?q=x&limit=0").status_code == 400
+
+## Fuzzy search
+
+def test_bounded_levenshtein():
+    assert search_index.bounded_levenshtein("orwel", "orwell", 1) == 1
+    assert search_index.bounded_levenshtein("fitzgerld", "fitzgerald", 2) == 1
+    assert search_index.bounded_levenshtein("kitten", "sitting", 2) is None
+    assert search_index.bounded_levenshtein("kitten", "sitting", 3) == 3
+
+def test_fuzzy_search_tolerates_typos():
+    insert_book("1984", "George Orwell", "6100000000041", 1, 1)
+    insert_book("The Great Gatsby", "F. Scott Fitzgerald", "6100000000042", 1, 1)
+    results = search_books_in_catalog("Fitzgerld", "author", fuzzy=True)
+    assert titles(results) == ["The Great Gatsby"] and results[0]["match_distance"] == 1
+    assert titles(search_books_in_catalog("geroge orwel", "author", fuzzy=True)) == ["1984"]
+    assert search_books_in_catalog("Fitzgerld", "author") == []
+
+def test_fuzzy_search_ranks_exact_then_by_distance():
+    insert_book("Gatsby", "A", "6100000000043", 1, 1)
+    insert_book("Gadsby", "B", "6100000000044", 1, 1)
+    insert_book("Gatsbee", "C", "6100000000045", 1, 1)
+    results = search_books_in_catalog("gatsby", "title", fuzzy=True)
+    assert [(b["title"], b["match_distance"]) for b in results] == [("Gatsby", 0), ("Gadsby", 1), ("Gatsbee", 2)]
+
+def test_fuzzy_search_bounds_edits_by_word_length():
+    insert_book("Cat", "A", "6100000000046", 1, 1)
+    insert_book("Dune", "B", "6100000000047", 1, 1)
+    # Two-letter words must match exactly; 3-5 letters allow one edit
+    assert search_books_in_catalog("ca", "title", fuzzy=True)[0]["match_distance"] == 0
+    assert titles(search_books_in_catalog("dume", "title", fuzzy=True)) == ["Dune"]
+    assert search_books_in_catalog("dxmx", "title", fuzzy=True) == []
+
+def test_fuzzy_search_follows_edits():
+    insert_book("Mockingbird", "Harper Lee", "6100000000048", 1, 1)
+    assert titles(search_books_in_catalog("mokingbird", "title", fuzzy=True)) == ["Mockingbird"]
+    conn = get_db_connection()
+    conn.execute("UPDATE books SET title = 'Renamed' WHERE isbn = '6100000000048'")
+    conn.commit()
+    assert search_books_in_catalog("mokingbird", "title", fuzzy=True) == []
+
+def test_fuzzy_search_endpoints():
+    from app import create_app
+    client = create_app().test_client()
+    insert_book("Brave New World", "Aldous Huxley", "6100000000049", 1, 1)
+
+    data = client.get("/api/search?q=huxly&type=author&fuzzy=true").get_json()
+    assert data["fuzzy"] is True and data["results"][0]["match_distance"] == 1
+    assert client.get("/api/search?q=huxly&type=author").get_json()["count"] == 0
+    page = client.get("/search?q=huxly&type=author&fuzzy=1").get_data(as_text=True)
+    assert "Brave New World" in page and "close match" in page
+
+## Result cache
+
+def test_search_cache_reuses_results(mocker):
+    insert_book("Dune", "Frank Herbert", "6100000000051", 2, 2)
+    before = search_cache.get_search_cache_stats()
+    spy = mocker.spy(search_index, "search")
+    assert titles(search_books_in_catalog("dune", "title")) == ["Dune"]
+    assert titles(search_books_in_catalog("DUNE", "title")) == ["Dune"]
+    assert spy.call_count == 1
+    stats = search_cache.get_search_cache_stats()
+    assert stats["hits"] == before["hits"] + 1 and stats["misses"] == before["misses"] + 1
+
+def test_search_cache_hits_are_copies():
+    insert_book("Dune", "Frank Herbert", "6100000000052", 2, 2)
+    search_books_in_catalog("dune", "title")[0]["title"] = "Changed"
+    assert titles(search_books_in_catalog("dune", "title")) == ["Dune"]
+
+def test_search_cache_invalidated_by_catalog_writes():
+    insert_book("Dune", "Frank Herbert", "6100000000053", 2, 2)
+    book = search_books_in_catalog("dune", "title")[0]
+    assert book["available_copies"] == 2
+    update_book_availability(book["id"], -1)
+    assert search_books_in_catalog("dune", "title")[0]["available_copies"] == 1
+    insert_book("Dune Messiah", "Frank Herbert", "6100000000054", 1, 1)
+    assert titles(search_books_in_catalog("dune", "title")) == ["Dune", "Dune Messiah"]
+
+def test_search_cache_sees_edits_from_other_connections():
+    insert_book("Dune", "Frank Herbert", "6100000000055", 1, 1)
+    assert titles(search_books_in_catalog("dune", "title")) == ["Dune"]
+    conn = sqlite3.connect(database.DATABASE)
+    conn.execute("UPDATE books SET title = 'Arrakis' WHERE isbn = '6100000000055'")
+    conn.commit()
+    conn.close()
+    assert search_books_in_catalog("dune", "title") == []
+
+def test_search_cache_stale_mode_serves_old_availability(mocker):
+    mocker.patch.object(search_cache.search_cache, "stale_seconds", 30.0)
+    insert_book("Dune", "Frank Herbert", "6100000000056", 2, 2)
+    book = search_books_in_catalog("dune", "title")[0]
+    update_book_availability(book["id"], -1)
+    assert search_books_in_catalog("dune", "title")[0]["available_copies"] == 2
+    assert search_cache.get_search_cache_stats()["stale_hits"] >= 1
+    # Title changes are never served stale
+    insert_book("Dune Messiah", "Frank Herbert", "6100000000057", 1, 1)
+    assert len(search_books_in_catalog("dune", "title")) == 2
+
+def test_search_cache_skips_large_results(mocker):
+    mocker.patch.object(search_cache.search_cache, "max_results", 1)
+    insert_book("Dune", "Frank Herbert", "6100000000058", 1, 1)
+    insert_book("Dune Messiah", "Frank Herbert", "6100000000059", 1, 1)
+    too_large = search_cache.get_search_cache_stats()["too_large"]
+    search_books_in_catalog("dune", "title")
+    assert search_cache.get_search_cache_stats()["too_large"] == too_large + 1
+
+def test_search_cache_can_be_turned_off(mocker):
+    from app import create_app
+    create_app({"SEARCH_CACHE": False})
+    try:
+        insert_book("Dune", "Frank Herbert", "6100000000060", 1, 1)
+        spy = mocker.spy(search_index, "search")
+        search_books_in_catalog("dune", "title")
+        search_books_in_catalog("dune", "title")
+        assert spy.call_count == 2
+    finally:
+        create_app()
+
+def test_search_cache_stats_endpoint():
+    from app import create_app
+    client = create_app({"SEARCH_CACHE_SIZE": 64, "SEARCH_CACHE_STALE_SECONDS": 5}).test_client()
+    try:
+        insert_book("Dune", "Frank Herbert", "6100000000061", 1, 1)
+        client.get("/api/search?q=dune&type=title")
+        client.get("/api/search?q=dune&type=title")
+        stats = client.get("/api/debug/search_cache").get_json()
+        assert stats["enabled"] is True and stats["maxsize"] == 64 and stats["stale_seconds"] == 5
+        assert stats["hits"] >= 1 and 0 < stats["hit_rate"] <= 1
+    finally:
+        create_app()
+
+## Paged search
+
+def add_dune_books(count):
+    for i in range(count):
+        insert_book(f"Dune {i}", "Frank Herbert", f"61000000001{i:02d}", 1, 1)
+
+def test_search_page_walks_ranked_results():
+    add_dune_books(5)
+    first = search_books_page("dune", "title", limit=2)
+    assert first["order"] == "relevance" and first["total"] == 5 and first["total_exact"]
+    second = search_books_page("dune", "title", limit=2, cursor=first["next_cursor"])
+    third = search_books_page("dune", "title", limit=2, cursor=second["next_cursor"])
+    assert third["next_cursor"] is None
+    paged = titles(first["books"] + second["books"] + third["books"])
+    assert paged == titles(search_books_in_catalog("dune", "title"))
+
+def test_search_page_lists_broad_searches_by_title(mocker):
+    mocker.patch("services.library_service.SEARCH_RANK_LIMIT", 3)
+    mocker.patch("services.library_service.SEARCH_ESTIMATE_SAMPLE", 2)
+    add_dune_books(6)
+    insert_book("Emma", "Jane Austen", "6100000000199", 1, 1)
+    first = search_books_page("dune", "title", limit=4)
+    assert first["order"] == "title" and titles(first["books"]) == ["Dune 0", "Dune 1", "Dune 2", "Dune 3"]
+    assert not first["total_exact"] and 0 < first["total"] <= 6
+    rest = search_books_page("dune", "title", limit=4, cursor=first["next_cursor"])
+    assert titles(rest["books"]) == ["Dune 4", "Dune 5"] and rest["next_cursor"] is None
+
+def test_search_page_short_terms_use_title_order():
+    add_dune_books(3)
+    page = search_books_page("du", "title", limit=10, fuzzy=True)
+    assert page["order"] == "title" and page["total"] == 3 and page["total_exact"]
+    assert [book["match_distance"] for book in page["books"]] == [0, 0, 0]
+
+def test_search_page_estimates_total_from_sample(mocker):
+    mocker.patch("services.library_service.SEARCH_ESTIMATE_SAMPLE", 2)
+    add_dune_books(4)
+    insert_book("Emma", "Jane Austen", "6100000000199", 1, 1)
+    insert_book("Persuasion", "Jane Austen", "6100000000198", 1, 1)
+    page = search_books_page("u", "title", limit=1)
+    assert page["total_exact"] is False and page["total"] > 0
+
+def test_search_page_scan_limit_returns_partial_pages(mocker):
+    mocker.patch("services.library_service.SEARCH_SCAN_LIMIT", 3)
+    for i in range(5):
+        insert_book(f"Aardvark {i}", "Anon", f"61000000003{i:02d}", 1, 1)
+    insert_book("Aardvark Dune", "Anon", "6100000000399", 1, 1)
+    first = search_books_page("du", "title", limit=10)
+    assert first["books"] == [] and first["next_cursor"]
+
+    found, cursor = [], first["next_cursor"]
+    while cursor:
+        page = search_books_page("du", "title", limit=10, cursor=cursor)
+        found += titles(page["books"])
+        cursor = page["next_cursor"]
+    assert found == sorted(titles(search_books_in_catalog("du", "title")))
+
+def test_search_page_bounds_broad_searches_without_index(mocker):
+    mocker.patch("services.search_index.ENABLED", False)
+    mocker.patch("services.library_service.SEARCH_RANK_LIMIT", 3)
+    ranked = mocker.spy(library_service, "search_books")
+    add_dune_books(6)
+    first = search_books_page("dune", "title", limit=4)
+    assert first["order"] == "title" and titles(first["books"]) == ["Dune 0", "Dune 1", "Dune 2", "Dune 3"]
+    rest = search_books_page("dune", "title", limit=4, cursor=first["next_cursor"])
+    assert titles(rest["books"]) == ["Dune 4", "Dune 5"] and rest["next_cursor"] is None
+    ranked.assert_not_called()
+
+    mocker.patch("services.library_service.SEARCH_RANK_LIMIT", 10)
+    assert search_books_page("dune", "title", limit=4)["order"] == "relevance"
+
+def test_search_page_ranks_exact_matches_when_typos_are_too_many(mocker):
+    insert_book("Dune", "Frank Herbert", "6100000000301", 1, 1)
+    for i in range(3):
+        insert_book(f"Dume {i}", "Anon", f"61000000003{i + 10}", 1, 1)
+    assert len(search_books_page("dune", "title", fuzzy=True)["books"]) == 4
+
+    mocker.patch("services.library_service.SEARCH_RANK_LIMIT", 2)
+    page = search_books_page("dune", "title", fuzzy=True)
+    assert page["order"] == "relevance" and titles(page["books"]) == ["Dune"]
+    assert page["books"][0]["match_distance"] == 0
+
+def test_search_page_rejects_bad_cursors():
+    add_dune_books(3)
+    broad = search_books_page("du", "title", limit=1)["next_cursor"]
+    for cursor in ("not-a-cursor", broad):
+        try:
+            search_books_page("dune", "title", limit=1, cursor=cursor)
+        except ValueError as e:
+            assert str(e) == "Invalid cursor."
+        else:
+            raise AssertionError(f"{cursor} was accepted")
+
+def test_stream_search_results_pages_through_all():
+    add_dune_books(5)
+    summary, lines = stream_search_results("dune", "title", limit=4)
+    assert summary == {"total": 5, "total_exact": True, "order": "relevance"}
+    rows = [json.loads(line) for line in lines]
+    assert len(rows) == 5 and rows[-1]["next_cursor"]
+    assert len(search_books_page("dune", "title", cursor=rows[-1]["next_cursor"])["books"]) == 1
+
+def test_search_api_pagination_and_ndjson():
+    from app import create_app
+    client = create_app().test_client()
+    add_dune_books(3)
+
+    data = client.get("/api/search?q=dune&type=title&limit=2").get_json()
+    assert data["count"] == 2 and data["total"] == 3 and data["total_exact"] is True and data["limit"] == 2
+    data = client.get(f"/api/search?q=dune&type=title&limit=2&cursor={data['next_cursor']}").get_json()
+    assert data["count"] == 1 and data["next_cursor"] is None
+
+    response = client.get("/api/search?q=dune&type=title&format=ndjson")
+    assert response.mimetype == "application/x-ndjson" and response.headers["X-Total-Count"] == "3"
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [row.get("title") for row in rows[:3]] == ["Dune 0", "Dune 1", "Dune 2"]
+    assert rows[-1] == {"next_cursor": None}
+
+    assert client.get("/api/search?q=dune&limit=0").status_code == 400
+    assert client.get("/api/search?q=dune&limit=201").status_code == 400
+    assert client.get("/api/search?q=dune&limit=5000&format=ndjson").status_code == 200
+    assert client.get("/api/search?q=dune&format=xml").status_code == 400
+    assert client.get("/api/search?q=dune&cursor=bogus").status_code == 400